@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# In-cluster Prometheus with kube-state-metrics and cAdvisor; empty disables allocation
+PROMETHEUS_URL = os.environ.get('PROMETHEUS_URL', '')
+PROMETHEUS_TIMEOUT = float(os.environ.get('PROMETHEUS_TIMEOUT', 10))
+CLUSTER_NAME = os.environ.get('CLUSTER_NAME', 'amazon-cluster')
+# Window CPU usage is averaged over
+USAGE_WINDOW = os.environ.get('ALLOCATION_USAGE_WINDOW', '1h')
+# Price of one vCPU relative to one GiB of memory, used to split a node's cost between the two
+# (about 7.6:1 in the EC2 general-purpose families)
+CPU_GIB_PRICE_RATIO = float(os.environ.get('ALLOCATION_CPU_GIB_RATIO', 7.6))
+
+# Node capacity no pod requested or used; reported as its own namespace so shares add up to the bill
+IDLE = '__idle__'
+GIB = float(1 << 30)
+
+QUERIES = {
+    'pods': 'kube_pod_info{node!=""}',
+    'owners': 'kube_pod_owner',
+    'requests': 'sum by (namespace, pod, resource) (kube_pod_container_resource_requests{resource=~"cpu|memory"})',
+    'cpu_usage': f'sum by (namespace, pod) (rate(container_cpu_usage_seconds_total{{container!="", image!=""}}[{USAGE_WINDOW}]))',
+    'memory_usage': 'sum by (namespace, pod) (container_memory_working_set_bytes{container!="", image!=""})',
+    'allocatable': 'kube_node_status_allocatable{resource=~"cpu|memory"}',
+}
+
+# ReplicaSets carry the Deployment's pod-template hash, Jobs a CronJob's schedule timestamp
+GENERATED_SUFFIX = {
+    'ReplicaSet': ('Deployment', re.compile(r'-[a-z0-9]{5,10}$')),
+    'Job': ('CronJob', re.compile(r'-\d{8,}$')),
+}
+
+Allocation = namedtuple('Allocation', ['namespaces', 'workloads', 'idle', 'total', 'pods', 'nodes'])
+
+
+class PrometheusClient:
+    """Instant queries against the Prometheus HTTP API, with only the standard library."""
+
+    def __init__(self, url, timeout=PROMETHEUS_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def query(self, promql):
+        """Returns [(labels, value)] for an instant vector query."""
+        with urlopen(f"{self.url}/api/v1/query?{urlencode({'query': promql})}", timeout=self.timeout) as response:
+            body = json.load(response)
+        if body.get('status') != 'success':
+            raise RuntimeError(f"Prometheus query failed: {body.get('error', body)}")
+        return [(r['metric'], float(r['value'][1])) for r in body['data']['result']]
+
+
+def workload_name(kind, name):
+    """'Kind/name' of the Deployment / CronJob behind a pod's ReplicaSet / Job owner; other owners as they are."""
+    if kind in GENERATED_SUFFIX:
+        parent, pattern = GENERATED_SUFFIX[kind]
+        if pattern.search(name):
+            return f"{parent}/{pattern.sub('', name)}"
+    return f"{kind}/{name}"
+
+
+class PodMatrix:
+    """
+    Every scheduled pod as one row of parallel NumPy arrays (node index, requests, usage),
+    plus per-node allocatable capacity, built from the Prometheus query results.
+    """
+
+    def __init__(self, results):
+        nodes = {}
+        for labels, value in results['allocatable']:
+            nodes.setdefault(labels['node'], {})[labels['resource']] = value
+        self.node_names = sorted(nodes)
+        node_index = {n: i for i, n in enumerate(self.node_names)}
+        self.node_cpu = np.array([nodes[n].get('cpu', 0.0) for n in self.node_names])
+        self.node_mem = np.array([nodes[n].get('memory', 0.0) for n in self.node_names]) / GIB
+
+        owners = {(l['namespace'], l['pod']): (l.get('owner_kind', ''), l.get('owner_name', ''))
+                  for l, _ in results['owners'] if l.get('owner_kind') not in (None, '', '<none>')}
+        # One row per pod even if kube-state-metrics briefly reports a rescheduled pod twice
+        placed = {(l['namespace'], l['pod']): l['node'] for l, _ in results['pods'] if l['node'] in node_index}
+        pods = [(ns, pod, node) for (ns, pod), node in placed.items()]
+        index = {(ns, pod): i for i, (ns, pod, _) in enumerate(pods)}
+
+        self.namespaces = np.array([ns for ns, _, _ in pods], dtype=object)
+        self.workloads = np.array([
+            workload_name(*owners[(ns, pod)]) if (ns, pod) in owners else f"Pod/{pod}"
+            for ns, pod, _ in pods
+        ], dtype=object)
+        self.node = np.array([node_index[node] for _, _, node in pods], dtype=np.int64)
+
+        def column(rows, scale=1.0, resource=None):
+            values = np.zeros(len(pods))
+            for labels, value in rows:
+                if resource and labels.get('resource') != resource:
+                    continue
+                i = index.get((labels.get('namespace'), labels.get('pod')))
+                if i is not None:
+                    values[i] += value / scale
+            return values
+
+        self.req_cpu = column(results['requests'], resource='cpu')
+        self.req_mem = column(results['requests'], GIB, resource='memory')
+        self.use_cpu = column(results['cpu_usage'])
+        self.use_mem = column(results['memory_usage'], GIB)
+
+    def __len__(self):
+        return len(self.node)
+
+
+def allocate(matrix, cluster_cost, cpu_gib_ratio=CPU_GIB_PRICE_RATIO):
+    """
+    Splits one day's cluster cost over namespaces and workloads.
+
+    Each node's share of the cost follows its capacity, priced at cpu_gib_ratio per vCPU
+    against each GiB, and is split into a CPU and a memory part the same way. A pod pays
+    for max(request, usage) of each resource. When a node's pods together claim more than
+    it has, they share it pro rata. What nobody claimed is the node's idle cost.
+    """
+    n = len(matrix.node_names)
+    cpu_value = matrix.node_cpu * cpu_gib_ratio
+    node_value = cpu_value + matrix.node_mem
+    node_cost = cluster_cost * node_value / node_value.sum() if node_value.sum() else np.zeros(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cpu_cost = np.where(node_value > 0, node_cost * cpu_value / node_value, 0.0)
+    mem_cost = node_cost - cpu_cost
+
+    eff_cpu = np.maximum(matrix.req_cpu, matrix.use_cpu)
+    eff_mem = np.maximum(matrix.req_mem, matrix.use_mem)
+    # Per-node sums of the pod-by-node matrix, one bincount per column instead of a dense P x N product
+    claimed_cpu = np.bincount(matrix.node, weights=eff_cpu, minlength=n)
+    claimed_mem = np.bincount(matrix.node, weights=eff_mem, minlength=n)
+    cpu_rate = cpu_cost / np.maximum(np.maximum(matrix.node_cpu, claimed_cpu), 1e-9)
+    mem_rate = mem_cost / np.maximum(np.maximum(matrix.node_mem, claimed_mem), 1e-9)
+
+    pod_cost = eff_cpu * cpu_rate[matrix.node] + eff_mem * mem_rate[matrix.node]
+    idle = float(node_cost.sum() - pod_cost.sum())
+
+    namespaces = _sum_by(matrix.namespaces, pod_cost)
+    if idle > 0:
+        namespaces[IDLE] = idle
+    workload_keys = np.array([f"{ns}\0{w}" for ns, w in zip(matrix.namespaces, matrix.workloads)], dtype=object)
+    workloads = {tuple(k.split('\0')): v for k, v in _sum_by(workload_keys, pod_cost).items()}
+    return Allocation(namespaces, workloads, idle, float(cluster_cost), len(matrix), n)
+
+
+def _sum_by(keys, values):
+    if not len(keys):
+        return {}
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return dict(zip(unique.tolist(), np.bincount(inverse, weights=values).tolist()))
+
+
+class CostAllocator:
+    """Pulls pod requests and usage from Prometheus and allocates the cluster's daily EC2/EBS cost with them."""
+
+    def __init__(self, prometheus, cluster=CLUSTER_NAME):
+        self.prometheus = prometheus
+        self.cluster = cluster
+
+    def matrix(self):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(QUERIES)) as pool:
+            results = dict(zip(QUERIES, pool.map(self.prometheus.query, QUERIES.values())))
+        matrix = PodMatrix(results)
+        logger.info(f"Pod matrix: {len(matrix)} pods on {len(matrix.node_names)} nodes "
+                    f"({time.perf_counter() - started:.2f}s)")
+        return matrix
+
+    def run(self, cluster_cost):
+        return allocate(self.matrix(), cluster_cost)
+
+
+def allocator_from_env():
+    return CostAllocator(PrometheusClient(PROMETHEUS_URL)) if PROMETHEUS_URL else None
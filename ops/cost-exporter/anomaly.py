@@ -0,0 +1,166 @@
+import logging
+import math
+import os
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# Days of history kept per service: SEASONS past values for each day of the week
+SEASON_DAYS = 7
+SEASONS = int(os.environ.get('ANOMALY_SEASONS', 8))
+# Smoothing of the trend baseline; 0.2 weighs roughly the last week and a half
+EWMA_ALPHA = float(os.environ.get('ANOMALY_EWMA_ALPHA', 0.2))
+# Score (robust standard deviations above baseline) at which a day is flagged
+THRESHOLD = float(os.environ.get('ANOMALY_THRESHOLD', 4.0))
+# Dollars above baseline a day must also exceed, so cent-sized services never page anyone
+MIN_DELTA = float(os.environ.get('ANOMALY_MIN_DELTA', 5.0))
+# Same-weekday values needed before the seasonal baseline is trusted over the EWMA alone
+MIN_SEASONS = int(os.environ.get('ANOMALY_MIN_SEASONS', 3))
+
+# MAD of a normal distribution is 0.6745 sigma; scale it so scores read as standard deviations
+MAD_SCALE = 1.4826
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2.0
+
+
+class Verdict:
+    __slots__ = ('day', 'amount', 'expected', 'score', 'anomalous')
+
+    def __init__(self, day, amount, expected, score, anomalous):
+        self.day = day
+        self.amount = amount
+        self.expected = expected
+        self.score = score
+        self.anomalous = anomalous
+
+
+class ServiceWindow:
+    """
+    Rolling daily costs of one service in a fixed-size ring buffer, plus EWMA mean and
+    variance. Scoring a day reads SEASONS same-weekday slots and updates the EWMA, so
+    it costs the same however long the service has been tracked.
+    """
+
+    __slots__ = ('ring', 'filled', 'pos', 'last_day', 'mean', 'var', '_undo', 'verdict')
+
+    def __init__(self, size=SEASON_DAYS * SEASONS):
+        self.ring = [0.0] * size
+        self.filled = 0
+        self.pos = 0
+        self.last_day = None
+        self.mean = None
+        self.var = 0.0
+        # (mean, var, filled) before the latest push, so a revised latest day can be re-scored
+        self._undo = None
+        self.verdict = None
+
+    def _seasonal(self):
+        """Same-weekday values from earlier weeks still in the buffer, newest first."""
+        size = len(self.ring)
+        weeks = min(self.filled, size) // SEASON_DAYS
+        # pos holds the day before the one being scored, so k weeks back is k * 7 - 1 slots behind it
+        return [self.ring[(self.pos + 1 - k * SEASON_DAYS) % size] for k in range(1, weeks + 1)]
+
+    def _score(self, day, amount):
+        scores, baselines = [], []
+        seasonal = self._seasonal()
+        if len(seasonal) >= MIN_SEASONS:
+            median = _median(seasonal)
+            mad = _median([abs(v - median) for v in seasonal])
+            scores.append((amount - median) / (MAD_SCALE * mad + max(0.01 * median, 0.01)))
+            baselines.append(median)
+        if self.mean is not None and self.filled >= SEASON_DAYS:
+            scores.append((amount - self.mean) / (math.sqrt(self.var) + max(0.01 * self.mean, 0.01)))
+            baselines.append(self.mean)
+        if not scores:
+            return Verdict(day, amount, None, 0.0, False)
+        # A spike has to stand out against both the weekly pattern and the recent trend
+        score = min(scores)
+        expected = max(baselines)
+        return Verdict(day, amount, expected, score, score >= THRESHOLD and amount - expected >= MIN_DELTA)
+
+    def push(self, day, amount):
+        """Scores `day` against the days before it and adds it to the window. Returns its Verdict."""
+        if self.last_day is not None and day == self.last_day:
+            # Cost Explorer revised the latest day: roll it back and score the new amount instead
+            self.mean, self.var, self.filled = self._undo
+            self.pos = (self.pos - 1) % len(self.ring)
+        elif self.last_day is not None:
+            # Days the service reported nothing cost nothing
+            for _ in range((day - self.last_day).days - 1):
+                self._append(0.0)
+
+        verdict = self._score(day, amount)
+        self._undo = (self.mean, self.var, self.filled)
+        self._append(amount)
+        self.last_day = day
+        self.verdict = verdict
+        return verdict
+
+    def _append(self, amount):
+        self.pos = (self.pos + 1) % len(self.ring)
+        self.ring[self.pos] = amount
+        self.filled += 1
+        if self.mean is None:
+            self.mean = amount
+        else:
+            delta = amount - self.mean
+            self.mean += EWMA_ALPHA * delta
+            self.var = (1 - EWMA_ALPHA) * (self.var + EWMA_ALPHA * delta * delta)
+
+    def is_empty(self):
+        return self.filled >= len(self.ring) and not any(self.ring)
+
+
+class AnomalyDetector:
+    """
+    Streaming cost-spike detection over complete days, one ServiceWindow per service.
+
+    Every complete day is fed in once, in order; re-feeding the latest day (Cost Explorer
+    keeps revising recent days) re-scores it in place. Days before the latest one are
+    never revisited, so their later revisions are ignored.
+    """
+
+    def __init__(self, history_days=SEASON_DAYS * SEASONS):
+        self.history_days = history_days
+        self.windows = {}
+        self.last_day = None
+
+    def is_warm(self):
+        return self.last_day is not None
+
+    def observe(self, day, services):
+        """Feeds one complete day ({service: amount}). Returns the Verdicts of that day."""
+        if self.last_day is not None and day < self.last_day:
+            return {}
+        verdicts = {}
+        for service in services.keys() | self.windows.keys():
+            window = self.windows.get(service)
+            if window is None:
+                window = self.windows[service] = ServiceWindow(self.history_days)
+            verdicts[service] = window.push(day, services.get(service, 0.0))
+        # Services gone from the bill for a whole window stop costing memory
+        for service in [s for s, w in self.windows.items() if w.is_empty()]:
+            del self.windows[service]
+        self.last_day = day
+        return verdicts
+
+    def update(self, days, today):
+        """Feeds the complete days of a collector refresh ({day: DayCosts}) not seen yet, plus the latest one again."""
+        new = sorted(d for d in days if d < today and (self.last_day is None or d >= self.last_day))
+        for day in new:
+            self.observe(day, days[day].by_service())
+        return [(service, w.verdict) for service, w in self.windows.items() if w.verdict and w.verdict.day == self.last_day]
+
+    def bootstrap(self, history):
+        """Seeds the windows from {day: {service: amount}} history, oldest first."""
+        for day in sorted(history):
+            self.observe(day, history[day])
+        logger.info(f"Anomaly detector seeded with {len(history)} days of {len(self.windows)} services")
+
+    def history_start(self, today):
+        return today - timedelta(days=self.history_days)
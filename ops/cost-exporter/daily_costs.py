@@ -0,0 +1,238 @@
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Cost Explorer keeps revising recent days; anything older than this is treated as final and cached
+UNSETTLED_DAYS = int(os.environ.get('UNSETTLED_DAYS', 3))
+BURN_RATE_DAYS = int(os.environ.get('BURN_RATE_DAYS', 7))
+FORECAST_TTL = int(os.environ.get('FORECAST_TTL', 21600))
+# Cost allocation tag EKS puts on cluster resources (activate it in the Billing console)
+CLUSTER_COST_TAG = os.environ.get('CLUSTER_COST_TAG', 'aws:eks:cluster-name')
+CLUSTER_SERVICES = ['Amazon Elastic Compute Cloud - Compute', 'EC2 - Other']
+
+# get_cost_and_usage accepts at most two GroupBy keys, so the three dimensions take two queries
+USAGE_GROUPING = [{'Type': 'DIMENSION', 'Key': 'SERVICE'}, {'Type': 'DIMENSION', 'Key': 'USAGE_TYPE'}]
+ACCOUNT_GROUPING = [{'Type': 'DIMENSION', 'Key': 'LINKED_ACCOUNT'}, {'Type': 'DIMENSION', 'Key': 'SERVICE'}]
+
+
+def _fmt(d):
+    return d.strftime('%Y-%m-%d')
+
+
+def daterange(start, end):
+    """Days in [start, end)."""
+    for n in range((end - start).days):
+        yield start + timedelta(days=n)
+
+
+def next_month(d):
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+class DayCosts:
+    """One day of costs: by (service, usage_type) and by (account, service)."""
+
+    __slots__ = ('usage', 'accounts')
+
+    def __init__(self):
+        self.usage = defaultdict(float)
+        self.accounts = defaultdict(float)
+
+    def total(self):
+        return sum(self.usage.values())
+
+    def by_service(self):
+        services = defaultdict(float)
+        for (service, _), amount in self.usage.items():
+            services[service] += amount
+        return services
+
+
+class DailyCostCollector:
+    """
+    Pulls DAILY Cost Explorer data with full pagination, caching days that have settled
+    so every refresh only re-queries the trailing unsettled window. With a CostHistory the
+    settled days also survive restarts: they are read back from it instead of re-queried.
+    """
+
+    def __init__(self, client, unsettled_days=UNSETTLED_DAYS, burn_days=BURN_RATE_DAYS, forecast_ttl=FORECAST_TTL,
+                 history=None):
+        self.client = client
+        self.history = history
+        self.unsettled_days = unsettled_days
+        self.burn_days = burn_days
+        self.forecast_ttl = forecast_ttl
+        self.final = {}
+        self.recent = {}
+        self.api_calls = 0
+        self._forecast = None
+        self._forecast_at = 0.0
+        self._forecast_month = None
+        self._cluster_costs = {}
+
+    def _query(self, start, end, group_by):
+        """Yields (day, group keys, amount) for every group across every page."""
+        kwargs = {
+            'TimePeriod': {'Start': _fmt(start), 'End': _fmt(end)},
+            'Granularity': 'DAILY',
+            'Metrics': ['UnblendedCost'],
+            'GroupBy': group_by,
+        }
+        while True:
+            response = self.client.get_cost_and_usage(**kwargs)
+            self.api_calls += 1
+            for result in response['ResultsByTime']:
+                day = datetime.strptime(result['TimePeriod']['Start'], '%Y-%m-%d').date()
+                for group in result.get('Groups', []):
+                    yield day, tuple(group['Keys']), float(group['Metrics']['UnblendedCost']['Amount'])
+            token = response.get('NextPageToken')
+            if not token:
+                return
+            kwargs['NextPageToken'] = token
+
+    def service_history(self, start, end):
+        """
+        Per-service totals of every day in [start, end): {day: {service: amount}}. Settled days
+        come from the CostHistory when there is one; Cost Explorer is asked only from the first missing day.
+        """
+        if start >= end:
+            return {}
+        stored = self.history.settled_days(start, end) if self.history is not None else {}
+        history = {day: dict(costs.by_service()) for day, costs in stored.items()}
+        missing = [d for d in daterange(start, end) if d not in stored]
+        if missing and self.history is not None:
+            # Fetched in full so the store keeps them too; only days that settled are written
+            fresh = self._fetch(min(missing), end)
+            settled_before = datetime.utcnow().date() - timedelta(days=self.unsettled_days)
+            self.history.save({d: fresh.get(d) or DayCosts() for d in daterange(min(missing), min(end, settled_before))},
+                              settled=True)
+            history.update((day, dict(fresh[day].by_service()) if day in fresh else {}) for day in daterange(min(missing), end))
+        elif missing:
+            queried = defaultdict(lambda: defaultdict(float))
+            for day, (service,), amount in self._query(min(missing), end, [{'Type': 'DIMENSION', 'Key': 'SERVICE'}]):
+                queried[day][service] += amount
+            history.update((day, dict(queried.get(day, {}))) for day in daterange(min(missing), end))
+        return history
+
+    def _fetch(self, start, end):
+        """Both groupings of [start, end) merged into {day: DayCosts}."""
+        fresh = defaultdict(DayCosts)
+        for day, (service, usage_type), amount in self._query(start, end, USAGE_GROUPING):
+            fresh[day].usage[(service, usage_type)] += amount
+        for day, (account, service), amount in self._query(start, end, ACCOUNT_GROUPING):
+            fresh[day].accounts[(account, service)] += amount
+        return fresh
+
+    def window_start(self, today):
+        """First day the exporter needs: start of month, or further back for the burn-rate window."""
+        return min(today.replace(day=1), today - timedelta(days=self.burn_days))
+
+    def refresh(self, today=None):
+        """Re-queries missing settled days plus the unsettled tail. Returns {day: DayCosts} for the window."""
+        today = today or datetime.utcnow().date()
+        start = self.window_start(today)
+        settled_before = today - timedelta(days=self.unsettled_days)
+
+        # Drop settled days that fell out of the window so memory stays bounded
+        for day in [d for d in self.final if d < start]:
+            del self.final[day]
+        if self.history is not None and not self.final:
+            self.final.update(self.history.settled_days(start, settled_before))
+
+        missing = [d for d in daterange(start, settled_before) if d not in self.final]
+        query_start = min(missing) if missing else max(start, settled_before)
+        end = today + timedelta(days=1)  # End is exclusive; include today's partial estimate
+        logger.info(f"Querying daily costs {_fmt(query_start)}..{_fmt(today)} "
+                    f"({len(self.final)} settled days cached)")
+
+        fresh = self._fetch(query_start, end)
+        settled = {}
+        for day in daterange(query_start, min(settled_before, end)):
+            # Settled days with no spend are cached too, so they are never asked for again
+            settled[day] = self.final[day] = fresh.get(day) or DayCosts()
+        self.recent = {d: fresh.get(d) or DayCosts() for d in daterange(max(query_start, settled_before), end)}
+        if self.history is not None:
+            try:
+                self.history.save(settled, settled=True)
+                self.history.save(self.recent, settled=False)
+                self.history.prune(today)
+            except Exception as e:
+                # The in-memory cache still has these days; they are written again after the next restart
+                logger.warning(f"Failed to write cost history: {e}")
+        return self.days()
+
+    def days(self):
+        merged = dict(self.final)
+        merged.update(self.recent)
+        return merged
+
+    def cluster_cost(self, day, cluster, today=None):
+        """
+        EC2 instance and EBS/EC2-Other cost of one day for resources tagged with the cluster.
+        Settled days are fetched once; unsettled ones at most every forecast_ttl seconds.
+        """
+        today = today or datetime.utcnow().date()
+        cached = self._cluster_costs.get((day, cluster))
+        settled = day < today - timedelta(days=self.unsettled_days)
+        if cached and (settled or time.time() - cached[1] < self.forecast_ttl):
+            return cached[0]
+        response = self.client.get_cost_and_usage(
+            TimePeriod={'Start': _fmt(day), 'End': _fmt(day + timedelta(days=1))},
+            Granularity='DAILY',
+            Metrics=['UnblendedCost'],
+            Filter={'And': [
+                {'Tags': {'Key': CLUSTER_COST_TAG, 'Values': [cluster]}},
+                {'Dimensions': {'Key': 'SERVICE', 'Values': CLUSTER_SERVICES}},
+            ]},
+        )
+        self.api_calls += 1
+        amount = sum(float(r['Total']['UnblendedCost']['Amount']) for r in response['ResultsByTime'])
+        self._cluster_costs = {k: v for k, v in self._cluster_costs.items() if k[0] >= day - timedelta(days=7)}
+        self._cluster_costs[(day, cluster)] = (amount, time.time())
+        return amount
+
+    def forecast(self, today=None):
+        """Forecast spend from today to month end, re-fetched at most every forecast_ttl seconds."""
+        today = today or datetime.utcnow().date()
+        month = today.replace(day=1)
+        fresh = self._forecast_month == month and time.time() - self._forecast_at < self.forecast_ttl
+        if not fresh:
+            response = self.client.get_cost_forecast(
+                TimePeriod={'Start': _fmt(today), 'End': _fmt(next_month(today))},
+                Metric='UNBLENDED_COST',
+                Granularity='MONTHLY',
+            )
+            self.api_calls += 1
+            self._forecast = float(response['Total']['Amount'])
+            self._forecast_at = time.time()
+            self._forecast_month = month
+        return self._forecast
+
+
+def month_to_date(days, today):
+    """Aggregates the current month's DayCosts, up to and including today, into one DayCosts."""
+    month_start = today.replace(day=1)
+    mtd = DayCosts()
+    for day, costs in days.items():
+        if month_start <= day <= today:
+            for key, amount in costs.usage.items():
+                mtd.usage[key] += amount
+            for key, amount in costs.accounts.items():
+                mtd.accounts[key] += amount
+    return mtd
+
+
+def burn_rate(days, today, window):
+    """Average daily spend over the last `window` complete days."""
+    complete = [days[d].total() for d in daterange(today - timedelta(days=window), today) if d in days]
+    return sum(complete) / len(complete) if complete else 0.0
+
+
+def latest_complete_day(days, today):
+    earlier = [d for d in days if d < today]
+    return max(earlier) if earlier else None
+
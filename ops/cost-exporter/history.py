@@ -0,0 +1,212 @@
+"""
+Local cost history: every day the daily collector fetched, kept in SQLite on the
+exporter's volume.
+
+Settled days are written once and read back on restart, so they are never asked of
+Cost Explorer again. The same file answers range queries for the /api/costs endpoint
+and renders OpenMetrics backfill for promtool:
+
+    python history.py backfill --since 2024-01-01 --out costs.om
+    promtool tsdb create-blocks-from openmetrics costs.om /prometheus
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from daily_costs import DayCosts
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB = os.environ.get('HISTORY_DB', '')
+# Days older than this are deleted from the store
+HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 800))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS days (
+    day TEXT PRIMARY KEY,
+    settled INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    service TEXT NOT NULL,
+    usage_type TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (day, service, usage_type)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS usage_by_service ON usage (service, day);
+CREATE TABLE IF NOT EXISTS accounts (
+    day TEXT NOT NULL,
+    account TEXT NOT NULL,
+    service TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (day, account, service)
+) WITHOUT ROWID;
+"""
+
+# Columns each table can be grouped and filtered by
+DIMENSIONS = {
+    'usage': ('service', 'usage_type'),
+    'accounts': ('account', 'service'),
+}
+PERIODS = {
+    'day': 'day',
+    'month': 'substr(day, 1, 7)',
+    'total': "'total'",
+}
+
+
+def _day(value):
+    return value if isinstance(value, date) else datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class CostHistory:
+    """
+    Daily per-service / usage-type / account costs in one SQLite file (WAL mode, so range
+    queries never wait on a refresh writing). One connection shared under a lock; every
+    statement here takes milliseconds.
+    """
+
+    def __init__(self, path, retention_days=HISTORY_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def save(self, days, settled):
+        """Replaces the stored rows of each day in {day: DayCosts}, in one transaction."""
+        if not days:
+            return
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                for day, costs in days.items():
+                    key = day.isoformat()
+                    self._db.execute('DELETE FROM usage WHERE day = ?', (key,))
+                    self._db.execute('DELETE FROM accounts WHERE day = ?', (key,))
+                    self._db.executemany('INSERT INTO usage VALUES (?, ?, ?, ?)',
+                                         ((key, s, u, a) for (s, u), a in costs.usage.items()))
+                    self._db.executemany('INSERT INTO accounts VALUES (?, ?, ?, ?)',
+                                         ((key, acct, s, a) for (acct, s), a in costs.accounts.items()))
+                    self._db.execute('INSERT OR REPLACE INTO days VALUES (?, ?)', (key, int(settled)))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def prune(self, today):
+        cutoff = (today - timedelta(days=self.retention_days)).isoformat()
+        with self._lock:
+            for table in ('usage', 'accounts', 'days'):
+                self._db.execute(f"DELETE FROM {table} WHERE day < ?", (cutoff,))
+
+    def settled_days(self, start, end):
+        """Settled days in [start, end) as {day: DayCosts}, including settled days with no spend."""
+        bounds = (start.isoformat(), end.isoformat())
+        with self._lock:
+            keys = [r[0] for r in self._db.execute(
+                'SELECT day FROM days WHERE settled = 1 AND day >= ? AND day < ?', bounds)]
+            days = {_day(k): DayCosts() for k in keys}
+            for key, service, usage_type, amount in self._db.execute(
+                    'SELECT u.day, service, usage_type, amount FROM usage u JOIN days d ON d.day = u.day '
+                    'WHERE d.settled = 1 AND u.day >= ? AND u.day < ?', bounds):
+                days[_day(key)].usage[(service, usage_type)] = amount
+            for key, account, service, amount in self._db.execute(
+                    'SELECT a.day, account, service, amount FROM accounts a JOIN days d ON d.day = a.day '
+                    'WHERE d.settled = 1 AND a.day >= ? AND a.day < ?', bounds):
+                days[_day(key)].accounts[(account, service)] = amount
+        return days
+
+    def query(self, start, end, group_by=('service',), period='day', table='usage', **filters):
+        """
+        Sums costs over [start, end) per `period` (day | month | total) and per `group_by`
+        column, optionally filtered to exact column values. Returns a list of row dicts.
+        """
+        columns = DIMENSIONS.get(table)
+        if columns is None:
+            raise ValueError(f"unknown table {table!r}")
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        unknown = [c for c in list(group_by) + list(filters) if c not in columns]
+        if unknown:
+            raise ValueError(f"{table} can only be grouped or filtered by {', '.join(columns)}, not {', '.join(unknown)}")
+
+        where = ['day >= ?', 'day < ?']
+        params = [start.isoformat(), end.isoformat()]
+        for column, value in filters.items():
+            where.append(f"{column} = ?")
+            params.append(value)
+        keys = [f"{PERIODS[period]} AS period"] + list(group_by)
+        sql = (f"SELECT {', '.join(keys)}, SUM(amount) FROM {table} WHERE {' AND '.join(where)} "
+               f"GROUP BY {', '.join(['period'] + list(group_by))} ORDER BY period, SUM(amount) DESC")
+        names = ['period'] + list(group_by) + ['amount']
+        with self._lock:
+            return [dict(zip(names, row)) for row in self._db.execute(sql, params)]
+
+    def coverage(self):
+        with self._lock:
+            first, last, settled, total = self._db.execute(
+                'SELECT MIN(day), MAX(day), SUM(settled), COUNT(*) FROM days').fetchone()
+        return {'first_day': first, 'last_day': last, 'settled_days': settled or 0, 'days': total}
+
+    def openmetrics(self, start, end, metric='aws_billing_daily_cost'):
+        """
+        Yields OpenMetrics text lines for promtool's create-blocks-from openmetrics: one
+        sample per (service, usage type) and day, stamped at the start of the day (UTC).
+        """
+        yield f"# HELP {metric} Charges per day, service and usage type (backfilled from the cost history)\n"
+        yield f"# TYPE {metric} gauge\n"
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT day, service, usage_type, amount FROM usage WHERE day >= ? AND day < ? '
+                'ORDER BY service, usage_type, day', (start.isoformat(), end.isoformat())).fetchall()
+        for key, service, usage_type, amount in rows:
+            ts = int(datetime.strptime(key, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+            yield f'{metric}{{service="{_escape(service)}",usage_type="{_escape(usage_type)}"}} {amount!r} {ts}\n'
+        yield "# EOF\n"
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def history_from_env():
+    return CostHistory(HISTORY_DB) if HISTORY_DB else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cost history maintenance')
+    sub = parser.add_subparsers(dest='command', required=True)
+    backfill = sub.add_parser('backfill', help='write OpenMetrics backfill for promtool')
+    backfill.add_argument('--db', default=HISTORY_DB or 'cost-history.db')
+    backfill.add_argument('--since', type=_day, default=None, help='first day (default: everything stored)')
+    backfill.add_argument('--until', type=_day, default=None, help='day after the last one (default: today)')
+    backfill.add_argument('--out', default='-')
+    args = parser.parse_args(argv)
+
+    history = CostHistory(args.db)
+    since = args.since or _day(history.coverage()['first_day'] or date.today().isoformat())
+    until = args.until or datetime.utcnow().date()
+    started = time.perf_counter()
+    out = sys.stdout if args.out == '-' else open(args.out, 'w')
+    try:
+        out.writelines(history.openmetrics(since, until))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info(f"Wrote backfill {since}..{until} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
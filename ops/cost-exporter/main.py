@@ -3,7 +3,16 @@ import time
 import os
 import logging
 from datetime import datetime, timedelta
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import start_http_server, Counter, REGISTRY
+
+from ops_common.metrics import METRICS, sink_from_env
+
+from allocation import allocator_from_env
+from anomaly import AnomalyDetector
+from daily_costs import DailyCostCollector, burn_rate, latest_complete_day, month_to_date
+from history import history_from_env
+from registry import SnapshotRegistry
+from server import serve
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -13,10 +22,56 @@ logger = logging.getLogger(__name__)
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 SCRAPE_INTERVAL = int(os.environ.get('SCRAPE_INTERVAL', 21600)) # Default 6 hours
 PORT = int(os.environ.get('PORT', 8000))
+# monthly: one MONTHLY/SERVICE query per cycle. daily: DAILY service/usage-type/account data with settled-day caching
+EXPORTER_MODE = os.environ.get('EXPORTER_MODE', 'monthly')
+# loop: refresh every SCRAPE_INTERVAL in a blocking loop. async: serve a cached snapshot, refreshed on
+# schedule and on demand once older than SNAPSHOT_MAX_AGE; scrapes wait at most REFRESH_WAIT for it
+SERVE_MODE = os.environ.get('SERVE_MODE', 'loop')
+# Defaults to a little over SCRAPE_INTERVAL, so scrapes only refresh when the schedule fell behind
+SNAPSHOT_MAX_AGE = int(os.environ.get('SNAPSHOT_MAX_AGE', SCRAPE_INTERVAL + 600))
+REFRESH_WAIT = float(os.environ.get('REFRESH_WAIT', 5))
+# After a failed refresh, scrapes serve the stale snapshot this long before Cost Explorer is tried again
+REFRESH_RETRY_BACKOFF = int(os.environ.get('REFRESH_RETRY_BACKOFF', 300))
+# POST /refresh is refused (429) within this many seconds of the last refresh; each one is billed
+REFRESH_MIN_INTERVAL = int(os.environ.get('REFRESH_MIN_INTERVAL', 300))
+# Daily mode only: score each complete day per service against its rolling baseline
+ANOMALY_DETECTION = os.environ.get('ANOMALY_DETECTION', 'true') == 'true'
+SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
+
+ce = boto3.client('ce', region_name=AWS_REGION)
+sns = boto3.client('sns', region_name=AWS_REGION) if SNS_TOPIC_ARN else None
+
+# Same AWS call latency / retry / throttle and phase metrics as the Lambdas, served on /metrics
+METRICS.configure(sink_from_env('prometheus'))
+METRICS.instrument_client('ce', ce)
 
 # Prometheus Metrics
-TOTAL_COST = Gauge('aws_billing_estimated_charges_total', 'Total estimated billing charges for the current month')
-SERVICE_COST = Gauge('aws_billing_service_cost_total', 'Estimated billing charges per service', ['service'])
+# Cost gauges are rebuilt from scratch every refresh and swapped in whole: series that drop
+# out of the bill disappear, and each labelled gauge is capped at SERIES_BUDGET series (top-K + "other")
+COSTS = SnapshotRegistry()
+TOTAL_COST = COSTS.gauge('aws_billing_estimated_charges_total', 'Total estimated billing charges for the current month')
+SERVICE_COST = COSTS.gauge('aws_billing_service_cost_total', 'Estimated billing charges per service', ['service'])
+DAILY_COST = COSTS.gauge('aws_billing_daily_cost', 'Charges for the latest complete day per service and usage type', ['service', 'usage_type'])
+ACCOUNT_COST = COSTS.gauge('aws_billing_account_cost_total', 'Month-to-date charges per linked account', ['account'])
+BURN_RATE = COSTS.gauge('aws_billing_daily_burn_rate', 'Average daily charges over the trailing burn-rate window')
+FORECAST = COSTS.gauge('aws_billing_month_end_forecast', 'Month-to-date charges plus the Cost Explorer forecast for the rest of the month')
+# One series per service: "other" would sum scores, which means nothing
+ANOMALY_SCORE = COSTS.gauge('aws_billing_anomaly_score', 'Robust z-score of the latest complete day against the service baseline', ['service'], budget=0)
+ANOMALY = COSTS.gauge('aws_billing_cost_anomaly', 'Services whose latest complete day was flagged as a cost spike', ['service'], budget=0)
+NAMESPACE_COST = COSTS.gauge('aws_billing_namespace_daily_cost', 'Cluster EC2/EBS charges of the latest complete day allocated per namespace', ['cluster', 'namespace'])
+NAMESPACE_SHARE = COSTS.gauge('aws_billing_namespace_cost_share', "Namespace share of the cluster's EC2/EBS charges", ['cluster', 'namespace'])
+WORKLOAD_COST = COSTS.gauge('aws_billing_workload_daily_cost', 'Cluster EC2/EBS charges of the latest complete day allocated per workload', ['cluster', 'namespace', 'workload'])
+REGISTRY.register(COSTS)
+CE_REQUESTS = Counter('aws_cost_explorer_requests', 'Billable Cost Explorer API requests made by the exporter')
+
+DETECTOR = AnomalyDetector()
+# Namespace / workload allocation of the cluster's cost; only when PROMETHEUS_URL is set
+ALLOCATOR = allocator_from_env()
+ALERTED = set()
+
+def publish_alert(subject, message):
+    if SNS_TOPIC_ARN:
+        sns.publish(TopicArn=SNS_TOPIC_ARN, Subject=subject, Message=message)
 
 def get_cost_and_usage():
     """
@@ -24,8 +79,6 @@ def get_cost_and_usage():
     Groups by SERVICE.
     """
     try:
-        client = boto3.client('ce', region_name=AWS_REGION)
-        
         # Date Range: First day of current month to Today
         today = datetime.now()
         start_date = today.replace(day=1).strftime('%Y-%m-%d')
@@ -42,35 +95,162 @@ def get_cost_and_usage():
 
         logger.info(f"Querying AWS Cost Explorer from {start_date} to {end_date}...")
 
-        response = client.get_cost_and_usage(
+        response = ce.get_cost_and_usage(
             TimePeriod={'Start': start_date, 'End': end_date},
             Granularity='MONTHLY',
             Metrics=['UnblendedCost'],
             GroupBy=[{'Type': 'DIMENSION', 'Key': 'SERVICE'}]
         )
 
-        total_bill = 0.0
+        services = {}
 
         for group in response['ResultsByTime'][0]['Groups']:
             service_name = group['Keys'][0]
             amount = float(group['Metrics']['UnblendedCost']['Amount'])
-            
-            # Update Prometheus Metric
-            SERVICE_COST.labels(service=service_name).set(amount)
-            total_bill += amount
-            
-        # Update Total Metric
-        TOTAL_COST.set(total_bill)
+            services[(service_name,)] = amount
+
+        CE_REQUESTS.inc()
+
+        # Swap in the new per-service and total values together
+        total_bill = sum(services.values())
+        COSTS.publish({SERVICE_COST: services, TOTAL_COST: total_bill})
         logger.info(f"Updated metrics. Total Bill MTD: ${total_bill:.2f}")
 
     except Exception as e:
         logger.error(f"Failed to query AWS Cost Explorer: {e}")
+        return False
+
+def export_daily_costs(collector):
+    """
+    Refreshes DAILY Cost Explorer data (only the unsettled tail once warm) and
+    updates month-to-date, latest-day, burn-rate and forecast metrics.
+    """
+    try:
+        calls_before = collector.api_calls
+        today = datetime.utcnow().date()
+        days = collector.refresh(today)
+        mtd = month_to_date(days, today)
+
+        services = mtd.by_service()
+        total_bill = sum(services.values())
+
+        accounts = {}
+        for (account, _), amount in mtd.accounts.items():
+            accounts[(account,)] = accounts.get((account,), 0.0) + amount
+
+        latest = latest_complete_day(days, today)
+        snapshot = {
+            SERVICE_COST: {(service_name,): amount for service_name, amount in services.items()},
+            TOTAL_COST: total_bill,
+            ACCOUNT_COST: accounts,
+            DAILY_COST: dict(days[latest].usage) if latest else {},
+            BURN_RATE: burn_rate(days, today, collector.burn_days),
+        }
+
+        if ANOMALY_DETECTION:
+            try:
+                snapshot.update(detect_anomalies(collector, days, today))
+            except Exception as e:
+                # Cost metrics still go out; the detector retries its seeding on the next refresh
+                logger.warning(f"Anomaly detection unavailable: {e}")
+
+        if ALLOCATOR is not None and latest:
+            try:
+                snapshot.update(allocate_cluster_cost(collector, latest, today))
+            except Exception as e:
+                # Left out of the snapshot, so the last good allocation keeps being served
+                logger.warning(f"Cost allocation unavailable: {e}")
+
+        try:
+            # Actuals up to yesterday plus the forecast from today to month end
+            spent_before_today = total_bill - days[today].total() if today in days else total_bill
+            snapshot[FORECAST] = spent_before_today + collector.forecast(today)
+        except Exception as e:
+            # Left out of the snapshot, so the last good forecast keeps being served
+            logger.warning(f"Cost forecast unavailable: {e}")
+
+        COSTS.publish(snapshot)
+
+        CE_REQUESTS.inc(collector.api_calls - calls_before)
+        logger.info(f"Updated daily metrics. Total Bill MTD: ${total_bill:.2f} "
+                    f"({collector.api_calls - calls_before} Cost Explorer requests)")
+
+    except Exception as e:
+        logger.error(f"Failed to query AWS Cost Explorer: {e}")
+        return False
+
+def detect_anomalies(collector, days, today):
+    """
+    Scores the latest complete day of every service, seeding the detector's history on first use.
+    Returns the anomaly gauges for the snapshot and alerts on each service/day flagged for the first time.
+    """
+    with METRICS.phase('anomaly_detection'):
+        if not DETECTOR.is_warm():
+            DETECTOR.bootstrap(collector.service_history(DETECTOR.history_start(today), collector.window_start(today)))
+        verdicts = DETECTOR.update(days, today)
+
+    flagged = [(service, v) for service, v in verdicts if v.anomalous]
+    new = [(service, v) for service, v in flagged if (service, v.day) not in ALERTED]
+    if new:
+        lines = [f"{service}: ${v.amount:,.2f} on {v.day} vs ${v.expected:,.2f} expected (score {v.score:.1f})"
+                 for service, v in sorted(new, key=lambda sv: -(sv[1].amount - sv[1].expected))]
+        logger.warning("Cost anomalies: " + "; ".join(lines))
+        try:
+            # SNS subjects must be plain ASCII
+            publish_alert(f"AWS cost anomaly: {len(new)} service(s)", "💸 " + "\n".join(lines))
+        except Exception as e:
+            logger.error(f"Failed to publish cost anomaly alert: {e}")
+        ALERTED.update((service, v.day) for service, v in new)
+    # Only the latest day can still be flagged again
+    ALERTED.intersection_update((service, v.day) for service, v in flagged)
+
+    return {
+        ANOMALY_SCORE: {(service,): v.score for service, v in verdicts},
+        ANOMALY: {(service,): 1 for service, v in flagged},
+    }
+
+def allocate_cluster_cost(collector, day, today):
+    """Allocates the cluster's EC2/EBS cost of `day` over namespaces and workloads by pod requests and usage."""
+    cluster = ALLOCATOR.cluster
+    cost = collector.cluster_cost(day, cluster, today)
+    if not cost:
+        logger.warning(f"No EC2/EBS cost tagged with cluster {cluster} on {day}; is the cost allocation tag active?")
+        return {}
+    with METRICS.phase('cost_allocation'):
+        allocation = ALLOCATOR.run(cost)
+    logger.info(f"Allocated ${cost:.2f} of {cluster} over {len(allocation.namespaces)} namespaces "
+                f"and {len(allocation.workloads)} workloads ({allocation.pods} pods, {allocation.nodes} nodes, "
+                f"${allocation.idle:.2f} idle)")
+    return {
+        NAMESPACE_COST: {(cluster, ns): amount for ns, amount in allocation.namespaces.items()},
+        NAMESPACE_SHARE: {(cluster, ns): amount / cost for ns, amount in allocation.namespaces.items()},
+        WORKLOAD_COST: {(cluster, ns, workload): amount for (ns, workload), amount in allocation.workloads.items()},
+    }
+
+def refresh(collector):
+    """One refresh in the configured mode. Returns False if Cost Explorer could not be queried."""
+    with METRICS.phase(f"refresh_{EXPORTER_MODE}"):
+        if EXPORTER_MODE == 'daily':
+            return export_daily_costs(collector)
+        return get_cost_and_usage()
 
 if __name__ == '__main__':
-    logger.info(f"Starting AWS Cost Exporter on port {PORT}...")
-    start_http_server(PORT)
-    
-    while True:
-        get_cost_and_usage()
-        logger.info(f"Sleeping for {SCRAPE_INTERVAL} seconds...")
-        time.sleep(SCRAPE_INTERVAL)
+    logger.info(f"Starting AWS Cost Exporter on port {PORT} in {EXPORTER_MODE} mode ({SERVE_MODE} server)...")
+    # Daily mode keeps every fetched day in HISTORY_DB, so settled days survive restarts
+    history = history_from_env() if EXPORTER_MODE == 'daily' else None
+    collector = DailyCostCollector(ce, history=history)
+
+    if SERVE_MODE == 'async':
+        max_age = SNAPSHOT_MAX_AGE
+        if max_age < SCRAPE_INTERVAL:
+            # Otherwise every scrape between scheduled refreshes would buy an extra round of CE calls
+            logger.warning(f"SNAPSHOT_MAX_AGE {max_age}s is below SCRAPE_INTERVAL, using {SCRAPE_INTERVAL}s")
+            max_age = SCRAPE_INTERVAL
+        serve(lambda: refresh(collector), PORT, SCRAPE_INTERVAL, max_age, REFRESH_WAIT, history=history,
+              retry_backoff=REFRESH_RETRY_BACKOFF, min_refresh_interval=REFRESH_MIN_INTERVAL)
+    else:
+        start_http_server(PORT)
+        while True:
+            refresh(collector)
+            logger.info(f"Sleeping for {SCRAPE_INTERVAL} seconds...")
+            time.sleep(SCRAPE_INTERVAL)
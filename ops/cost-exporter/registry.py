@@ -0,0 +1,123 @@
+import heapq
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Most series any one labelled metric exposes; the smallest values beyond it are summed into "other"
+SERIES_BUDGET = int(os.environ.get('SERIES_BUDGET', 100))
+OTHER = 'other'
+
+
+def top_k(values, budget, other=OTHER):
+    """
+    Keeps the `budget` - 1 largest series (by absolute value, so credits rank too) and
+    rolls the rest into one series with every label set to "other".
+    """
+    if budget <= 0 or len(values) <= budget:
+        return OrderedDict(sorted(values.items(), key=lambda kv: -abs(kv[1])))
+    kept = heapq.nlargest(budget - 1, values.items(), key=lambda kv: abs(kv[1]))
+    kept_keys = {labels for labels, _ in kept}
+    rest = sum(v for labels, v in values.items() if labels not in kept_keys)
+    width = len(next(iter(values)))
+    rolled = OrderedDict(kept)
+    rolled[(other,) * width] = rolled.get((other,) * width, 0.0) + rest
+    return rolled
+
+
+class _Family:
+    __slots__ = ('name', 'documentation', 'labelnames', 'budget')
+
+    def __init__(self, name, documentation, labelnames, budget):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.budget = budget
+
+
+class SnapshotRegistry:
+    """
+    Custom Collector for gauges that are recomputed wholesale on every refresh.
+
+    publish() builds a fresh snapshot of the published metrics and swaps it in with a
+    single reference assignment, so a scrape sees either the old refresh or the new one,
+    never a mix. Series missing from the new snapshot are evicted instead of reporting
+    their last value forever, and each labelled metric is held to a series budget.
+    """
+
+    def __init__(self, budget=SERIES_BUDGET, prefix='aws_cost_exporter'):
+        self.budget = budget
+        self.prefix = prefix
+        self.families = OrderedDict()
+        self._snapshot = {}
+        self._evicted = {}
+        self._rolled_up = {}
+        self._lock = threading.Lock()
+
+    def gauge(self, name, documentation, labelnames=(), budget=None):
+        self.families[name] = _Family(name, documentation, labelnames, self.budget if budget is None else budget)
+        self._evicted[name] = 0
+        self._rolled_up[name] = 0
+        return name
+
+    def publish(self, values):
+        """
+        Replaces the series of each metric in `values` ({name: {label tuple: value}}, or
+        {name: value} for unlabelled gauges). Metrics not passed keep their last snapshot.
+        """
+        with self._lock:
+            snapshot = dict(self._snapshot)
+            for name, series in values.items():
+                family = self.families[name]
+                if not family.labelnames:
+                    snapshot[name] = OrderedDict([((), float(series))])
+                    continue
+                series = {tuple(str(v) for v in labels): float(v) for labels, v in series.items()}
+                fresh = top_k(series, family.budget) if series else OrderedDict()
+                self._rolled_up[name] = len(series) - len(fresh) + 1 if len(series) > len(fresh) else 0
+
+                previous = self._snapshot.get(name, {})
+                added = fresh.keys() - previous.keys()
+                evicted = previous.keys() - fresh.keys()
+                self._evicted[name] += len(evicted)
+                if added or evicted:
+                    logger.info(f"{name}: {len(fresh)} series (+{len(added)} new, -{len(evicted)} evicted"
+                                + (f", {self._rolled_up[name]} rolled into '{OTHER}'" if self._rolled_up[name] else '')
+                                + ")")
+                snapshot[name] = fresh
+            self._snapshot = snapshot
+
+    def series(self, name):
+        return dict(self._snapshot.get(name, {}))
+
+    def describe(self):
+        for family in self.families.values():
+            yield GaugeMetricFamily(family.name, family.documentation, labels=family.labelnames)
+        yield from self._own_metrics(None)
+
+    def collect(self):
+        snapshot = self._snapshot
+        for name, family in self.families.items():
+            metric = GaugeMetricFamily(name, family.documentation, labels=family.labelnames)
+            for labels, value in snapshot.get(name, {}).items():
+                metric.add_metric(labels, value)
+            yield metric
+        yield from self._own_metrics(snapshot)
+
+    def _own_metrics(self, snapshot):
+        series = GaugeMetricFamily(f"{self.prefix}_series", 'Series exposed per cost metric', labels=['metric'])
+        rolled = GaugeMetricFamily(f"{self.prefix}_series_rolled_up",
+                                   f"Series summed into the '{OTHER}' rollup by the series budget", labels=['metric'])
+        evicted = CounterMetricFamily(f"{self.prefix}_series_evicted",
+                                      'Series dropped because a refresh no longer reported them', labels=['metric'])
+        for name in self.families if snapshot is not None else ():
+            series.add_metric([name], len(snapshot.get(name, {})))
+            rolled.add_metric([name], self._rolled_up[name])
+            evicted.add_metric([name], self._evicted[name])
+        yield series
+        yield rolled
+        yield evicted
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+logger = logging.getLogger(__name__)
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 429: 'Too Many Requests',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class Refresher:
+    """
+    Runs a blocking refresh function off the event loop and tracks how old its data is.
+
+    Concurrent callers share one in-flight refresh, so any number of scrapes or
+    /refresh requests arriving together cost a single round of Cost Explorer calls.
+    The refresh function returns False (or raises) when it failed to update anything;
+    scrapes then serve the stale snapshot for retry_backoff seconds instead of
+    retrying Cost Explorer every time.
+    """
+
+    def __init__(self, refresh_fn, interval, max_age, wait, retry_backoff=300):
+        self.refresh_fn = refresh_fn
+        self.interval = interval
+        self.max_age = max_age
+        self.wait = wait
+        self.retry_backoff = retry_backoff
+        self.refreshed_at = None
+        self.last_error = None
+        self.refreshes = 0
+        self._inflight = None
+
+    def age(self):
+        return None if self.refreshed_at is None else time.time() - self.refreshed_at
+
+    def is_stale(self):
+        age = self.age()
+        return age is None or age > self.max_age
+
+    def last_attempt(self):
+        """When the latest refresh finished, successfully or not."""
+        return max(self.refreshed_at or 0, self.last_error or 0) or None
+
+    def is_refreshing(self):
+        return self._inflight is not None and not self._inflight.done()
+
+    def backing_off(self):
+        failed_last = self.last_error is not None and self.last_error > (self.refreshed_at or 0)
+        return failed_last and time.time() - self.last_error < self.retry_backoff
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            ok = await loop.run_in_executor(None, self.refresh_fn)
+        except Exception as e:
+            ok = False
+            logger.error(f"Refresh failed: {e}")
+        self.refreshes += 1
+        if ok is False:
+            self.last_error = time.time()
+        else:
+            self.refreshed_at = time.time()
+        return ok is not False
+
+    def refresh(self):
+        """Starts a refresh, or joins the one already running. Returns the shared task."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._run())
+        return self._inflight
+
+    async def ensure_fresh(self):
+        """
+        Refreshes first if the snapshot is older than max_age, waiting at most `wait`
+        seconds; a slow Cost Explorer keeps running in the background and the stale
+        snapshot is served meanwhile.
+        """
+        if not self.is_stale() or self.backing_off():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self.refresh()), self.wait)
+        except asyncio.TimeoutError:
+            logger.info(f"Refresh still running after {self.wait}s, serving the previous snapshot")
+
+    async def run_schedule(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    def status(self):
+        age = self.age()
+        return {
+            'snapshot_age_seconds': None if age is None else round(age, 1),
+            'max_age_seconds': self.max_age,
+            'stale': self.is_stale(),
+            'refreshing': self.is_refreshing(),
+            'refreshes': self.refreshes,
+            'last_error_age_seconds': None if self.last_error is None else round(time.time() - self.last_error, 1),
+            'backing_off': self.backing_off(),
+        }
+
+
+class MetricsServer:
+    """
+    Minimal asyncio HTTP server for the exporter:
+
+      GET  /metrics   cached snapshot, refreshed first if older than max_age
+      GET  /healthz   200 while the event loop is serving, with the snapshot age
+      GET  /ready     200 once a snapshot has been published, 503 before
+      POST /refresh   forces a (coalesced) refresh and returns once it finishes; at most one
+                      per min_refresh_interval, since every refresh is billed by Cost Explorer
+
+    and, with a CostHistory store:
+
+      GET  /api/costs     sums over a day range, e.g. ?start=2024-05-01&end=2024-06-01&group_by=service&period=month
+      GET  /api/history   which days the store holds
+      GET  /api/backfill  OpenMetrics text of a day range, for promtool tsdb create-blocks-from openmetrics
+    """
+
+    def __init__(self, refresher, port, registry=REGISTRY, history=None, min_refresh_interval=300):
+        self.refresher = refresher
+        self.port = port
+        self.registry = registry
+        self.history = history
+        self.min_refresh_interval = min_refresh_interval
+
+    async def handle(self, reader, writer):
+        method = 'GET'
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            length = 0
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = header.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value.strip() or 0)
+            if length:
+                await reader.readexactly(length)
+            url = urlsplit(target)
+            status, content_type, body = await self.route(method, url.path, url.query)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, content_type, body = 400, 'text/plain', b'Bad Request\n'
+        except Exception as e:
+            logger.exception(f"Request failed: {e}")
+            status, content_type, body = 500, 'text/plain', b'Internal Server Error\n'
+
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n")
+        writer.write(head.encode('latin-1') + (body if method != 'HEAD' else b''))
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def _json(self, status, doc):
+        return status, 'application/json', (json.dumps(doc) + '\n').encode()
+
+    async def route(self, method, path, query=''):
+        if path == '/metrics':
+            await self.refresher.ensure_fresh()
+            return 200, CONTENT_TYPE_LATEST, generate_latest(self.registry)
+        if path == '/healthz':
+            return self._json(200, self.refresher.status())
+        if path == '/ready':
+            ready = self.refresher.refreshed_at is not None
+            return self._json(200 if ready else 503, dict(self.refresher.status(), ready=ready))
+        if path == '/refresh':
+            if method != 'POST':
+                return self._json(405, {'error': 'use POST'})
+            last = self.refresher.last_attempt()
+            if not self.refresher.is_refreshing() and last is not None and time.time() - last < self.min_refresh_interval:
+                retry = self.min_refresh_interval - (time.time() - last)
+                return self._json(429, dict(self.refresher.status(), retry_after_seconds=round(retry, 1)))
+            # Shielded: a client hanging up must not cancel the refresh other callers share
+            ok = await asyncio.shield(self.refresher.refresh())
+            return self._json(200 if ok else 503, dict(self.refresher.status(), refreshed=ok))
+        if path.startswith('/api/'):
+            if self.history is None:
+                return self._json(404, {'error': 'cost history is disabled (set HISTORY_DB)'})
+            try:
+                # SQLite is blocking; keep it off the loop that serves /metrics
+                return await asyncio.get_running_loop().run_in_executor(None, self.api, path, parse_qs(query))
+            except ValueError as e:
+                return self._json(400, {'error': str(e)})
+        return 404, 'text/plain', b'Not Found\n'
+
+    def api(self, path, params):
+        def param(name, default=None):
+            return params[name][-1] if name in params else default
+
+        today = datetime.utcnow().date()
+        start = datetime.strptime(param('start', today.replace(day=1).isoformat()), '%Y-%m-%d').date()
+        end = datetime.strptime(param('end', (today + timedelta(days=1)).isoformat()), '%Y-%m-%d').date()
+        if path == '/api/costs':
+            table = param('table', 'usage')
+            group_by = [c for c in param('group_by', 'service').split(',') if c]
+            filters = {c: param(c) for c in ('service', 'usage_type', 'account') if param(c) is not None}
+            started = time.perf_counter()
+            rows = self.history.query(start, end, group_by, param('period', 'day'), table, **filters)
+            return self._json(200, {
+                'start': start.isoformat(), 'end': end.isoformat(), 'rows': rows,
+                'total': sum(r['amount'] for r in rows),
+                'query_ms': round((time.perf_counter() - started) * 1000, 2),
+            })
+        if path == '/api/history':
+            return self._json(200, self.history.coverage())
+        if path == '/api/backfill':
+            body = ''.join(self.history.openmetrics(start, end)).encode()
+            return 200, 'application/openmetrics-text; version=1.0.0; charset=utf-8', body
+        return self._json(404, {'error': f"no such endpoint {path}"})
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, port=self.port)
+        logger.info(f"Serving /metrics, /healthz, /ready and /refresh{' and /api' if self.history else ''} on port {self.port}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.refresher.run_schedule())
+
+
+def serve(refresh_fn, port, interval, max_age, wait, history=None, retry_backoff=300, min_refresh_interval=300):
+    refresher = Refresher(refresh_fn, interval, max_age, wait, retry_backoff)
+    asyncio.run(MetricsServer(refresher, port, history=history, min_refresh_interval=min_refresh_interval).serve())
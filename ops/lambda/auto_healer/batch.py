@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+MAX_WORKERS = int(os.environ.get('HEALER_MAX_WORKERS', 16))
+
+BatchResult = namedtuple('BatchResult', ['processed', 'duplicates', 'failed_ids'])
+
+
+def parse_record(record):
+    """
+    Returns (record_id, message) for one batch record.
+    Handles direct SNS deliveries, SQS with SNS raw delivery, and SQS wrapping an SNS envelope.
+    """
+    if 'Sns' in record:
+        return record['Sns'].get('MessageId'), json.loads(record['Sns']['Message'])
+    if 'body' in record:
+        body = json.loads(record['body'])
+        if body.get('Type') == 'Notification' and 'Message' in body:
+            body = json.loads(body['Message'])
+        return record['messageId'], body
+    raise ValueError(f"Unrecognised record: {list(record)}")
+
+
+def is_sqs_batch(records):
+    return any(r.get('eventSource') == 'aws:sqs' for r in records)
+
+
+def partial_batch_response(failed_ids):
+    """SQS ReportBatchItemFailures response: only the listed messages go back on the queue."""
+    return {'batchItemFailures': [{'itemIdentifier': record_id} for record_id in failed_ids]}
+
+
+def collect_tasks(records, key_fn):
+    """
+    Parses every record and collapses duplicates (same key_fn(message)) into one task.
+    Returns (OrderedDict key -> (message, [record ids]), [ids of unparseable records]).
+    """
+    tasks = OrderedDict()
+    failed = []
+    for record in records:
+        try:
+            record_id, message = parse_record(record)
+        except Exception as e:
+            logger.error(f"Failed to parse record: {e}")
+            failed.append(record.get('messageId') or record.get('Sns', {}).get('MessageId'))
+            continue
+
+        key = key_fn(message)
+        if key in tasks:
+            tasks[key][1].append(record_id)
+        else:
+            tasks[key] = (message, [record_id])
+    return tasks, [f for f in failed if f]
+
+
+def run_tasks(tasks, handler, max_workers=MAX_WORKERS):
+    """Runs handler(message) for each task concurrently. Returns the record ids of failed tasks."""
+    failed = []
+    if not tasks:
+        return failed
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as pool:
+        futures = [(key, ids, pool.submit(handler, message)) for key, (message, ids) in tasks.items()]
+    for key, ids, future in futures:
+        error = future.exception()
+        if error:
+            logger.error(f"Remediation {key} failed: {error}")
+            failed.extend(ids)
+    return failed
@@ -0,0 +1,159 @@
+import logging
+import os
+import re
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# send_command accepts at most 50 InstanceIds per call
+MAX_TARGETS = 50
+MAX_CONCURRENCY = os.environ.get('DISK_MAX_CONCURRENCY', '25%')
+MAX_ERRORS = os.environ.get('DISK_MAX_ERRORS', '10%')
+POLL_INTERVAL = float(os.environ.get('DISK_POLL_INTERVAL', 3))
+# Seconds spent waiting for results when the caller gives no deadline
+POLL_BUDGET = float(os.environ.get('DISK_POLL_BUDGET', 40))
+
+# Usage of / is measured around the cleanup so every host reports what it actually freed
+CLEANUP_COMMANDS = [
+    "before=$(df --output=used -B1 / | tail -1)",
+    "rm -rf /tmp/*",
+    "docker system prune -f",
+    "after=$(df --output=used -B1 / | tail -1)",
+    'echo "BYTES_FREED=$((before - after))"',
+]
+BYTES_FREED = re.compile(r'BYTES_FREED=(-?\d+)')
+
+PENDING_STATUSES = {'Pending', 'InProgress', 'Delayed', 'Cancelling'}
+# SendFailed is ours: send_command itself was refused for the host's group, so nothing ran there
+FAILED_STATUSES = {'Failed', 'Cancelled', 'TimedOut', 'DeliveryTimedOut', 'ExecutionTimedOut',
+                   'Undeliverable', 'Terminated', 'InvalidPlatform', 'AccessDenied', 'SendFailed'}
+
+HostResult = namedtuple('HostResult', ['instance_id', 'command_id', 'status', 'bytes_freed'])
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def parse_bytes_freed(output):
+    match = BYTES_FREED.search(output or '')
+    return max(0, int(match.group(1))) if match else None
+
+
+def human_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+        n /= 1024.0
+    return f"{n:.1f} TB"
+
+
+class DiskRemediationCoalescer:
+    """
+    Cleans disks across many instances with as few SSM calls as possible:
+    one send_command per 50 instances (rate controlled by MaxConcurrency/MaxErrors),
+    then list_command_invocations per command until every host has a final status.
+    """
+
+    def __init__(self, ssm, max_targets=MAX_TARGETS, max_concurrency=MAX_CONCURRENCY,
+                 max_errors=MAX_ERRORS, poll_interval=POLL_INTERVAL):
+        self.ssm = ssm
+        self.max_targets = max_targets
+        self.max_concurrency = max_concurrency
+        self.max_errors = max_errors
+        self.poll_interval = poll_interval
+
+    def send(self, instance_ids):
+        """Sends the cleanup to one group of instances. Returns the CommandId."""
+        response = self.ssm.send_command(
+            InstanceIds=list(instance_ids),
+            DocumentName="AWS-RunShellScript",
+            Comment="Auto-Healer disk cleanup",
+            Parameters={'commands': CLEANUP_COMMANDS},
+            MaxConcurrency=self.max_concurrency,
+            MaxErrors=self.max_errors,
+        )
+        command_id = response['Command']['CommandId']
+        logger.info(f"SSM Command Sent: {command_id} to {len(instance_ids)} instances")
+        return command_id
+
+    def invocations(self, command_id):
+        """Yields (instance_id, status, output) for every host the command targeted."""
+        kwargs = {'CommandId': command_id, 'Details': True}
+        while True:
+            response = self.ssm.list_command_invocations(**kwargs)
+            for invocation in response.get('CommandInvocations', []):
+                output = ''.join(p.get('Output', '') for p in invocation.get('CommandPlugins', []))
+                yield invocation['InstanceId'], invocation['Status'], output
+            token = response.get('NextToken')
+            if not token:
+                return
+            kwargs['NextToken'] = token
+
+    def collect(self, command_id, instance_ids, results):
+        """Records final results for one command. Returns True once no host is still pending."""
+        seen = set()
+        for instance_id, status, output in self.invocations(command_id):
+            seen.add(instance_id)
+            if status in PENDING_STATUSES:
+                continue
+            bytes_freed = parse_bytes_freed(output) if status == 'Success' else None
+            results[instance_id] = HostResult(instance_id, command_id, status, bytes_freed)
+        # Invocations show up asynchronously; hosts not listed yet are still pending
+        return all(i in seen and i in results for i in instance_ids)
+
+    def remediate(self, instance_ids, deadline=None):
+        """
+        Cleans every instance and waits for results until `deadline`.
+        Returns OrderedDict instance_id -> HostResult; hosts still running at the deadline
+        are reported with status 'InProgress'.
+        """
+        instance_ids = list(OrderedDict.fromkeys(instance_ids))
+        deadline = deadline or time.time() + POLL_BUDGET
+        groups = list(_chunks(instance_ids, self.max_targets))
+        logger.info(f"Remediating disk space on {len(instance_ids)} instances in {len(groups)} SSM commands")
+
+        results, commands = {}, []
+        with ThreadPoolExecutor(max_workers=max(1, len(groups))) as pool:
+            futures = [(pool.submit(self.send, ids), ids) for ids in groups]
+        # One refused group (e.g. InvalidInstanceId for a terminated host) must not lose the commands already sent
+        for future, ids in futures:
+            try:
+                commands.append((future.result(), ids))
+            except Exception as e:
+                logger.error(f"SSM send_command failed for {len(ids)} instances ({', '.join(ids[:5])}): {e}")
+                for instance_id in ids:
+                    results[instance_id] = HostResult(instance_id, None, 'SendFailed', None)
+
+        pending = commands
+        while pending:
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.time())))
+            pending = [(cid, ids) for cid, ids in pending if not self.collect(cid, ids, results)]
+            if pending and time.time() >= deadline:
+                logger.warning(f"{len(pending)} SSM commands still running at the deadline")
+                break
+
+        for command_id, ids in pending:
+            for instance_id in ids:
+                results.setdefault(instance_id, HostResult(instance_id, command_id, 'InProgress', None))
+        return OrderedDict((i, results[i]) for i in instance_ids)
+
+
+def summarize(results):
+    """Alert text: fleet totals first, then one line per host."""
+    succeeded = [r for r in results.values() if r.status == 'Success']
+    failed = [r for r in results.values() if r.status in FAILED_STATUSES]
+    running = [r for r in results.values() if r.status not in FAILED_STATUSES and r.status != 'Success']
+    freed = sum(r.bytes_freed or 0 for r in succeeded)
+    commands = sorted({r.command_id for r in results.values() if r.command_id})
+
+    lines = [f"Executed cleanup on {len(results)} instances with {len(commands)} SSM command(s): "
+             f"{len(succeeded)} succeeded, {len(failed)} failed, {len(running)} still running. "
+             f"Freed {human_bytes(freed)} in total."]
+    for r in results.values():
+        detail = human_bytes(r.bytes_freed) + " freed" if r.bytes_freed is not None else r.status
+        lines.append(f"- {r.instance_id}: {detail} (Command ID: {r.command_id or 'not sent'})")
+    return "\n".join(lines)
@@ -0,0 +1,296 @@
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+HEALER_STATE = os.environ.get('HEALER_STATE', 'file')
+HEALER_STATE_TABLE = os.environ.get('HEALER_STATE_TABLE', 'auto-healer-state')
+HEALER_STATE_FILE = os.environ.get('HEALER_STATE_FILE', '/tmp/auto-healer-state.json')
+
+# Seconds before the same host is remediated again for the same action
+COOLDOWNS = {
+    'disk_cleanup': int(os.environ.get('DISK_COOLDOWN', 1800)),
+}
+# Token buckets per action, "action=capacity/seconds": at most `capacity` runs, refilled over `seconds`
+RATE_LIMITS = os.environ.get('HEALER_RATE_LIMITS', 'disk_cleanup=50/3600')
+# A host remediated this many times within the window is escalated to a human, once per window
+ESCALATION_THRESHOLD = int(os.environ.get('ESCALATION_THRESHOLD', 3))
+ESCALATION_WINDOW = int(os.environ.get('ESCALATION_WINDOW', 21600))
+# Alerts within this many seconds of the last one sent are held for the digest; 0 sends every alert
+DIGEST_INTERVAL = int(os.environ.get('DIGEST_INTERVAL', 900))
+DIGEST_MAX_ITEMS = int(os.environ.get('DIGEST_MAX_ITEMS', 50))
+
+# Optimistic-concurrency retries when another invocation updated the same key first
+MAX_CONFLICTS = 5
+
+Admission = namedtuple('Admission', ['allowed', 'suppressed', 'escalated', 'claims'])
+
+
+def parse_rate_limits(spec):
+    """'disk_cleanup=50/3600,foo=10/60' -> {action: (capacity, refill per second)}."""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        action, _, rate = part.partition('=')
+        capacity, _, seconds = rate.partition('/')
+        limits[action.strip()] = (float(capacity), float(capacity) / float(seconds))
+    return limits
+
+
+class JsonFileState:
+    """Local JSON file stand-in for tests, benchmarks and single-container use; shared by threads, not containers."""
+
+    def __init__(self, path=HEALER_STATE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+            json.dump(data, f, sort_keys=True)
+        os.replace(f.name, self.path)
+
+    def transact(self, key, fn, ttl=None):
+        """Applies fn(doc or None) -> (new doc, result) atomically. Returns result."""
+        with self._lock:
+            data = self._read()
+            doc = data.get(key)
+            new, result = fn(json.loads(json.dumps(doc)) if doc is not None else None)
+            if new != doc:
+                data[key] = new
+                self._write(data)
+            return result
+
+
+class DynamoDbState:
+    """
+    DynamoDB state: one item per key (hash key `key`) with a version checked on every
+    write, so concurrent invocations never lose each other's updates. Items carry an
+    `expires_at` TTL attribute so idle hosts age out of the table.
+    """
+
+    def __init__(self, dynamodb, table=HEALER_STATE_TABLE):
+        self.dynamodb = dynamodb
+        self.table = table
+
+    def transact(self, key, fn, ttl=None):
+        for _ in range(MAX_CONFLICTS):
+            item = self.dynamodb.get_item(TableName=self.table, Key={'key': {'S': key}}, ConsistentRead=True).get('Item')
+            doc = json.loads(item['doc']['S']) if item else None
+            version = int(item['version']['N']) if item else 0
+            new, result = fn(json.loads(json.dumps(doc)) if doc is not None else None)
+            if new == doc:
+                return result
+            new_item = {
+                'key': {'S': key},
+                'doc': {'S': json.dumps(new, sort_keys=True)},
+                'version': {'N': str(version + 1)},
+            }
+            if ttl:
+                new_item['expires_at'] = {'N': str(int(time.time() + ttl))}
+            try:
+                self.dynamodb.put_item(
+                    TableName=self.table,
+                    Item=new_item,
+                    ConditionExpression='attribute_not_exists(#k) OR version = :v',
+                    ExpressionAttributeNames={'#k': 'key'},
+                    ExpressionAttributeValues={':v': {'N': str(version)}},
+                )
+                return result
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        raise RuntimeError(f"Gave up updating {key} after {MAX_CONFLICTS} conflicting writes")
+
+
+def state_from_env(client_factory=boto3.client, kind=None):
+    """Builds the state store selected by HEALER_STATE (dynamodb | file)."""
+    kind = kind or HEALER_STATE
+    if kind == 'dynamodb':
+        return DynamoDbState(client_factory('dynamodb'))
+    if kind == 'file':
+        return JsonFileState()
+    raise ValueError(f"Unknown HEALER_STATE: {kind}")
+
+
+class RemediationGovernor:
+    """
+    Keeps remediations and alerts bounded during alarm storms:
+
+    - per-host cooldowns, so a flapping alarm re-runs its remediation at most once per cooldown
+    - token buckets per action type, capping how many hosts one action touches per period
+    - escalation, once per window, for a host that keeps needing the same remediation
+    - an alert digest: the first alert after a quiet period goes out at once, the rest
+      are held and sent together once DIGEST_INTERVAL has passed
+
+    State lives in a JsonFileState or DynamoDbState so it holds across invocations. If the
+    store fails, remediations are let through rather than silently dropped.
+    """
+
+    def __init__(self, state, cooldowns=None, rate_limits=None, escalation_threshold=ESCALATION_THRESHOLD,
+                 escalation_window=ESCALATION_WINDOW, digest_interval=DIGEST_INTERVAL, clock=time.time):
+        self.state = state
+        self.cooldowns = COOLDOWNS if cooldowns is None else cooldowns
+        self.rate_limits = parse_rate_limits(RATE_LIMITS) if rate_limits is None else rate_limits
+        self.escalation_threshold = escalation_threshold
+        self.escalation_window = escalation_window
+        self.digest_interval = digest_interval
+        self.clock = clock
+
+    def _claim(self, action, resource, now):
+        """Starts the cooldown and records the run. Returns (previous doc or None, escalate) or a suppression reason."""
+        cooldown = self.cooldowns.get(action, 0)
+
+        def claim(doc):
+            doc = doc or {'last': None, 'history': [], 'escalated': None}
+            if cooldown and doc['last'] is not None and now - doc['last'] < cooldown:
+                return doc, 'cooldown'
+            previous = dict(doc, history=list(doc['history']))
+            doc['last'] = now
+            doc['history'] = [t for t in doc['history'] if now - t < self.escalation_window] + [now]
+            escalate = (len(doc['history']) >= self.escalation_threshold
+                        and (doc['escalated'] is None or now - doc['escalated'] >= self.escalation_window))
+            if escalate:
+                doc['escalated'] = now
+            return doc, (previous, escalate)
+
+        return self.state.transact(f"host/{action}/{resource}", claim, ttl=max(cooldown, self.escalation_window))
+
+    def _release(self, action, resource, previous):
+        """Undoes a claim the rate limiter then refused, so the host is not left in cooldown."""
+        self.state.transact(f"host/{action}/{resource}", lambda doc: (previous, None),
+                            ttl=max(self.cooldowns.get(action, 0), self.escalation_window))
+
+    def _take_tokens(self, action, wanted, now):
+        """Takes up to `wanted` tokens from the action's bucket. Returns how many were granted."""
+        if action not in self.rate_limits:
+            return wanted
+        capacity, refill = self.rate_limits[action]
+
+        def take(doc):
+            doc = doc or {'tokens': capacity, 'at': now}
+            tokens = min(capacity, doc['tokens'] + (now - doc['at']) * refill)
+            granted = min(wanted, int(math.floor(tokens)))
+            return {'tokens': tokens - granted, 'at': now}, granted
+
+        return self.state.transact(f"bucket/{action}", take, ttl=int(capacity / refill) if refill else None)
+
+    def admit(self, action, resources):
+        """
+        Decides which of `resources` may be remediated now. Returns an Admission of the
+        allowed resources (in order), {resource: 'cooldown' | 'rate_limited'} for the rest,
+        the allowed resources that just crossed the escalation threshold, and the claims
+        release() needs if a remediation then fails.
+        """
+        now = self.clock()
+        try:
+            claimed, suppressed = OrderedDict(), OrderedDict()
+            for resource in resources:
+                outcome = self._claim(action, resource, now)
+                if isinstance(outcome, str):
+                    suppressed[resource] = outcome
+                else:
+                    claimed[resource] = outcome
+
+            granted = self._take_tokens(action, len(claimed), now) if claimed else 0
+            allowed = list(claimed)[:granted]
+            for resource in list(claimed)[granted:]:
+                self._release(action, resource, claimed[resource][0])
+                suppressed[resource] = 'rate_limited'
+        except Exception as e:
+            logger.error(f"Remediation governor unavailable, allowing {action} on all {len(resources)}: {e}")
+            return Admission(list(resources), {}, [], {})
+
+        escalated = [r for r in allowed if claimed[r][1]]
+        if suppressed:
+            logger.info(f"Governor: {action} allowed on {len(allowed)}, suppressed on {len(suppressed)} "
+                        f"({', '.join(f'{r}: {why}' for r, why in list(suppressed.items())[:10])})")
+        return Admission(allowed, suppressed, escalated, {r: claimed[r][0] for r in allowed})
+
+    def release(self, action, resources, admission):
+        """
+        Ends the cooldown of admitted resources whose remediation failed, so the retry of their
+        record is not skipped as 'cooldown'. The failed run still counts toward escalation.
+        """
+        def restore(previous):
+            def fn(doc):
+                if doc is None:
+                    return doc, None
+                return dict(doc, last=previous['last']), None
+            return fn
+
+        for resource in resources:
+            if resource not in admission.claims:
+                continue
+            try:
+                self.state.transact(f"host/{action}/{resource}", restore(admission.claims[resource]),
+                                    ttl=max(self.cooldowns.get(action, 0), self.escalation_window))
+            except Exception as e:
+                logger.error(f"Could not end the {action} cooldown of {resource}: {e}")
+
+    def notify(self, subject, message):
+        """
+        Returns True if the alert should be published now (first one after a quiet period),
+        False if it was queued for the digest.
+        """
+        if not self.digest_interval:
+            return True
+        now = self.clock()
+
+        def queue(doc):
+            doc = doc or {'sent': None, 'items': [], 'dropped': 0}
+            if not doc['items'] and (doc['sent'] is None or now - doc['sent'] >= self.digest_interval):
+                doc['sent'] = now
+                return doc, True
+            if len(doc['items']) < DIGEST_MAX_ITEMS:
+                doc['items'].append([subject, message[:1000]])
+            else:
+                doc['dropped'] += 1
+            return doc, False
+
+        try:
+            return self.state.transact('digest', queue, ttl=self.digest_interval * 4)
+        except Exception as e:
+            logger.error(f"Alert digest unavailable, sending alert directly: {e}")
+            return True
+
+    def flush(self, force=False):
+        """Takes the held alerts once DIGEST_INTERVAL has passed since the last send. Returns (items, dropped)."""
+        now = self.clock()
+
+        def take(doc):
+            if not doc or not (doc['items'] or doc['dropped']):
+                return doc, ([], 0)
+            if not force and doc['sent'] is not None and now - doc['sent'] < self.digest_interval:
+                return doc, ([], 0)
+            return {'sent': now, 'items': [], 'dropped': 0}, (doc['items'], doc['dropped'])
+
+        return self.state.transact('digest', take, ttl=self.digest_interval * 4)
+
+
+def format_digest(items, dropped):
+    """(subject, message) of one digest alert, alerts grouped under their subjects."""
+    groups = OrderedDict()
+    for subject, message in items:
+        groups.setdefault(subject, []).append(message)
+    total = len(items) + dropped
+    subject = f"Auto-Healer digest: {total} alerts"
+    sections = [f"{s} (x{len(msgs)})\n" + "\n".join(f"  - {m}" for m in msgs) for s, msgs in groups.items()]
+    if dropped:
+        sections.append(f"... and {dropped} more alerts not kept (digest full)")
+    return subject, "\n\n".join(sections)
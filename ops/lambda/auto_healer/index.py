@@ -1,97 +1,288 @@
-import boto3
+from ops_common.coldstart import ColdStart  # first import, so the init timer starts here
+
 import logging
 import json
 
 import os
+import threading
+import time
+from collections import OrderedDict
+
+from ops_common.clients import ClientPool
+from ops_common.metrics import METRICS, sink_from_env
+
+from batch import BatchResult, collect_tasks, is_sqs_batch, partial_batch_response, run_tasks
+from disk_remediation import FAILED_STATUSES, DiskRemediationCoalescer, summarize
+from governor import RemediationGovernor, format_digest, state_from_env
+from sg_index import SecurityGroupIndex
 
 # Setup Logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-ec2 = boto3.client('ec2')
-ssm = boto3.client('ssm')
-sns = boto3.client('sns')
+# Clients: built on first use and kept warm; a CloudTrail event never needs ssm
+CLIENTS = ClientPool()
+METRICS.configure(sink_from_env('emf'))
+CLIENTS.add_hook(METRICS.instrument_client)
+ec2 = CLIENTS.lazy('ec2')
+ssm = CLIENTS.lazy('ssm')
+sns = CLIENTS.lazy('sns')
 
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
+# Seconds of Lambda time kept back after waiting on SSM results, to publish and return
+DEADLINE_MARGIN = int(os.environ.get('DEADLINE_MARGIN', 10))
+
+# Scheduled audits only report existing violations unless this is enabled
+SG_AUDIT_REVOKE = os.environ.get('SG_AUDIT_REVOKE', 'false').lower() == 'true'
+
+DISK_REMEDIATOR = DiskRemediationCoalescer(ssm)
+# Cooldowns, rate limits, escalation and the alert digest, kept in DynamoDB (HEALER_STATE) across invocations
+GOVERNOR = RemediationGovernor(state_from_env(CLIENTS.lazy))
+
+# Kept across warm invocations; batch tasks run on threads, so every use holds SG_LOCK
+SG_INDEX = SecurityGroupIndex()
+SG_LOCK = threading.Lock()
+SG_EVENTS = {
+    'AuthorizeSecurityGroupIngress', 'RevokeSecurityGroupIngress',
+    'ModifySecurityGroupRules', 'DeleteSecurityGroup',
+}
 
+COLD_START = ColdStart(CLIENTS)
+
+@COLD_START.track
+@METRICS.track
 def lambda_handler(event, context):
     """
     The Auto-Healer:
-    Triggered by CloudWatch Alarms via SNS or EventBridge.
+    Triggered by CloudWatch Alarms via SNS or SQS, or by CloudTrail via EventBridge.
+    A scheduled {"action": "audit_security_groups"} event runs a full security group audit,
+    and {"action": "flush_digest"} sends the alerts held back by the governor.
+    SQS batches return partial-batch failures so only failed records are retried.
     """
-    logger.info(f"Received event: {json.dumps(event)}")
-    
     try:
         if 'Records' in event:
-            message = json.loads(event['Records'][0]['Sns']['Message'])
-            alarm_name = message['AlarmName']
-            state_reason = message['NewStateReason']
-            logger.info(f"Alarm: {alarm_name}, Reason: {state_reason}")
-            
-            if "DiskSpace" in alarm_name:
-                instance_id = parse_instance_id(message)
-                if instance_id:
-                    remediate_disk_space(instance_id)
-            
-        elif 'detail-type' in event and event['detail-type'] == 'AWS API Call via CloudTrail':
-             event_name = event['detail']['eventName']
-             if event_name == 'AuthorizeSecurityGroupIngress':
-                 check_security_group_compliance(event['detail'])
+            records = event['Records']
+            logger.info(f"Received batch of {len(records)} records")
+            result = process_records(records, deadline_from(context))
+            flush_digest()
+            if is_sqs_batch(records):
+                return partial_batch_response(result.failed_ids)
+            if result.failed_ids:
+                # SNS has no partial retry; fail the invocation so Lambda retries it
+                raise RuntimeError(f"{len(result.failed_ids)} records failed remediation")
+            return
+
+        logger.info(f"Received event: {json.dumps(event)}")
+        return handle_message(event)
 
     except Exception as e:
         logger.error(f"Error processing event: {e}")
         raise e
 
+def deadline_from(context):
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        return time.time() + context.get_remaining_time_in_millis() / 1000.0 - DEADLINE_MARGIN
+    return None
+
+def process_records(records, deadline=None):
+    """
+    De-duplicates a batch, then coalesces every disk alarm in it into fleet-wide SSM commands
+    while the other remediations run concurrently. The batch is the coalescing window: alarms
+    reach the function through the auto-healer-alarms queue, whose event source mapping
+    collects them for auto_healer_batching_window seconds (ops/terraform/aws/lambda.tf).
+    """
+    tasks, failed = collect_tasks(records, remediation_key)
+    duplicates = sum(len(ids) - 1 for _, ids in tasks.values())
+    METRICS.processed('batch', len(records))
+    METRICS.count('batch_duplicates', duplicates)
+
+    disk_tasks = OrderedDict((k, t) for k, t in tasks.items() if is_disk_alarm(t[0]) and parse_instance_id(t[0]))
+    other_tasks = OrderedDict((k, t) for k, t in tasks.items() if k not in disk_tasks)
+    logger.info(f"Batch of {len(records)} records -> {len(tasks)} remediations "
+                f"({duplicates} duplicates, {len(disk_tasks)} disk alarms coalesced)")
+
+    failed += run_tasks(other_tasks, handle_message)
+
+    if disk_tasks:
+        record_ids = OrderedDict()
+        for message, ids in disk_tasks.values():
+            record_ids.setdefault(parse_instance_id(message), []).extend(ids)
+        try:
+            failed_instances = remediate_disk_fleet(list(record_ids), deadline)
+        except Exception as e:
+            logger.error(f"Fleet disk remediation failed: {e}")
+            failed_instances = list(record_ids)
+        for instance_id in failed_instances:
+            failed.extend(record_ids[instance_id])
+
+    return BatchResult(len(tasks), duplicates, failed)
+
+def is_disk_alarm(message):
+    return "DiskSpace" in message.get('AlarmName', '')
+
+def handle_message(message):
+    """Routes one CloudWatch alarm or CloudTrail event to its remediation."""
+    if 'AlarmName' in message:
+        alarm_name = message['AlarmName']
+        state_reason = message['NewStateReason']
+        logger.info(f"Alarm: {alarm_name}, Reason: {state_reason}")
+
+        if is_disk_alarm(message):
+            instance_id = parse_instance_id(message)
+            if instance_id:
+                remediate_disk_space(instance_id)
+
+    elif message.get('detail-type') == 'AWS API Call via CloudTrail':
+        event_name = message['detail']['eventName']
+        if event_name in SG_EVENTS:
+            check_security_group_compliance(message['detail'])
+
+    elif message.get('action') == 'audit_security_groups':
+        return audit_security_groups()
+
+    elif message.get('action') == 'flush_digest':
+        return flush_digest(force=message.get('force', False))
+
+def remediation_key(message):
+    """Records with the same key within one batch trigger a single remediation."""
+    if 'AlarmName' in message:
+        return ('alarm', message['AlarmName'], parse_instance_id(message))
+    if 'detail' in message:
+        params = message['detail'].get('requestParameters') or {}
+        return ('cloudtrail', message['detail'].get('eventName'), params.get('groupId'),
+                json.dumps(params.get('ipPermissions'), sort_keys=True))
+    return ('raw', json.dumps(message, sort_keys=True))
+
 def parse_instance_id(message):
     """Extracts InstanceId from CloudWatch Alarm message."""
-    metrics = message['Trigger']['Dimensions']
+    metrics = message.get('Trigger', {}).get('Dimensions', [])
     for m in metrics:
         if m['name'] == 'InstanceId':
             return m['value']
     return None
 
 def remediate_disk_space(instance_id):
-    """Cleans /tmp and docker prune via SSM."""
-    logger.info(f"Remediating Disk Space on {instance_id}...")
-    
-    commands = [
-        "rm -rf /tmp/*",
-        "docker system prune -f"
-    ]
-    
-    response = ssm.send_command(
-        InstanceIds=[instance_id],
-        DocumentName="AWS-RunShellScript",
-        Parameters={'commands': commands}
-    )
-    cmd_id = response['Command']['CommandId']
-    logger.info(f"SSM Command Sent: {cmd_id}")
-    
-    publish_alert("Auto-Healer: Disk Space Cleaned", f"Executed cleanup on instance {instance_id}. Command ID: {cmd_id}")
+    """Cleans /tmp and docker prune via SSM on a single instance."""
+    if remediate_disk_fleet([instance_id]):
+        raise RuntimeError(f"Disk cleanup failed on {instance_id}")
+
+def remediate_disk_fleet(instance_ids, deadline=None):
+    """
+    Cleans /tmp and docker prune via SSM on many instances at once, 50 per command.
+    Hosts still in cooldown or over the rate limit are skipped (their alarms count as handled).
+    Alerts with the bytes freed per host; returns the instances whose cleanup failed.
+    """
+    admission = GOVERNOR.admit('disk_cleanup', instance_ids)
+    if admission.escalated:
+        escalate('disk_cleanup', admission.escalated,
+                 "Disk cleanup keeps being needed; the disk is filling faster than /tmp and docker prune can free it.")
+
+    failed = []
+    if admission.allowed:
+        logger.info(f"Remediating Disk Space on {len(admission.allowed)} instances...")
+        with METRICS.phase('disk_remediation'):
+            results = DISK_REMEDIATOR.remediate(admission.allowed, deadline)
+        METRICS.processed('disk_remediation', len(results))
+        METRICS.count('disk_bytes_freed', sum(r.bytes_freed or 0 for r in results.values()))
+        notify("Auto-Healer: Disk Space Cleaned", summarize(results))
+        failed = [r.instance_id for r in results.values() if r.status in FAILED_STATUSES]
+        # The failed records are retried by SQS; a cooldown left in place would drop the retry
+        GOVERNOR.release('disk_cleanup', failed, admission)
+
+    if admission.suppressed:
+        METRICS.count('remediations_suppressed', len(admission.suppressed), action='disk_cleanup')
+        notify("Auto-Healer: Disk Cleanup Suppressed",
+               f"Skipped {len(admission.suppressed)} hosts: " +
+               ", ".join(f"{i} ({why})" for i, why in list(admission.suppressed.items())[:20]))
+    return failed
 
 def check_security_group_compliance(detail):
-    """Revokes 0.0.0.0/0 on Port 22."""
-    sg_id = detail['requestParameters']['groupId']
-    items = detail['requestParameters']['ipPermissions']['items']
-    
-    for item in items:
-        from_port = item.get('fromPort')
-        to_port = item.get('toPort')
-        
-        if from_port == 22 or (from_port <= 22 and to_port >= 22):
-            for ip_range in item.get('ipRanges', {}).get('items', []):
-                if ip_range['cidrIp'] == '0.0.0.0/0':
-                    logger.warning(f"SECURITY VIOLATION: Port 22 open to world on {sg_id}. Revoking...")
-                    revoke_rule(sg_id, item)
-
-def revoke_rule(sg_id, ip_permission):
+    """
+    Applies a CloudTrail change to the rule index, then revokes world access to sensitive ports
+    opened by the rules that change created or modified. Violations that were already there are
+    left to the scheduled audit, which only revokes with SG_AUDIT_REVOKE.
+    """
+    with SG_LOCK, METRICS.phase('security_group_check'):
+        if SG_INDEX.is_stale():
+            with METRICS.phase('security_group_index_load'):
+                SG_INDEX.load(ec2)
+        rule_ids = SG_INDEX.apply_cloudtrail(ec2, detail)
+        violations = SG_INDEX.violations(rule_ids=rule_ids)
+
+    # Revocations are never held back; the governor only tracks groups that keep getting reopened
+    if violations:
+        admission = GOVERNOR.admit('sg_revoke', list(OrderedDict.fromkeys(rule.group_id for _, rule in violations)))
+        if admission.escalated:
+            escalate('sg_revoke', admission.escalated,
+                     "World access to sensitive ports keeps being re-added; find who or what is opening it.")
+
+    for port, rule in violations:
+        logger.warning(f"SECURITY VIOLATION: Port {port} open to {rule.cidr} on {rule.group_id}. Revoking...")
+        revoke_rule(rule, port)
+
+def audit_security_groups():
+    """Full scan of every security group rule, for scheduled audits."""
+    with SG_LOCK, METRICS.phase('security_group_audit'):
+        SG_INDEX.load(ec2)
+        violations = SG_INDEX.violations()
+    METRICS.processed('security_group_audit', len(SG_INDEX))
+
+    if not violations:
+        logger.info(f"Audit: no sensitive ports open to the world across {len(SG_INDEX)} rules")
+        return f"Audited {len(SG_INDEX)} security group rules: no violations."
+
+    lines = [f"- {rule.group_id} ({rule.rule_id}): port {port} open to {rule.cidr}" for port, rule in violations]
+    if SG_AUDIT_REVOKE:
+        for port, rule in violations:
+            revoke_rule(rule, port)
+    action = "revoked" if SG_AUDIT_REVOKE else "found (not revoked, SG_AUDIT_REVOKE=false)"
+    report = f"Audited {len(SG_INDEX)} security group rules: {len(violations)} violations {action}.\n" + "\n".join(lines)
+    logger.warning(report)
+    publish_alert("Auto-Healer: Security Group Audit", report)
+    return report
+
+def revoke_rule(rule, port):
     """Revokes the specific ingress rule."""
     ec2.revoke_security_group_ingress(
-        GroupId=sg_id,
-        IpPermissions=[ip_permission]
+        GroupId=rule.group_id,
+        SecurityGroupRuleIds=[rule.rule_id]
     )
-    logger.info(f"Revoked bad rule on {sg_id}")
-    publish_alert("Auto-Healer: Security Rule Revoked", f"Revoked 0.0.0.0/0 access on Port 22 for Security Group {sg_id}.")
+    with SG_LOCK:
+        SG_INDEX.remove(rule.rule_id)
+    METRICS.count('security_group_rules_revoked', 1)
+    logger.info(f"Revoked bad rule {rule.rule_id} on {rule.group_id}")
+    notify("Auto-Healer: Security Rule Revoked",
+           f"Revoked {rule.cidr} access on Port {port} for Security Group {rule.group_id} (rule {rule.rule_id}).")
+
+def notify(subject, message):
+    """Publishes an alert now, or holds it for the digest if one went out within DIGEST_INTERVAL."""
+    if GOVERNOR.notify(subject, message):
+        publish_alert(subject, message)
+    else:
+        METRICS.count('alerts_digested', 1)
+        logger.info(f"Held for digest: {subject}")
+
+def escalate(action, resources, reason):
+    """Repeat offenders skip the digest: a human needs to look now."""
+    METRICS.count('escalations', len(resources), action=action)
+    logger.warning(f"Escalating {action} on {', '.join(resources)}")
+    publish_alert(f"Auto-Healer ESCALATION: {action} on {len(resources)} resource(s)",
+                  f"🚨 {reason}\n" + "\n".join(
+                      f"- {r}: {GOVERNOR.escalation_threshold}+ times within {GOVERNOR.escalation_window // 3600}h"
+                      for r in resources))
+
+def flush_digest(force=False):
+    """Sends the held alerts as one message once the digest interval has passed."""
+    try:
+        items, dropped = GOVERNOR.flush(force)
+    except Exception as e:
+        logger.error(f"Failed to flush the alert digest: {e}")
+        return None
+    if not items and not dropped:
+        return None
+    subject, message = format_digest(items, dropped)
+    publish_alert(subject, message)
+    return subject
 
 def publish_alert(subject, message):
     """Publishes a message to the SNS Topic."""
@@ -104,3 +295,5 @@ def publish_alert(subject, message):
         logger.info(f"Published SNS Alert: {subject}")
     else:
         logger.warning("SNS_TOPIC_ARN not set. Skipping alert.")
+
+COLD_START.imported()
@@ -0,0 +1,285 @@
+import ipaddress
+import logging
+import os
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict, namedtuple
+
+logger = logging.getLogger()
+
+SENSITIVE_PORTS = [int(p) for p in os.environ.get('SENSITIVE_PORTS', '22').split(',') if p.strip()]
+# Public CIDRs this broad (or broader) count as "the world"; 0 means only 0.0.0.0/0 and ::/0
+WORLD_PREFIX_MAX = int(os.environ.get('WORLD_PREFIX_MAX', 0))
+# A warm container re-reads every rule after this long, in case CloudTrail events were missed
+SG_INDEX_TTL = int(os.environ.get('SG_INDEX_TTL', 900))
+
+PORT_MIN, PORT_MAX = 0, 65535
+PORT_PROTOCOLS = {'tcp', 'udp', '6', '17'}
+ALL_PROTOCOLS = {'-1', 'all'}
+# Broad ranges inside these are internal, not "the world". ipaddress' is_private is no use here:
+# 0.0.0.0/0 and 0.0.0.0/1 start and end on reserved addresses, so 3.9 calls them private
+INTERNAL_RANGES = [ipaddress.ip_network(n) for n in (
+    '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '100.64.0.0/10', '127.0.0.0/8', '169.254.0.0/16',
+    'fc00::/7', 'fe80::/10',
+)]
+
+# One security group rule, normalised from describe_security_group_rules or a CloudTrail responseElement
+Rule = namedtuple('Rule', ['rule_id', 'group_id', 'egress', 'protocol', 'from_port', 'to_port', 'cidr'])
+
+
+def port_range(protocol, from_port, to_port):
+    """
+    Inclusive port interval a rule opens, or None for protocols without ports (ICMP etc.).
+    All-protocol rules and -1/None bounds open the whole range.
+    """
+    protocol = str(protocol).lower()
+    if protocol in ALL_PROTOCOLS:
+        return PORT_MIN, PORT_MAX
+    if protocol not in PORT_PROTOCOLS:
+        return None
+    low = PORT_MIN if from_port is None or from_port < 0 else from_port
+    high = PORT_MAX if to_port is None or to_port < 0 else to_port
+    return min(low, high), max(low, high)
+
+
+def is_world(cidr, prefix_max=WORLD_PREFIX_MAX):
+    """True for 0.0.0.0/0, ::/0 and (with WORLD_PREFIX_MAX) any other very broad public range."""
+    if not cidr:
+        return False
+    try:
+        network = ipaddress.ip_network(cidr, strict=False)
+    except ValueError:
+        return False
+    if network.prefixlen == 0:
+        return True
+    if network.prefixlen > prefix_max:
+        return False
+    return not any(network.version == r.version and network.subnet_of(r) for r in INTERNAL_RANGES)
+
+
+def _modified_rule_ids(request):
+    """Rule ids a ModifySecurityGroupRules request names; CloudTrail logs a single rule as a dict."""
+    items = request.get('SecurityGroupRule') or []
+    if isinstance(items, dict):
+        items = [items]
+    return {item['SecurityGroupRuleId'] for item in items if item.get('SecurityGroupRuleId')}
+
+
+def rule_from_api(item):
+    """Rule from a describe_security_group_rules SecurityGroupRule."""
+    return Rule(item['SecurityGroupRuleId'], item['GroupId'], item.get('IsEgress', False),
+                item.get('IpProtocol', '-1'), item.get('FromPort'), item.get('ToPort'),
+                item.get('CidrIpv4') or item.get('CidrIpv6'))
+
+
+def rule_from_cloudtrail(item):
+    """Rule from a CloudTrail responseElements.securityGroupRuleSet item."""
+    return Rule(item['securityGroupRuleId'], item['groupId'], item.get('isEgress', False),
+                item.get('ipProtocol', '-1'), item.get('fromPort'), item.get('toPort'),
+                item.get('cidrIpv4') or item.get('cidrIpv6'))
+
+
+class _Node:
+    __slots__ = ('center', 'low', 'high', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+        self.center = (low + high) // 2
+        self.by_start = []  # (start, rule_id) ascending
+        self.by_end = []    # (-end, rule_id) ascending, i.e. end descending
+        self.left = self.right = None
+
+
+class PortIntervalTree:
+    """
+    Centered interval tree over the fixed port domain [0, 65535].
+
+    Every node owns the intervals that contain its center, so the tree depth is bounded
+    by log2(65536) = 16 and inserts/removes never need rebalancing. A stabbing query
+    walks one root-to-leaf path and only touches intervals that actually contain the port.
+    """
+
+    def __init__(self):
+        self.root = _Node(PORT_MIN, PORT_MAX)
+        self.intervals = {}
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def _node_for(self, start, end, create):
+        node = self.root
+        while node is not None:
+            if end < node.center:
+                if node.left is None and create:
+                    node.left = _Node(node.low, node.center - 1)
+                node = node.left
+            elif start > node.center:
+                if node.right is None and create:
+                    node.right = _Node(node.center + 1, node.high)
+                node = node.right
+            else:
+                return node
+        return None
+
+    def add(self, rule_id, start, end):
+        if rule_id in self.intervals:
+            self.remove(rule_id)
+        node = self._node_for(start, end, create=True)
+        insort(node.by_start, (start, rule_id))
+        insort(node.by_end, (-end, rule_id))
+        self.intervals[rule_id] = (start, end)
+
+    def remove(self, rule_id):
+        interval = self.intervals.pop(rule_id, None)
+        if interval is None:
+            return
+        start, end = interval
+        node = self._node_for(start, end, create=False)
+        del node.by_start[bisect_left(node.by_start, (start, rule_id))]
+        del node.by_end[bisect_left(node.by_end, (-end, rule_id))]
+
+    def stab(self, port):
+        """Yields the id of every interval containing `port`."""
+        node = self.root
+        while node is not None:
+            if port < node.center:
+                for start, rule_id in node.by_start:
+                    if start > port:
+                        break
+                    yield rule_id
+                node = node.left
+            else:
+                for neg_end, rule_id in node.by_end:
+                    if -neg_end < port:
+                        break
+                    yield rule_id
+                node = node.right if port > node.center else None
+
+
+class SecurityGroupIndex:
+    """
+    In-memory index of every security group rule in the region.
+
+    Only ingress rules open to the world go into the port interval tree, so
+    "is port 22 exposed?" is a single stabbing query however many rules exist.
+    """
+
+    def __init__(self, prefix_max=WORLD_PREFIX_MAX):
+        self.prefix_max = prefix_max
+        self.rules = {}
+        self.by_group = defaultdict(set)
+        self.exposed_tree = PortIntervalTree()
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, rule):
+        self.remove(rule.rule_id)
+        self.rules[rule.rule_id] = rule
+        self.by_group[rule.group_id].add(rule.rule_id)
+        ports = port_range(rule.protocol, rule.from_port, rule.to_port)
+        if not rule.egress and ports and is_world(rule.cidr, self.prefix_max):
+            self.exposed_tree.add(rule.rule_id, *ports)
+
+    def remove(self, rule_id):
+        rule = self.rules.pop(rule_id, None)
+        if rule is None:
+            return
+        self.exposed_tree.remove(rule_id)
+        ids = self.by_group.get(rule.group_id)
+        if ids is not None:
+            ids.discard(rule_id)
+            if not ids:
+                del self.by_group[rule.group_id]
+
+    def remove_group(self, group_id):
+        for rule_id in list(self.by_group.get(group_id, ())):
+            self.remove(rule_id)
+
+    def exposed(self, port, rule_ids=None):
+        """Ingress rules that open `port` to the world, optionally limited to some rule ids."""
+        found = [self.rules[r] for r in self.exposed_tree.stab(port)]
+        if rule_ids is not None:
+            found = [r for r in found if r.rule_id in rule_ids]
+        return found
+
+    def is_exposed(self, port):
+        return next(self.exposed_tree.stab(port), None) is not None
+
+    def violations(self, ports=None, rule_ids=None):
+        """(port, Rule) for every sensitive port exposed to the world, one entry per rule."""
+        seen = set()
+        found = []
+        for port in ports or SENSITIVE_PORTS:
+            for rule in self.exposed(port, rule_ids):
+                if rule.rule_id not in seen:
+                    seen.add(rule.rule_id)
+                    found.append((port, rule))
+        return found
+
+    def load(self, ec2):
+        """Full scan: replaces the index with every rule from paginated describe_security_group_rules."""
+        started = time.time()
+        fresh = SecurityGroupIndex(self.prefix_max)
+        for page in ec2.get_paginator('describe_security_group_rules').paginate(MaxResults=1000):
+            for item in page['SecurityGroupRules']:
+                fresh.add(rule_from_api(item))
+        self.rules, self.by_group, self.exposed_tree = fresh.rules, fresh.by_group, fresh.exposed_tree
+        self.loaded_at = time.time()
+        logger.info(f"Indexed {len(self.rules)} security group rules in {self.loaded_at - started:.1f}s "
+                    f"({len(self.exposed_tree)} open to the world)")
+
+    def refresh_groups(self, ec2, group_ids):
+        """
+        Re-reads the rules of just these groups, e.g. after a CloudTrail change we cannot apply directly.
+        Returns the ids of the rules that are new or differ from what the index held.
+        """
+        group_ids = sorted(set(group_ids))
+        before = {}
+        for group_id in group_ids:
+            before.update((r, self.rules[r]) for r in self.by_group.get(group_id, ()))
+            self.remove_group(group_id)
+        changed = set()
+        # The group-id filter takes at most 200 values
+        for i in range(0, len(group_ids), 200):
+            paginator = ec2.get_paginator('describe_security_group_rules')
+            for page in paginator.paginate(Filters=[{'Name': 'group-id', 'Values': group_ids[i:i + 200]}]):
+                for item in page['SecurityGroupRules']:
+                    rule = rule_from_api(item)
+                    self.add(rule)
+                    if before.get(rule.rule_id) != rule:
+                        changed.add(rule.rule_id)
+        return changed
+
+    def is_stale(self, ttl=SG_INDEX_TTL):
+        return self.loaded_at is None or time.time() - self.loaded_at > ttl
+
+    def apply_cloudtrail(self, ec2, detail):
+        """
+        Applies one CloudTrail security group event. Returns the ids of the rules it created
+        or changed. Authorize events carry the created rules in responseElements; other
+        changes (revoke, modify) re-read the affected group.
+        """
+        event_name = detail.get('eventName')
+        params = detail.get('requestParameters') or {}
+        response = detail.get('responseElements') or {}
+        group_id = params.get('groupId')
+
+        if event_name == 'DeleteSecurityGroup':
+            self.remove_group(group_id)
+            return set()
+
+        created = (response.get('securityGroupRuleSet') or {}).get('items') or []
+        if event_name in ('AuthorizeSecurityGroupIngress', 'AuthorizeSecurityGroupEgress') and created:
+            for item in created:
+                self.add(rule_from_cloudtrail(item))
+            return {item['securityGroupRuleId'] for item in created}
+
+        modify = params.get('ModifySecurityGroupRulesRequest') or {}
+        if not group_id:
+            group_id = modify.get('GroupId')
+        if group_id:
+            # A freshly reloaded index may already hold the modified rules, so the request names them too
+            return self.refresh_groups(ec2, [group_id]) | _modified_rule_ids(modify)
+        return set()
@@ -0,0 +1,100 @@
+"""
+Replays a batch of CloudWatch disk alarms (SNS -> SQS) against the Auto-Healer,
+one record at a time (one SSM command per alarm, fire and forget) versus through the
+concurrent, de-duplicating batch engine that coalesces disk alarms into 50-instance
+SSM commands and waits for each host's result.
+
+    python ops/lambda/bench/bench_auto_healer.py --records 500 --latency 0.02
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'auto_healer'))
+sys.path.insert(0, os.path.join(HERE, '..', 'layers', 'ops_common', 'python'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+os.environ.setdefault('OPS_METRICS_SINK', 'none')
+os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:auto-healer-alerts')
+os.environ.setdefault('DISK_POLL_INTERVAL', '0.1')
+
+from fake_aws import FakeAws, SyntheticFleet  # noqa: E402
+
+import batch  # noqa: E402
+import index  # noqa: E402
+from governor import JsonFileState, RemediationGovernor  # noqa: E402
+
+
+def disk_alarm_batch(records, hosts):
+    """An SQS batch of SNS-enveloped DiskSpace alarms spread over `hosts` instances."""
+    batch_records = []
+    for n in range(records):
+        alarm = {
+            'AlarmName': f"DiskSpace-i-{n % hosts:017x}",
+            'NewStateValue': 'ALARM',
+            'NewStateReason': 'Threshold Crossed: disk_used_percent > 90',
+            'Trigger': {'Dimensions': [{'name': 'InstanceId', 'value': f"i-{n % hosts:017x}"}]},
+        }
+        envelope = {'Type': 'Notification', 'MessageId': f"sns-{n}", 'Message': json.dumps(alarm)}
+        batch_records.append({'eventSource': 'aws:sqs', 'messageId': f"msg-{n:05d}", 'body': json.dumps(envelope)})
+    return {'Records': batch_records}
+
+
+def remediate_per_record(message):
+    """The original remediation: one send_command and one alert for every alarm."""
+    instance_id = index.parse_instance_id(message)
+    response = index.ssm.send_command(
+        InstanceIds=[instance_id],
+        DocumentName="AWS-RunShellScript",
+        Parameters={'commands': ["rm -rf /tmp/*", "docker system prune -f"]}
+    )
+    index.publish_alert("Auto-Healer: Disk Space Cleaned",
+                        f"Executed cleanup on instance {instance_id}. Command ID: {response['Command']['CommandId']}")
+
+
+def remediate_sequentially(records):
+    """Pre-batch behaviour: every record parsed and remediated on its own, one after another."""
+    for record in records:
+        remediate_per_record(batch.parse_record(record)[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=500)
+    parser.add_argument('--hosts', type=int, default=200, help='distinct instances alarming in the batch')
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    event = disk_alarm_batch(args.records, args.hosts)
+
+    runs = [
+        ('per-record', lambda: remediate_sequentially(event['Records'])),
+        ('batched', lambda: index.lambda_handler(event, None)),
+    ]
+    baseline = None
+    for name, run in runs:
+        aws = FakeAws(latency=args.latency, jitter=args.latency / 2)
+        SyntheticFleet(instances=0, dbs=0, nodegroups=0, volumes=0, eips=0).install(aws)
+        aws.attach(index.ec2, index.ssm, index.sns)
+        # Fresh governor state with no rate limit, so both runs remediate every host
+        state = JsonFileState(os.path.join(tempfile.mkdtemp(prefix='bench-healer-'), 'state.json'))
+        index.GOVERNOR = RemediationGovernor(state, rate_limits={})
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        aws.detach(index.ec2, index.ssm, index.sns)
+        baseline = baseline or elapsed
+        print(f"{name:<11} {elapsed:8.2f}s  calls={sum(aws.calls.values()):<5} "
+              f"send_command={aws.calls['ssm:SendCommand']:<5} speedup={baseline / elapsed:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
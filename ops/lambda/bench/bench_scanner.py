@@ -0,0 +1,77 @@
+"""
+Benchmarks the Cost Terminator "stop" sweep with the FleetScanner running
+sequentially (one call at a time, the pre-scanner behaviour) versus concurrently.
+
+    python ops/lambda/bench/bench_scanner.py --resources 1000 --latency 0.02
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'cost_optimizer'))
+sys.path.insert(0, os.path.join(HERE, '..', 'layers', 'ops_common', 'python'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+os.environ.setdefault('OPS_METRICS_SINK', 'none')
+os.environ.setdefault('CAPACITY_STORE', 'file')
+os.environ.setdefault('CAPACITY_FILE', os.path.join(tempfile.mkdtemp(prefix='bench-'), 'capacity.json'))
+
+from fake_aws import FakeAws, SyntheticFleet  # noqa: E402
+
+import index  # noqa: E402
+import tag_index  # noqa: E402
+from scanner import FleetScanner  # noqa: E402
+
+
+def run_sweep(scanner, args):
+    aws = FakeAws(latency=args.latency, jitter=args.latency / 2, throttle_rate=args.throttle_rate)
+    SyntheticFleet(instances=args.resources, dbs=args.resources, nodegroups=args.nodegroups,
+                   volumes=args.resources, eips=args.resources // 10).install(aws)
+    clients = [*index.LOCAL.clients(), index.sns]
+    aws.attach(*clients)
+
+    index.SCANNER = index.LOCAL.scanner = scanner
+    tag_index.invalidate()
+    started = time.perf_counter()
+    result = index.lambda_handler({'action': 'stop'}, None)
+    elapsed = time.perf_counter() - started
+
+    # Detach so the next run starts from a fresh fleet
+    aws.detach(*clients)
+    return elapsed, sum(aws.calls.values()), sum(aws.throttled.values()), result['report']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resources', type=int, default=1000, help='instances, DBs and volumes each')
+    parser.add_argument('--nodegroups', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per simulated API call')
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+
+    runs = [
+        ('sequential', FleetScanner(max_workers=1)),
+        ('concurrent', FleetScanner(max_workers=args.workers)),
+    ]
+    baseline = None
+    reports = []
+    for name, scanner in runs:
+        elapsed, calls, throttled, report = run_sweep(scanner, args)
+        baseline = baseline or elapsed
+        reports.append(report)
+        print(f"{name:<11} {elapsed:8.2f}s  calls={calls:<6} throttled={throttled:<5} speedup={baseline / elapsed:5.1f}x")
+
+    print(f"report strings identical: {len(set(reports)) == 1}")
+
+
+if __name__ == '__main__':
+    main()
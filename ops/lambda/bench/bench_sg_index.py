@@ -0,0 +1,81 @@
+"""
+Builds the security group compliance index from a synthetic region and times
+"is a sensitive port open to the world?" queries against a linear scan of every rule.
+
+    python ops/lambda/bench/bench_sg_index.py --rules 50000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'auto_healer'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+import boto3  # noqa: E402
+
+from fake_aws import FakeAws, SyntheticFleet  # noqa: E402
+
+from sg_index import SecurityGroupIndex, is_world, port_range  # noqa: E402
+
+
+def linear_exposed(rules, port):
+    """What answering the question without an index costs: look at every rule."""
+    found = []
+    for rule in rules:
+        ports = port_range(rule.protocol, rule.from_port, rule.to_port)
+        if not rule.egress and ports and ports[0] <= port <= ports[1] and is_world(rule.cidr):
+            found.append(rule)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    aws = FakeAws(latency=args.latency, page_size=1000)
+    fleet = SyntheticFleet(instances=0, dbs=0, nodegroups=0, volumes=0, eips=0, sg_rules=args.rules)
+    fleet.install(aws)
+    ec2 = aws.attach(boto3.client('ec2'))
+
+    index = SecurityGroupIndex()
+    started = time.perf_counter()
+    index.load(ec2)
+    print(f"load        {time.perf_counter() - started:8.2f}s  rules={len(index)} "
+          f"world-open={len(index.exposed_tree)} calls={sum(aws.calls.values())}")
+
+    ports = [(22, 3389, 443, 5432, 8080, 30500)[n % 6] for n in range(args.queries)]
+    rules = list(index.rules.values())
+    # The linear scan parses every CIDR on every query, so it only gets a sample
+    for name, query, sample in (('linear', lambda p: linear_exposed(rules, p), ports[:12]),
+                                ('indexed', index.exposed, ports)):
+        started = time.perf_counter()
+        hits = sum(len(query(p)) for p in sample)
+        per_query = (time.perf_counter() - started) / len(sample)
+        print(f"{name:<11} {per_query * 1e6:8.1f}us/query  queries={len(sample)} hits={hits}")
+
+    # Incremental path: one CloudTrail authorize opening SSH to the world
+    detail = {
+        'eventName': 'AuthorizeSecurityGroupIngress',
+        'requestParameters': {'groupId': 'sg-00000000000000001'},
+        'responseElements': {'securityGroupRuleSet': {'items': [{
+            'securityGroupRuleId': 'sgr-bench', 'groupId': 'sg-00000000000000001', 'isEgress': False,
+            'ipProtocol': 'tcp', 'fromPort': 22, 'toPort': 22, 'cidrIpv4': '0.0.0.0/0'}]}},
+    }
+    started = time.perf_counter()
+    rule_ids = index.apply_cloudtrail(ec2, detail)
+    violations = index.violations(rule_ids=rule_ids)
+    print(f"cloudtrail  {(time.perf_counter() - started) * 1e6:8.1f}us  violations={[r.rule_id for _, r in violations]}")
+
+
+if __name__ == '__main__':
+    main()
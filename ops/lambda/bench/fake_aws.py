@@ -0,0 +1,537 @@
+"""
+Synthetic AWS backend for benchmarking the ops Lambdas offline.
+
+Real boto3 clients are kept (parameter validation, paginators, waiters all behave as
+in production) but every call is answered from an in-memory fleet through botocore's
+``before-call`` hook, the same mechanism botocore's Stubber uses. Unlike Stubber it
+does not depend on call order, so it is safe to drive from thread pools.
+"""
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import botocore.session
+from botocore.awsrequest import AWSResponse
+
+_PAGINATOR_MODELS = {}
+_PAGINATOR_LOCK = threading.Lock()
+
+
+def _paginator_config(service, operation):
+    with _PAGINATOR_LOCK:
+        if service not in _PAGINATOR_MODELS:
+            try:
+                _PAGINATOR_MODELS[service] = botocore.session.get_session().get_paginator_model(service)
+            except Exception:
+                _PAGINATOR_MODELS[service] = None
+    model = _PAGINATOR_MODELS[service]
+    if model is None:
+        return None
+    try:
+        return model.get_paginator(operation)
+    except ValueError:
+        return None
+
+
+def _error(code, message, status=400):
+    parsed = {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}}
+    return AWSResponse(None, status, {}, None), parsed
+
+
+class FakeAws:
+    """
+    Routes (service, operation) pairs to Python handlers with injectable latency and throttling.
+
+    Handlers receive the validated request params and return the *unpaginated* response;
+    FakeAws slices the result key into pages using botocore's own paginator model.
+
+    Answering in before-call skips botocore's retry loop, so throttles are retried here
+    instead, up to max_attempts like the clients' standard mode, and reported through
+    RetryAttempts.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle_rate=0.0, page_size=100, seed=0, max_attempts=5,
+                 retry_delay=0.01):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.page_size = page_size
+        self.calls = Counter()
+        self.throttled = Counter()
+        self._routes = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def route(self, service, operation):
+        """Decorator registering a handler for e.g. ('ec2', 'DescribeInstances')."""
+        def register(fn):
+            self._routes[(service, operation)] = fn
+            return fn
+        return register
+
+    def attach(self, *clients):
+        """Short-circuits every call made by the given boto3 clients into this backend."""
+        for client in clients:
+            client.meta.events.register('before-parameter-build', self._capture_params)
+            client.meta.events.register('before-call', self._on_call)
+        return clients[0] if len(clients) == 1 else clients
+
+    def detach(self, *clients):
+        for client in clients:
+            client.meta.events.unregister('before-parameter-build', self._capture_params)
+            client.meta.events.unregister('before-call', self._on_call)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled.clear()
+
+    def _capture_params(self, params, context, **kwargs):
+        # before-call only sees the serialized request, so keep the API-level params around
+        context['fake_aws_params'] = dict(params)
+
+    def _on_call(self, model, context, **kwargs):
+        params = context.get('fake_aws_params', {})
+        service = model.service_model.service_name
+        operation = model.name
+        key = f"{service}:{operation}"
+
+        for attempt in range(self.max_attempts):
+            with self._lock:
+                self.calls[key] += 1
+                throttle = self.throttle_rate and self._random.random() < self.throttle_rate
+                delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+                if throttle:
+                    self.throttled[key] += 1
+            if delay:
+                time.sleep(delay)
+            if not throttle:
+                break
+            if attempt + 1 < self.max_attempts:
+                time.sleep(self._random.uniform(0, self.retry_delay * 2 ** attempt))
+        else:
+            return _error('Throttling', 'Rate exceeded')
+
+        handler = self._routes.get((service, operation))
+        if handler is None:
+            return _error('UnsupportedOperation', f"FakeAws has no route for {key}")
+
+        try:
+            response = handler(params) or {}
+        except FakeAwsError as e:
+            return _error(e.code, str(e))
+
+        response = self._page(service, operation, params, response)
+        response.setdefault('ResponseMetadata', {'HTTPStatusCode': 200, 'RetryAttempts': attempt})
+        return AWSResponse(None, 200, {}, None), response
+
+    def _page(self, service, operation, params, response):
+        config = _paginator_config(service, operation)
+        if not config or not isinstance(config.get('result_key'), str):
+            return response
+
+        result_key = config['result_key']
+        items = response.get(result_key, [])
+        start = int(params.get(config['input_token']) or 0)
+        size = int(params.get(config.get('limit_key'), 0) or self.page_size)
+        response[result_key] = items[start:start + size]
+        if start + size < len(items):
+            response[config['output_token']] = str(start + size)
+        return response
+
+
+class FakeAwsError(Exception):
+    """Raised by route handlers to return an AWS error code to the caller."""
+
+    def __init__(self, code, message=''):
+        super().__init__(message or code)
+        self.code = code
+
+
+def _tags(d):
+    return [{'Key': k, 'Value': v} for k, v in d.items()]
+
+
+def _matches(filters, values):
+    """Applies EC2-style Filters against a flat dict of filterable attributes."""
+    for f in filters or []:
+        if values.get(f['Name']) not in f['Values']:
+            return False
+    return True
+
+
+def _matches_tag_filters(tag_filters, tags):
+    """Applies Resource Groups Tagging API TagFilters (key must exist, value in Values if given)."""
+    for f in tag_filters or []:
+        if f['Key'] not in tags or (f.get('Values') and tags[f['Key']] not in f['Values']):
+            return False
+    return True
+
+
+class SyntheticFleet:
+    """
+    A deterministic dev/prod fleet of EC2 instances, RDS instances, EKS node groups,
+    EBS volumes and snapshots, Elastic IPs, ENIs and security group rules, wired into a FakeAws backend.
+    """
+
+    def __init__(self, instances=100, dbs=100, nodegroups=10, volumes=100, eips=20, sg_rules=0,
+                 snapshots=0, enis=0, amis=0,
+                 dev_ratio=0.5, cluster='amazon-cluster', account='123456789012', region='us-east-1', seed=0):
+        rnd = random.Random(seed)
+        self.cluster = cluster
+        self.account = account
+        self.region = region
+
+        self.instances = {}
+        for n in range(instances):
+            iid = f"i-{n:017x}"
+            env = 'Dev' if rnd.random() < dev_ratio else 'Prod'
+            self.instances[iid] = {
+                'InstanceId': iid,
+                'InstanceType': rnd.choice(['t3.micro', 't3.large', 'm5.large', 'm5.xlarge', 'c5.2xlarge']),
+                'State': {'Name': 'running'},
+                'InstanceLifecycle': 'spot' if rnd.random() < 0.1 else None,
+                'HibernationOptions': {'Configured': n % 4 == 0},
+                'Tags': _tags({'Environment': env, 'Name': f"node-{n}"}),
+            }
+
+        self.dbs = {}
+        for n in range(dbs):
+            db_id = f"db-{n:05d}"
+            env = 'Dev' if rnd.random() < dev_ratio else 'Prod'
+            self.dbs[db_id] = {
+                'DBInstanceIdentifier': db_id,
+                'DBInstanceArn': f"arn:aws:rds:{region}:{account}:db:{db_id}",
+                'DBInstanceStatus': 'available',
+                'Tags': {'Environment': env},
+            }
+
+        self.nodegroups = {
+            f"ng-{n:03d}": {'minSize': 1 + n % 3, 'maxSize': 10, 'desiredSize': 2 + n % 4}
+            for n in range(nodegroups)
+        }
+        self.asgs = {
+            f"eks-{ng}": {'AutoScalingGroupName': f"eks-{ng}", 'MinSize': scaling['minSize'],
+                          'MaxSize': scaling['maxSize'], 'DesiredCapacity': scaling['desiredSize']}
+            for ng, scaling in self.nodegroups.items()
+        }
+
+        self.volumes = {}
+        for n in range(volumes):
+            vid = f"vol-{n:017x}"
+            tags = {}
+            if n % 10 == 0:
+                tags['kubernetes.io/created-for/pvc/name'] = f"data-{n}"
+            if n % 15 == 0:
+                tags['DoNotDelete'] = 'true'
+            self.volumes[vid] = {
+                'VolumeId': vid,
+                'Size': rnd.choice([8, 20, 100, 500]),
+                'VolumeType': rnd.choice(['gp2', 'gp3', 'io1', 'st1']),
+                'State': 'available' if n % 3 else 'in-use',
+                'CreateTime': datetime(2024, 1, 1, tzinfo=timezone.utc),
+                'Tags': _tags(tags),
+            }
+
+        self.eips = {}
+        for n in range(eips):
+            alloc = f"eipalloc-{n:017x}"
+            eip = {'AllocationId': alloc, 'PublicIp': f"203.0.113.{n % 250}"}
+            if n % 2:
+                eip['AssociationId'] = f"eipassoc-{n:017x}"
+            self.eips[alloc] = eip
+
+        # Half the snapshots are over a year old; the first `amis` back a registered image
+        self.snapshots = {}
+        for n in range(snapshots):
+            sid = f"snap-{n:017x}"
+            self.snapshots[sid] = {
+                'SnapshotId': sid,
+                'VolumeId': f"vol-{n:017x}",
+                'VolumeSize': rnd.choice([8, 20, 100, 500]),
+                'StartTime': datetime(2023, 1, 1, tzinfo=timezone.utc) if n % 2 else datetime.now(timezone.utc),
+                'State': 'completed',
+                'OwnerId': account,
+                'StorageTier': 'standard',
+                'Tags': _tags(dict({'Environment': 'Dev'} if n % 5 else {},
+                                   **({'DoNotDelete': 'true'} if n % 25 == 0 else {}))),
+            }
+        self.images = {
+            f"ami-{n:017x}": {'ImageId': f"ami-{n:017x}", 'OwnerId': account, 'State': 'available',
+                              'BlockDeviceMappings': [{'DeviceName': '/dev/xvda',
+                                                       'Ebs': {'SnapshotId': f"snap-{n:017x}"}}]}
+            for n in range(min(amis, snapshots))
+        }
+
+        self.enis = {}
+        for n in range(enis):
+            eni_id = f"eni-{n:017x}"
+            self.enis[eni_id] = {
+                'NetworkInterfaceId': eni_id,
+                'Status': 'available' if n % 3 == 0 else 'in-use',
+                'InterfaceType': 'nat_gateway' if n % 10 == 0 else 'interface',
+                'RequesterManaged': n % 10 == 0,
+                'Description': f"aws-K8S-{n:08x}",
+                'TagSet': [],
+            }
+
+        # Mostly private or narrow rules; about 1 in 500 opens a port range to the world
+        self.sg_rules = {}
+        for n in range(sg_rules):
+            low = rnd.choice([22, 80, 443, 3306, 5432, 8000, 10000, 30000])
+            rule = {
+                'SecurityGroupRuleId': f"sgr-{n:017x}",
+                'GroupId': f"sg-{n // 20:017x}",
+                'IsEgress': n % 7 == 0,
+                'IpProtocol': rnd.choice(['tcp', 'tcp', 'udp', '-1', 'icmp']),
+                'FromPort': low,
+                'ToPort': low + rnd.choice([0, 0, 10, 1000]),
+            }
+            if rnd.random() < 0.002:
+                rule['CidrIpv6' if n % 2 else 'CidrIpv4'] = '::/0' if n % 2 else '0.0.0.0/0'
+            else:
+                rule['CidrIpv4'] = f"10.{n % 256}.{(n // 256) % 256}.0/24"
+            self.sg_rules[rule['SecurityGroupRuleId']] = rule
+
+        self.commands = []
+
+    def install(self, aws):
+        """Registers every route this fleet can answer on a FakeAws backend."""
+
+        @aws.route('ec2', 'DescribeInstances')
+        def describe_instances(params):
+            found = []
+            for i in self.instances.values():
+                attrs = {
+                    'instance-state-name': i['State']['Name'],
+                    'instance-lifecycle': i['InstanceLifecycle'] or 'on-demand',
+                }
+                attrs.update({f"tag:{t['Key']}": t['Value'] for t in i['Tags']})
+                if _matches(params.get('Filters'), attrs):
+                    found.append({'ReservationId': f"r-{i['InstanceId'][2:]}", 'Instances': [self._instance_view(i)]})
+            return {'Reservations': found}
+
+        @aws.route('ec2', 'StopInstances')
+        def stop_instances(params):
+            return {'StoppingInstances': [self._transition(iid, 'stopped') for iid in params['InstanceIds']]}
+
+        @aws.route('ec2', 'StartInstances')
+        def start_instances(params):
+            return {'StartingInstances': [self._transition(iid, 'running') for iid in params['InstanceIds']]}
+
+        @aws.route('ec2', 'DescribeInstanceStatus')
+        def describe_instance_status(params):
+            statuses = []
+            for iid in params.get('InstanceIds') or list(self.instances):
+                state = self.instances[iid]['State']['Name']
+                if state != 'running' and not params.get('IncludeAllInstances'):
+                    continue
+                ok = {'Status': 'ok' if state == 'running' else 'not-applicable'}
+                statuses.append({'InstanceId': iid, 'InstanceState': {'Name': state},
+                                 'InstanceStatus': dict(ok), 'SystemStatus': dict(ok)})
+            return {'InstanceStatuses': statuses}
+
+        @aws.route('ec2', 'DescribeVolumes')
+        def describe_volumes(params):
+            return {'Volumes': [dict(v) for v in self.volumes.values()
+                                if _matches(params.get('Filters'), {'status': v['State']})]}
+
+        @aws.route('ec2', 'DeleteVolume')
+        def delete_volume(params):
+            if self.volumes.pop(params['VolumeId'], None) is None:
+                raise FakeAwsError('InvalidVolume.NotFound', params['VolumeId'])
+            return {}
+
+        @aws.route('ec2', 'DescribeSnapshots')
+        def describe_snapshots(params):
+            return {'Snapshots': [dict(s) for s in self.snapshots.values()
+                                  if _matches(params.get('Filters'), {f"tag:{t['Key']}": t['Value'] for t in s['Tags']})]}
+
+        @aws.route('ec2', 'DeleteSnapshot')
+        def delete_snapshot(params):
+            if params['SnapshotId'] in {m['Ebs']['SnapshotId'] for i in self.images.values()
+                                        for m in i['BlockDeviceMappings']}:
+                raise FakeAwsError('InvalidSnapshot.InUse', params['SnapshotId'])
+            if self.snapshots.pop(params['SnapshotId'], None) is None:
+                raise FakeAwsError('InvalidSnapshot.NotFound', params['SnapshotId'])
+            return {}
+
+        @aws.route('ec2', 'DescribeImages')
+        def describe_images(params):
+            return {'Images': [dict(i) for i in self.images.values()]}
+
+        @aws.route('ec2', 'DescribeNetworkInterfaces')
+        def describe_network_interfaces(params):
+            return {'NetworkInterfaces': [dict(e) for e in self.enis.values()
+                                          if _matches(params.get('Filters'), {'status': e['Status']})]}
+
+        @aws.route('ec2', 'DeleteNetworkInterface')
+        def delete_network_interface(params):
+            if self.enis.pop(params['NetworkInterfaceId'], None) is None:
+                raise FakeAwsError('InvalidNetworkInterfaceID.NotFound', params['NetworkInterfaceId'])
+            return {}
+
+        @aws.route('ec2', 'DescribeAddresses')
+        def describe_addresses(params):
+            return {'Addresses': [dict(e) for e in self.eips.values()]}
+
+        @aws.route('ec2', 'ReleaseAddress')
+        def release_address(params):
+            self.eips.pop(params['AllocationId'], None)
+            return {}
+
+        @aws.route('rds', 'DescribeDBInstances')
+        def describe_db_instances(params):
+            wanted = {v for f in params.get('Filters', []) if f['Name'] == 'db-instance-id' for v in f['Values']}
+            dbs = [db for db in self.dbs.values()
+                   if params.get('DBInstanceIdentifier') in (None, db['DBInstanceIdentifier'])
+                   and (not wanted or db['DBInstanceIdentifier'] in wanted)]
+            return {'DBInstances': [{k: v for k, v in db.items() if k != 'Tags'} for db in dbs]}
+
+        @aws.route('rds', 'ListTagsForResource')
+        def list_tags_for_resource(params):
+            db_id = params['ResourceName'].rsplit(':', 1)[-1]
+            return {'TagList': _tags(self.dbs[db_id]['Tags'])}
+
+        @aws.route('rds', 'StopDBInstance')
+        def stop_db_instance(params):
+            return {'DBInstance': self._db_transition(params['DBInstanceIdentifier'], 'available', 'stopped')}
+
+        @aws.route('rds', 'StartDBInstance')
+        def start_db_instance(params):
+            return {'DBInstance': self._db_transition(params['DBInstanceIdentifier'], 'stopped', 'available')}
+
+        @aws.route('resourcegroupstaggingapi', 'GetResources')
+        def get_resources(params):
+            mappings = []
+            if 'rds:db' in params.get('ResourceTypeFilters', ['rds:db']):
+                for db in self.dbs.values():
+                    if db['Tags'] and _matches_tag_filters(params.get('TagFilters'), db['Tags']):
+                        mappings.append({'ResourceARN': db['DBInstanceArn'], 'Tags': _tags(db['Tags'])})
+            return {'ResourceTagMappingList': mappings}
+
+        @aws.route('eks', 'ListNodegroups')
+        def list_nodegroups(params):
+            return {'nodegroups': list(self.nodegroups)}
+
+        @aws.route('eks', 'DescribeNodegroup')
+        def describe_nodegroup(params):
+            ng = params['nodegroupName']
+            return {'nodegroup': {
+                'nodegroupName': ng,
+                'clusterName': params['clusterName'],
+                'status': 'ACTIVE',
+                'scalingConfig': dict(self.nodegroups[ng]),
+                'resources': {'autoScalingGroups': [{'name': f"eks-{ng}"}]},
+            }}
+
+        @aws.route('eks', 'UpdateNodegroupConfig')
+        def update_nodegroup_config(params):
+            ng = params['nodegroupName']
+            self.nodegroups[ng].update(params.get('scalingConfig', {}))
+            self.asgs[f"eks-{ng}"].update(MinSize=self.nodegroups[ng]['minSize'], DesiredCapacity=self.nodegroups[ng]['desiredSize'])
+            return {'update': {'id': f"upd-{params['nodegroupName']}", 'status': 'InProgress', 'type': 'ConfigUpdate'}}
+
+        @aws.route('autoscaling', 'DescribeAutoScalingGroups')
+        def describe_auto_scaling_groups(params):
+            names = params.get('AutoScalingGroupNames') or list(self.asgs)
+            groups = []
+            for name in names:
+                if name not in self.asgs:
+                    continue
+                group = dict(self.asgs[name])
+                group['Instances'] = [
+                    {'InstanceId': f"i-{name}-{n}", 'LifecycleState': 'InService'}
+                    for n in range(group['DesiredCapacity'])
+                ]
+                groups.append(group)
+            return {'AutoScalingGroups': groups}
+
+        @aws.route('cloudwatch', 'GetMetricData')
+        def get_metric_data(params):
+            results = []
+            for q in params['MetricDataQueries']:
+                stat = q['MetricStat']
+                period = stat['Period']
+                dims = {d['Name']: d['Value'] for d in stat['Metric']['Dimensions']}
+                # Stable per-instance load level so repeated runs produce the same recommendations
+                load = (sum(ord(c) for c in dims.get('InstanceId', '')) % 60) + 1
+                timestamps, values = [], []
+                t = params['StartTime']
+                while t < params['EndTime']:
+                    timestamps.append(t)
+                    values.append(load * (0.5 + 0.5 * ((t.hour % 24) / 23)) * (1 if stat['Metric']['MetricName'] == 'CPUUtilization' else 1e5))
+                    t += timedelta(seconds=period)
+                results.append({'Id': q['Id'], 'Label': stat['Metric']['MetricName'], 'Timestamps': timestamps,
+                                'Values': values, 'StatusCode': 'Complete'})
+            return {'MetricDataResults': results}
+
+        @aws.route('ssm', 'SendCommand')
+        def send_command(params):
+            self.commands.append(dict(params, polls=0))
+            return {'Command': {'CommandId': f"00000000-0000-0000-0000-{len(self.commands):012d}", 'InstanceIds': params.get('InstanceIds', []),
+                                'Status': 'Pending'}}
+
+        @aws.route('ssm', 'ListCommandInvocations')
+        def list_command_invocations(params):
+            # Every command reports InProgress on its first poll, then Success with the bytes freed
+            command = self.commands[int(params['CommandId'].split('-')[-1]) - 1]
+            command['polls'] += 1
+            done = command['polls'] > 1
+            invocations = []
+            for instance_id in command.get('InstanceIds', []):
+                freed = (int(instance_id[-6:], 16) % 4096 + 1) * 1024 * 1024
+                invocations.append({
+                    'CommandId': params['CommandId'],
+                    'InstanceId': instance_id,
+                    'Status': 'Success' if done else 'InProgress',
+                    'CommandPlugins': [{'Name': 'aws:runShellScript',
+                                        'Output': f"BYTES_FREED={freed}\n" if done else ''}],
+                })
+            return {'CommandInvocations': invocations}
+
+        @aws.route('ec2', 'DescribeSecurityGroupRules')
+        def describe_security_group_rules(params):
+            groups = set()
+            for f in params.get('Filters', []):
+                if f['Name'] == 'group-id':
+                    groups.update(f['Values'])
+            return {'SecurityGroupRules': [r for r in self.sg_rules.values() if not groups or r['GroupId'] in groups]}
+
+        @aws.route('ec2', 'RevokeSecurityGroupIngress')
+        def revoke_security_group_ingress(params):
+            for rule_id in params.get('SecurityGroupRuleIds', []):
+                self.sg_rules.pop(rule_id, None)
+            return {'Return': True}
+
+        @aws.route('lambda', 'Invoke')
+        def invoke(params):
+            return {'StatusCode': 202}
+
+        @aws.route('sns', 'Publish')
+        def publish(params):
+            return {'MessageId': 'fake-message'}
+
+        return aws
+
+    def _instance_view(self, i):
+        view = {k: v for k, v in i.items() if v is not None}
+        view['State'] = dict(i['State'])
+        return view
+
+    def _transition(self, iid, state):
+        i = self.instances[iid]
+        previous = i['State']['Name']
+        i['State'] = {'Name': state}
+        return {'InstanceId': iid, 'PreviousState': {'Name': previous}, 'CurrentState': {'Name': state}}
+
+    def _db_transition(self, db_id, expected, state):
+        db = self.dbs[db_id]
+        if db['DBInstanceStatus'] != expected:
+            raise FakeAwsError('InvalidDBInstanceState', f"{db_id} is {db['DBInstanceStatus']}")
+        db['DBInstanceStatus'] = state
+        return {k: v for k, v in db.items() if k != 'Tags'}
@@ -0,0 +1,266 @@
+"""
+Replays recorded EventBridge / SNS / SQS / CloudTrail payloads against the ops Lambdas
+on synthetic fleets of several sizes, with injected per-call latency and throttling.
+
+Each (payload, fleet size) run reports wall-clock time, API calls by operation,
+throttled calls, peak Python memory and the headroom left before the function's
+configured timeout. Results are written as JSON; --compare prints the deltas
+against an earlier results file.
+
+    python ops/lambda/bench/replay.py --sizes 10 100 1000 10000 --latency 0.02 --output results.json
+    python ops/lambda/bench/replay.py --payloads 'auto_healer_*' --compare results.json
+"""
+import argparse
+import contextlib
+import fnmatch
+import io
+import importlib.util
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PAYLOAD_DIR = os.path.join(HERE, 'payloads')
+FUNCTIONS = {
+    # name -> (source dir, timeout from ops/terraform/aws/lambda.tf)
+    'cost_optimizer': (os.path.join(HERE, '..', 'cost_optimizer'), 300),
+    'auto_healer': (os.path.join(HERE, '..', 'auto_healer'), 60),
+}
+for source, _ in FUNCTIONS.values():
+    sys.path.insert(0, source)
+# What the ops_common Lambda layer provides under /opt/python
+sys.path.insert(0, os.path.join(HERE, '..', 'layers', 'ops_common', 'python'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:bench-alerts')
+os.environ.setdefault('CAPACITY_STORE', 'file')
+os.environ.setdefault('WARMUP_POLL_DELAY', '1')
+os.environ.setdefault('DISK_POLL_INTERVAL', '0.1')
+os.environ.setdefault('OPS_METRICS_SINK', 'emf')
+
+from botocore.client import BaseClient  # noqa: E402
+
+from fake_aws import FakeAws, SyntheticFleet  # noqa: E402
+from ops_common.clients import LazyClient, unwrap  # noqa: E402
+
+_MODULES = {}
+
+
+def load_function(name):
+    """
+    Imports a Lambda's index.py under a unique module name; both functions use
+    index.lambda_handler, so a plain `import index` would only ever load one of them.
+    """
+    if name not in _MODULES:
+        source, _ = FUNCTIONS[name]
+        spec = importlib.util.spec_from_file_location(f"{name}_index", os.path.join(source, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _MODULES[name] = module
+        # The handlers set the root logger to INFO at import time
+        logging.getLogger().setLevel(logging.ERROR)
+    return _MODULES[name]
+
+
+def clients_of(module):
+    found = []
+    for value in vars(module).values():
+        if isinstance(value, (BaseClient, LazyClient)):
+            found.append(unwrap(value))
+        elif type(value).__name__ == 'Target':
+            found.extend(unwrap(c) for c in value.clients())
+    return list({id(c): c for c in found}.values())
+
+
+def reset_state(name, module, workdir):
+    """Drops caches a warm container would carry over, so every run starts cold."""
+    if name == 'cost_optimizer':
+        import tag_index
+        from capacity_store import CapacitySnapshotStore, JsonFileBackend
+        from scanner import FleetScanner
+        tag_index.invalidate()
+        module.SCANNER = module.LOCAL.scanner = FleetScanner()
+        module.CAPACITY = CapacitySnapshotStore(JsonFileBackend(os.path.join(workdir, 'capacity.json')))
+    elif name == 'auto_healer':
+        from governor import JsonFileState, RemediationGovernor
+        from sg_index import SecurityGroupIndex
+        module.SG_INDEX = SecurityGroupIndex()
+        module.GOVERNOR = RemediationGovernor(JsonFileState(os.path.join(workdir, 'healer-state.json')))
+
+
+class FakeContext:
+    """The parts of the Lambda context object the handlers use."""
+
+    def __init__(self, name, timeout):
+        self.function_name = name
+        self.invoked_function_arn = f"arn:aws:lambda:us-east-1:123456789012:function:{name}"
+        self.aws_request_id = 'replay'
+        self.timeout = timeout
+        self.started = time.time()
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.timeout - (time.time() - self.started)) * 1000))
+
+
+def load_payloads(patterns):
+    found = []
+    for filename in sorted(os.listdir(PAYLOAD_DIR)):
+        stem = filename[:-len('.json')]
+        if filename.endswith('.json') and any(fnmatch.fnmatch(stem, p) for p in patterns):
+            with open(os.path.join(PAYLOAD_DIR, filename)) as f:
+                found.append((stem, json.load(f)))
+    return found
+
+
+def fleet_for(size, seed):
+    """Every resource type scales with `size`; security groups hold 10 rules each."""
+    return SyntheticFleet(instances=size, dbs=size, nodegroups=max(1, size // 100), volumes=size,
+                          eips=max(1, size // 10), sg_rules=size * 10, snapshots=size, enis=size // 2,
+                          amis=size // 20, seed=seed)
+
+
+def _json_safe(value, limit=2000):
+    text = json.dumps(value, default=str)
+    return value if len(text) <= limit else text[:limit] + '… (truncated)'
+
+
+def replay(stem, payload, size, args):
+    name = payload['function']
+    module = load_function(name)
+    _, timeout = FUNCTIONS[name]
+
+    aws = FakeAws(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate, seed=args.seed)
+    fleet_for(size, args.seed).install(aws)
+    clients = clients_of(module)
+    aws.attach(*clients)
+
+    events = []
+    phases = {}
+    with tempfile.TemporaryDirectory(prefix='replay-') as workdir:
+        reset_state(name, module, workdir)
+        if args.memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        for event in payload['events']:
+            event_started = time.perf_counter()
+            context = FakeContext(name, timeout)
+            # Keeps the handlers' Embedded Metric Format lines out of the replay output
+            emf_out = io.StringIO()
+            with contextlib.redirect_stdout(emf_out):
+                try:
+                    result, error = module.lambda_handler(event, context), None
+                except Exception as e:
+                    result, error = None, f"{type(e).__name__}: {e}"
+            for phase, ms in phase_durations(emf_out.getvalue()).items():
+                phases[phase] = round(phases.get(phase, 0.0) + ms, 1)
+            events.append({
+                'wall_s': round(time.perf_counter() - event_started, 4),
+                'error': error,
+                'result': _json_safe(result),
+            })
+        wall = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+        if args.memory:
+            tracemalloc.stop()
+    aws.detach(*clients)
+
+    slowest = max(e['wall_s'] for e in events)
+    return {
+        'payload': stem,
+        'function': name,
+        'fleet_size': size,
+        'wall_s': round(wall, 4),
+        'events': events,
+        'errors': sum(1 for e in events if e['error']),
+        'api_calls': sum(aws.calls.values()),
+        'api_calls_by_operation': dict(sorted(aws.calls.items())),
+        'throttled': sum(aws.throttled.values()),
+        'phase_ms': phases,
+        'peak_memory_mb': round(peak / 1024 / 1024, 2) if peak is not None else None,
+        'timeout_s': timeout,
+        'timeout_headroom_s': round(timeout - slowest, 2),
+    }
+
+
+def phase_durations(emf_lines):
+    """Total OpsPhaseDuration per phase from a handler's Embedded Metric Format output."""
+    totals = {}
+    for line in emf_lines.splitlines():
+        if not line.startswith('{'):
+            continue
+        doc = json.loads(line)
+        if 'OpsPhaseDuration' in doc and 'phase' in doc:
+            totals[doc['phase']] = totals.get(doc['phase'], 0.0) + sum(doc['OpsPhaseDuration'])
+    return totals
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = {(r['payload'], r['fleet_size']): r for r in json.load(f)['results']}
+    print(f"\nvs {previous_path}")
+    for r in results:
+        old = previous.get((r['payload'], r['fleet_size']))
+        if not old:
+            print(f"{r['payload']:<36} {r['fleet_size']:>6}  (no previous run)")
+            continue
+        ratio = old['wall_s'] / r['wall_s'] if r['wall_s'] else float('inf')
+        print(f"{r['payload']:<36} {r['fleet_size']:>6}  wall {old['wall_s']:8.2f}s -> {r['wall_s']:8.2f}s "
+              f"({ratio:4.1f}x)  calls {old['api_calls']:>6} -> {r['api_calls']:<6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payloads', nargs='+', default=['*'], help='payload name globs, e.g. cost_optimizer_*')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000])
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per simulated API call')
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip tracemalloc (it slows CPU-bound runs down noticeably)')
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--compare', help='earlier results JSON to diff against')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    payloads = load_payloads(args.payloads)
+    if not payloads:
+        parser.error(f"No payloads in {PAYLOAD_DIR} match {args.payloads}")
+
+    results = []
+    for size in args.sizes:
+        for stem, payload in payloads:
+            r = replay(stem, payload, size, args)
+            results.append(r)
+            memory = f"{r['peak_memory_mb']:7.1f}MB" if r['peak_memory_mb'] is not None else '      -'
+            print(f"{stem:<36} {size:>6}  {r['wall_s']:8.2f}s  calls={r['api_calls']:<6} "
+                  f"throttled={r['throttled']:<5} peak={memory} headroom={r['timeout_headroom_s']:7.1f}s"
+                  + (f"  errors={r['errors']}" if r['errors'] else ''))
+
+    if args.output:
+        doc = {
+            'meta': {
+                'recorded_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'args': vars(args),
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=2)
+        print(f"\nWrote {len(results)} results to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
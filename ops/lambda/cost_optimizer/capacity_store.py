@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+CAPACITY_STORE = os.environ.get('CAPACITY_STORE', 'ssm')
+CAPACITY_TABLE = os.environ.get('CAPACITY_TABLE', 'cost-terminator-capacity')
+CAPACITY_SSM_PREFIX = os.environ.get('CAPACITY_SSM_PREFIX', '/cost-terminator/capacity')
+CAPACITY_FILE = os.environ.get('CAPACITY_FILE', '/tmp/cost-terminator-capacity.json')
+
+# Used when a node group has never been snapshotted (first run, or a brand new group)
+DEFAULT_SCALING = {'minSize': 1, 'desiredSize': 1}
+
+
+class JsonFileBackend:
+    """Local JSON file backend for tests, benchmarks and running the scripts from a laptop."""
+
+    def __init__(self, path=CAPACITY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, data):
+        # Write-then-rename so a crash never leaves a half-written file behind
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(f.name, self.path)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._read().get(key)
+        return (entry['doc'], entry['version']) if entry else None
+
+    def put(self, key, doc):
+        with self._lock:
+            data = self._read()
+            version = data.get(key, {}).get('version', 0) + 1
+            data[key] = {'doc': doc, 'version': version}
+            self._write(data)
+        return version
+
+    def delete(self, key):
+        with self._lock:
+            data = self._read()
+            if data.pop(key, None) is not None:
+                self._write(data)
+
+
+class SsmBackend:
+    """SSM Parameter Store backend. Parameter versions double as snapshot versions."""
+
+    def __init__(self, ssm, prefix=CAPACITY_SSM_PREFIX):
+        self.ssm = ssm
+        self.prefix = prefix.rstrip('/')
+
+    def _name(self, key):
+        return f"{self.prefix}/{key}"
+
+    def get(self, key):
+        try:
+            param = self.ssm.get_parameter(Name=self._name(key))['Parameter']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ParameterNotFound':
+                return None
+            raise
+        return json.loads(param['Value']), param['Version']
+
+    def put(self, key, doc):
+        response = self.ssm.put_parameter(
+            Name=self._name(key),
+            Value=json.dumps(doc, sort_keys=True),
+            Type='String',
+            Overwrite=True,
+        )
+        return response['Version']
+
+    def delete(self, key):
+        try:
+            self.ssm.delete_parameter(Name=self._name(key))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ParameterNotFound':
+                raise
+
+
+class DynamoDbBackend:
+    """DynamoDB backend: one item per key (hash key `key`), with an atomically incremented version."""
+
+    def __init__(self, dynamodb, table=CAPACITY_TABLE):
+        self.dynamodb = dynamodb
+        self.table = table
+
+    def get(self, key):
+        item = self.dynamodb.get_item(TableName=self.table, Key={'key': {'S': key}}, ConsistentRead=True).get('Item')
+        if not item:
+            return None
+        return json.loads(item['doc']['S']), int(item['version']['N'])
+
+    def put(self, key, doc):
+        response = self.dynamodb.update_item(
+            TableName=self.table,
+            Key={'key': {'S': key}},
+            UpdateExpression='SET #doc = :doc, updated_at = :now ADD version :one',
+            ExpressionAttributeNames={'#doc': 'doc'},
+            ExpressionAttributeValues={
+                ':doc': {'S': json.dumps(doc, sort_keys=True)},
+                ':now': {'S': datetime.now(timezone.utc).isoformat()},
+                ':one': {'N': '1'},
+            },
+            ReturnValues='UPDATED_NEW',
+        )
+        return int(response['Attributes']['version']['N'])
+
+    def delete(self, key):
+        self.dynamodb.delete_item(TableName=self.table, Key={'key': {'S': key}})
+
+
+def backend_from_env(client_factory=boto3.client, kind=None):
+    """Builds the backend selected by CAPACITY_STORE (ssm | dynamodb | file)."""
+    kind = kind or CAPACITY_STORE
+    if kind == 'dynamodb':
+        return DynamoDbBackend(client_factory('dynamodb'))
+    if kind == 'ssm':
+        return SsmBackend(client_factory('ssm'))
+    if kind == 'file':
+        return JsonFileBackend()
+    raise ValueError(f"Unknown CAPACITY_STORE: {kind}")
+
+
+class CapacitySnapshotStore:
+    """
+    Versioned snapshots of EKS node group scalingConfigs, keyed by cluster and node group.
+    `scope` (e.g. "123456789012/eu-west-1") keeps same-named clusters in other accounts and regions apart.
+    """
+
+    def __init__(self, backend, scope=None):
+        self.backend = backend
+        self.scope = scope
+
+    def _key(self, cluster, nodegroup):
+        return f"{cluster}/{nodegroup}" if self.scope is None else f"{self.scope}/{cluster}/{nodegroup}"
+
+    def save(self, cluster, nodegroup, scaling_config):
+        doc = {
+            'scalingConfig': dict(scaling_config),
+            'takenAt': datetime.now(timezone.utc).isoformat(),
+        }
+        return self.backend.put(self._key(cluster, nodegroup), doc)
+
+    def load(self, cluster, nodegroup):
+        """Returns (scalingConfig, version), or None if the node group was never snapshotted."""
+        found = self.backend.get(self._key(cluster, nodegroup))
+        if not found:
+            return None
+        doc, version = found
+        return doc['scalingConfig'], version
+
+
+def snapshot_and_scale_down(eks, store, cluster, nodegroup, scaling=None):
+    """
+    Records a node group's full scalingConfig and then scales it to zero.
+    A group that is already at zero keeps its previous snapshot, so a repeated
+    stop can never overwrite the real capacity with 0/0.
+    `scaling` is the scalingConfig when the caller already described the group.
+    """
+    if scaling is None:
+        scaling = eks.describe_nodegroup(clusterName=cluster, nodegroupName=nodegroup)['nodegroup']['scalingConfig']
+    if scaling.get('desiredSize', 0) == 0 and scaling.get('minSize', 0) == 0:
+        logger.info(f"{nodegroup} already scaled to 0, keeping previous snapshot")
+        return None
+
+    version = store.save(cluster, nodegroup, scaling)
+    logger.info(f"Saved state for {nodegroup} (v{version}): {scaling}")
+
+    eks.update_nodegroup_config(
+        clusterName=cluster,
+        nodegroupName=nodegroup,
+        scalingConfig={'minSize': 0, 'desiredSize': 0}
+    )
+    logger.info(f"Scaled {nodegroup} to 0")
+    return version
+
+
+def restore_from_snapshot(eks, store, cluster, nodegroup, default=DEFAULT_SCALING):
+    """Restores a node group to its last snapshot. Returns (scalingConfig, version or None if defaulted)."""
+    found = store.load(cluster, nodegroup)
+    if found:
+        scaling, version = found
+    else:
+        scaling, version = dict(default), None
+        logger.warning(f"No capacity snapshot for {nodegroup}, falling back to {scaling}")
+
+    eks.update_nodegroup_config(
+        clusterName=cluster,
+        nodegroupName=nodegroup,
+        scalingConfig=scaling
+    )
+    logger.info(f"Restored {nodegroup} to {scaling}")
+    return scaling, version
@@ -1,39 +1,63 @@
-import boto3
 import logging
 
+from ops_common.clients import ClientPool
+
+from fanout import FanOut, Target, parse_targets
+from tag_index import load_tag_index
+
 logging.basicConfig(level=logging.INFO)
-rds = boto3.client('rds')
+# Set FANOUT_TARGETS to scan every account and region the Cost Terminator manages
+pool = ClientPool()
+fanout = FanOut(pool)
 
-print("🔎 Scanning ALL RDS Instances and their Tags...")
 
-try:
-    dbs = rds.describe_db_instances()
-    if not dbs['DBInstances']:
-        print("No RDS instances found.")
+def scan(target):
+    """Report lines for every RDS instance in one account and region."""
+    lines = []
+    dbs = list(target.scanner.paginate('rds', target.rds, 'describe_db_instances', 'DBInstances'))
+    if not dbs:
+        lines.append("No RDS instances found.")
 
-    for db in dbs['DBInstances']:
+    # One bulk tag lookup for every DB instead of a list_tags_for_resource call each
+    try:
+        tag_index = load_tag_index(target.tagging, 'rds:db', target.scanner, scope=target.scope)
+    except Exception as tag_err:
+        tag_index = None
+        lines.append(f"⚠️ Check Tags Failed: {tag_err}")
+
+    for db in dbs:
         db_id = db['DBInstanceIdentifier']
         status = db['DBInstanceStatus']
         arn = db['DBInstanceArn']
-        
-        print(f"  Found DB: {db_id} | Status: {status}")
-        
-        # RDS requires a separate call to get tags
-        try:
-            tags_response = rds.list_tags_for_resource(ResourceName=arn)
-            tags = tags_response['TagList']
-            tag_str = ", ".join([f"{t['Key']}={t['Value']}" for t in tags])
-            print(f"     Tags: [{tag_str}]")
-            
-            # Check logic
-            env_tag = next((t['Value'] for t in tags if t['Key'] == 'Environment'), None)
-            if env_tag == 'Dev':
-                print(f"     ✅ MATCH! This DB WOULD be stopped.")
-            else:
-                print(f"     ❌ SKIP. Tag 'Environment=Dev' missing.")
-                
-        except Exception as tag_err:
-             print(f"     ⚠️ Check Tags Failed: {tag_err}")
+
+        lines.append(f"  Found DB: {db_id} | Status: {status}")
+        if tag_index is None:
+            continue
+
+        tags = tag_index.tags(arn)
+        tag_str = ", ".join([f"{k}={v}" for k, v in tags.items()])
+        lines.append(f"     Tags: [{tag_str}]")
+
+        # Check logic
+        if tags.get('Environment') == 'Dev':
+            lines.append(f"     ✅ MATCH! This DB WOULD be stopped.")
+        else:
+            lines.append(f"     ❌ SKIP. Tag 'Environment=Dev' missing.")
+    return lines
+
+
+print("🔎 Scanning ALL RDS Instances and their Tags...")
+
+try:
+    specs = parse_targets(default_region=pool.session.region_name)
+    targets = fanout.targets(specs) if specs else [Target(pool, [])]
+    # Every account and region is scanned in parallel; output stays grouped per target
+    for r in fanout.run(scan, targets):
+        print(f"\n[{r.target.label}]")
+        if r.error:
+            print(f"Error: {r.error}")
+        else:
+            print("\n".join(r.result))
 
 except Exception as e:
     print(f"Error: {e}")
@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+from ops_common.clients import ClientPool
+
+from inventory import Inventory
+from scanner import FleetScanner
+
+logger = logging.getLogger()
+
+# JSON list of {"account", "role_arn", "regions", "clusters"}; empty means this account and region only
+FANOUT_TARGETS = os.environ.get('FANOUT_TARGETS', '')
+# Role assumed in accounts listed without a role_arn
+FANOUT_ROLE_NAME = os.environ.get('FANOUT_ROLE_NAME', 'cost-terminator')
+FANOUT_MAX_WORKERS = int(os.environ.get('FANOUT_MAX_WORKERS', 8))
+CLUSTER_NAME = os.environ.get('CLUSTER_NAME', 'amazon-cluster')
+# Assumed-role credentials are renewed this long before they expire
+CREDENTIAL_MARGIN = int(os.environ.get('FANOUT_CREDENTIAL_MARGIN', 300))
+SESSION_DURATION = int(os.environ.get('FANOUT_SESSION_DURATION', 3600))
+
+# One configured account: role_arn is None for the Lambda's own account
+TargetSpec = namedtuple('TargetSpec', ['account', 'role_arn', 'regions', 'clusters'])
+# Outcome of running one function against one Target
+TargetResult = namedtuple('TargetResult', ['target', 'result', 'error'])
+
+
+def parse_targets(raw=None, default_region=None):
+    """TargetSpecs from FANOUT_TARGETS (or an event's "targets"), as a JSON string or a list."""
+    raw = FANOUT_TARGETS if raw is None else raw
+    if isinstance(raw, str):
+        raw = json.loads(raw) if raw.strip() else []
+    specs = []
+    for entry in raw:
+        account = entry.get('account')
+        role_arn = entry.get('role_arn')
+        if account and not role_arn:
+            role_arn = f"arn:aws:iam::{account}:role/{FANOUT_ROLE_NAME}"
+        specs.append(TargetSpec(account, role_arn, entry.get('regions') or [default_region],
+                                entry.get('clusters') or [CLUSTER_NAME]))
+    return specs
+
+
+class CredentialCache:
+    """
+    STS AssumeRole credentials per role, reused until shortly before they expire, so warm
+    invocations and every region of an account share one AssumeRole call.
+    """
+
+    def __init__(self, sts, session_name='cost-terminator', duration=SESSION_DURATION, margin=CREDENTIAL_MARGIN):
+        self.sts = sts
+        self.session_name = session_name
+        self.duration = duration
+        self.margin = margin
+        self.assumed = 0
+        self._cache = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _role_lock(self, role_arn):
+        with self._lock:
+            return self._locks.setdefault(role_arn, threading.Lock())
+
+    def get(self, role_arn):
+        cached = self._cache.get(role_arn)
+        if cached and cached['Expiration'].timestamp() - time.time() > self.margin:
+            return cached
+        # One AssumeRole per role even when every region of the account asks at once
+        with self._role_lock(role_arn):
+            cached = self._cache.get(role_arn)
+            if cached and cached['Expiration'].timestamp() - time.time() > self.margin:
+                return cached
+            creds = self.sts.assume_role(RoleArn=role_arn, RoleSessionName=self.session_name,
+                                         DurationSeconds=self.duration)['Credentials']
+            self.assumed += 1
+            logger.info(f"Assumed {role_arn} until {creds['Expiration']:%H:%M:%S}")
+            self._cache[role_arn] = creds
+            return creds
+
+
+class Target:
+    """
+    One account and region the pipeline runs in: its own clients, FleetScanner (AWS
+    rate limits are per account and region) and the EKS clusters to manage there.
+    """
+
+    SERVICES = ('ec2', 'eks', 'rds', 'cloudwatch', 'resourcegroupstaggingapi', 'autoscaling')
+
+    def __init__(self, pool, clusters, account=None, region=None, scanner=None, scope=None):
+        self.pool = pool
+        self.clusters = list(clusters)
+        self.account = account
+        self.region = region or pool.region_name or pool.session.region_name
+        # Prefix for state kept in the home account (capacity snapshots, checkpoints, caches);
+        # None only for the Lambda's own account and region, whose keys predate fan-out
+        self.scope = scope
+        self.scanner = scanner or FleetScanner()
+        self.ec2 = pool.lazy('ec2')
+        self.eks = pool.lazy('eks')
+        self.rds = pool.lazy('rds')
+        self.cw = pool.lazy('cloudwatch')
+        self.tagging = pool.lazy('resourcegroupstaggingapi')
+        self.asg = pool.lazy('autoscaling')
+        self.inventory = Inventory(self)
+
+    @property
+    def label(self):
+        return f"{self.account or 'local'} {self.region}"
+
+    def key(self, name):
+        return name if self.scope is None else f"{self.scope}/{name}"
+
+    def reset_inventory(self):
+        """Drops the previous invocation's resource snapshot; the next phase sweeps afresh."""
+        self.inventory = Inventory(self)
+
+    def clients(self):
+        return [self.pool.lazy(service) for service in self.SERVICES]
+
+    def __repr__(self):
+        return f"<Target {self.label} clusters={self.clusters}>"
+
+
+class FanOut:
+    """
+    Builds a Target per configured account and region, assuming roles through a
+    CredentialCache, and runs a function against every Target in parallel. Client
+    pools are kept per role and region while their credentials stay valid.
+    """
+
+    def __init__(self, pool, max_workers=FANOUT_MAX_WORKERS):
+        self.pool = pool
+        self.max_workers = max(1, max_workers)
+        self.credentials = CredentialCache(pool.lazy('sts'))
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool_for(self, role_arn, region):
+        creds = self.credentials.get(role_arn) if role_arn else None
+        identity = creds['AccessKeyId'] if creds else None
+        with self._lock:
+            cached = self._pools.get((role_arn, region))
+            if cached and cached[0] == identity:
+                return cached[1]
+            if creds:
+                session = boto3.session.Session(aws_access_key_id=creds['AccessKeyId'],
+                                                aws_secret_access_key=creds['SecretAccessKey'],
+                                                aws_session_token=creds['SessionToken'], region_name=region)
+            else:
+                session = boto3.session.Session(region_name=region)
+            pool = ClientPool(session=session, region_name=region, config=self.pool.config)
+            for hook in self.pool.hooks:
+                pool.add_hook(hook)
+            self._pools[(role_arn, region)] = (identity, pool)
+            return pool
+
+    def targets(self, specs):
+        """Targets for every (account, region) in `specs`, assuming each role once."""
+        pairs = [(spec, region) for spec in specs for region in spec.regions]
+
+        def build(pair):
+            spec, region = pair
+            return Target(self._pool_for(spec.role_arn, region), spec.clusters, spec.account, region,
+                          scope=f"{spec.account or 'self'}/{region}")
+
+        return self.run_all(build, pairs)
+
+    def run_all(self, fn, items):
+        """fn over items on the fan-out pool, in input order; the first error is raised."""
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as pool:
+            return list(pool.map(fn, items))
+
+    def run(self, fn, targets):
+        """
+        Runs fn(target) for every Target concurrently, so the whole sweep takes about as
+        long as the slowest region. Returns TargetResults in target order; one failing
+        target does not stop the others.
+        """
+        def guarded(target):
+            started = time.time()
+            try:
+                result, error = fn(target), None
+            except Exception as e:
+                logger.error(f"{target.label}: {e}")
+                result, error = None, e
+            logger.info(f"{target.label} finished in {time.time() - started:.1f}s")
+            return TargetResult(target, result, error)
+
+        return self.run_all(guarded, targets)
+
+
+def for_each_cluster(target, fn):
+    """fn(cluster) for each of a Target's clusters in parallel; results in cluster order."""
+    if len(target.clusters) == 1:
+        return [fn(target.clusters[0])]
+    with ThreadPoolExecutor(max_workers=len(target.clusters)) as pool:
+        return list(pool.map(fn, target.clusters))
+
+
+def merge_reports(results):
+    """
+    One report from per-target report lists. A single local target reads exactly as the
+    report always has; otherwise each target gets a heading.
+    """
+    if len(results) == 1 and results[0].target.scope is None:
+        r = results[0]
+        return r.result if r.error is None else [f"Error in {r.target.label}: {r.error}"]
+
+    merged = []
+    for r in results:
+        merged.append(f"== {r.target.label} ({', '.join(r.target.clusters)}) ==")
+        if r.error is not None:
+            merged.append(f"Error: {r.error}")
+        else:
+            merged.extend(r.result)
+    return merged
@@ -0,0 +1,137 @@
+import logging
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from tag_index import load_tag_index
+
+logger = logging.getLogger()
+
+# An environment must have been quiet for this long before it is stopped
+IDLE_WINDOW_MINUTES = int(os.environ.get('IDLE_WINDOW_MINUTES', 120))
+IDLE_PERIOD = int(os.environ.get('IDLE_PERIOD', 300))
+# Per-period ceilings that still count as idle (health checks, agents and cron keep these above zero).
+# CPU is judged on the period's average, so one daemonset or Jenkins spike does not keep a cluster awake.
+# DB connections are no signal: the backend's connection pool holds them open whenever it runs.
+IDLE_MAX_REQUESTS = float(os.environ.get('IDLE_MAX_REQUESTS', 10))
+IDLE_CPU_PERCENT = float(os.environ.get('IDLE_CPU_PERCENT', 10.0))
+# Share of the window node and RDS CPU must cover, so a freshly started environment is not stopped on missing data
+IDLE_MIN_COVERAGE = float(os.environ.get('IDLE_MIN_COVERAGE', 0.8))
+
+# Hard API limit: MetricDataQueries per get_metric_data request
+MAX_QUERIES = 500
+
+# One CloudWatch series that keeps an environment awake while any period exceeds `threshold`
+Signal = namedtuple('Signal', ['kind', 'resource', 'namespace', 'metric', 'dimensions', 'stat', 'threshold'])
+# state: idle | busy | warming (not up for the whole window) | stopped (nothing running) | unknown (no metrics)
+IdleVerdict = namedtuple('IdleVerdict', ['target', 'state', 'reasons'])
+
+
+def _alb_dimension(arn):
+    # arn:aws:elasticloadbalancing:...:loadbalancer/app/name/id -> app/name/id
+    return arn.split(':loadbalancer/', 1)[-1]
+
+
+class IdleDetector:
+    """
+    Decides whether a Target's dev environment has been idle for the whole window, from
+    ALB request counts, node group CPU and the Environment=Dev RDS instances' CPU. Every series of a Target is fetched in one batched GetMetricData request.
+    """
+
+    def __init__(self, window_minutes=IDLE_WINDOW_MINUTES, period=IDLE_PERIOD):
+        self.window = timedelta(minutes=window_minutes)
+        self.period = period
+
+    def _window(self):
+        # The newest period is still being aggregated by CloudWatch, so the window ends one period back
+        now = datetime.now(timezone.utc)
+        end = datetime.fromtimestamp(now.timestamp() // self.period * self.period, timezone.utc) - timedelta(seconds=self.period)
+        return end - self.window, end
+
+    def signals(self, target):
+        """Returns (signals, running): the series to check, and whether anything is up to be stopped."""
+        signals = []
+        running = False
+
+        for cluster in target.clusters:
+            for ng in target.inventory.nodegroups(cluster):
+                if ng.scaling.get('desiredSize', 0) == 0:
+                    continue
+                running = True
+                for asg in ng.asgs:
+                    signals.append(Signal('nodes', ng.name, 'AWS/EC2', 'CPUUtilization',
+                                          {'AutoScalingGroupName': asg}, 'Average', IDLE_CPU_PERCENT))
+
+        # ALBs created by the AWS Load Balancer Controller are tagged with their cluster
+        albs = load_tag_index(target.tagging, 'elasticloadbalancing:loadbalancer', target.scanner,
+                              tag_filters=[{'Key': 'elbv2.k8s.aws/cluster', 'Values': target.clusters}], scope=target.scope)
+        for arn in (arn for cluster in target.clusters for arn in albs.matching('elbv2.k8s.aws/cluster', cluster)):
+            # Only Application Load Balancers report RequestCount
+            if ':loadbalancer/app/' in arn:
+                signals.append(Signal('alb', _alb_dimension(arn), 'AWS/ApplicationELB', 'RequestCount',
+                                      {'LoadBalancer': _alb_dimension(arn)}, 'Sum', IDLE_MAX_REQUESTS))
+
+        for db in target.inventory.databases.select('available', env='Dev'):
+            running = True
+            signals.append(Signal('rds', db.id, 'AWS/RDS', 'CPUUtilization',
+                                  {'DBInstanceIdentifier': db.id}, 'Average', IDLE_CPU_PERCENT))
+        return signals, running
+
+    def _queries(self, signals):
+        return [{
+            'Id': f"s{i}",
+            'MetricStat': {
+                'Metric': {
+                    'Namespace': s.namespace,
+                    'MetricName': s.metric,
+                    'Dimensions': [{'Name': k, 'Value': v} for k, v in s.dimensions.items()],
+                },
+                'Period': self.period,
+                'Stat': s.stat,
+            },
+            'ReturnData': True,
+        } for i, s in enumerate(signals)]
+
+    def fetch(self, target, signals):
+        """Values of every signal over the window, in signal order; [] where nothing was reported."""
+        start, end = self._window()
+        values = [[] for _ in signals]
+        queries = self._queries(signals)
+        for offset in range(0, len(queries), MAX_QUERIES):
+            kwargs = {'MetricDataQueries': queries[offset:offset + MAX_QUERIES], 'StartTime': start, 'EndTime': end}
+            while True:
+                page = target.scanner.call('cloudwatch', target.cw.get_metric_data, **kwargs)
+                for r in page['MetricDataResults']:
+                    values[int(r['Id'][1:])].extend(r['Values'])
+                if not page.get('NextToken'):
+                    break
+                kwargs['NextToken'] = page['NextToken']
+        return values
+
+    def evaluate(self, target):
+        """IdleVerdict for one Target."""
+        signals, running = self.signals(target)
+        if not running:
+            return IdleVerdict(target, 'stopped', ["nothing running"])
+
+        if not signals:
+            # Something runs but nothing reports on it; never stop an environment blind
+            return IdleVerdict(target, 'unknown', ["no metrics to judge by"])
+
+        values = self.fetch(target, signals)
+        bins = int(self.window.total_seconds() // self.period)
+        busy, warming = [], []
+        for s, v in zip(signals, values):
+            # ALBs publish no RequestCount at all for periods without requests
+            peak = max(v, default=0.0)
+            if peak > s.threshold:
+                busy.append(f"{s.kind} {s.resource} {s.metric} peaked at {peak:.1f}")
+            # CPU is reported for as long as something runs, so short coverage means it started mid-window
+            if s.metric == 'CPUUtilization' and len(v) < bins * IDLE_MIN_COVERAGE:
+                warming.append(f"{s.kind} {s.resource} up for {len(v) * self.period // 60} of {bins * self.period // 60} min")
+
+        if busy:
+            return IdleVerdict(target, 'busy', busy)
+        if warming:
+            return IdleVerdict(target, 'warming', warming)
+        return IdleVerdict(target, 'idle', [f"{len(signals)} signals quiet for {self.window.total_seconds() / 60:.0f} min"])
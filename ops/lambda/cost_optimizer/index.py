@@ -1,247 +1,451 @@
-import boto3
+from ops_common.coldstart import ColdStart  # first import, so the init timer starts here
+
 import logging
 import os
 import json
-from datetime import datetime
+import time
+from functools import partial
+
+from ops_common.clients import ClientPool
+from ops_common.metrics import METRICS, sink_from_env
+
+from capacity_store import CapacitySnapshotStore, backend_from_env, restore_from_snapshot, snapshot_and_scale_down
+from fanout import CLUSTER_NAME, FanOut, Target, TargetResult, for_each_cluster, merge_reports, parse_targets
+from idle import IdleDetector
+from reaper import REAPER_DRY_RUN, Reaper, summarize as summarize_reaper
+from resume import RESUME_MODE, hibernate_or_stop, is_warm, wait_for_capacity
+from rightsizing import RightSizingEngine
+from scanner import FleetScanner, raise_first_error
+from warmup import (MAX_WARMUP_SECONDS, POLL_DELAY, Stage, WarmupScheduler, deadline_from, expired, fit_report, note,
+                    wait_all, wait_for)
 
 # Setup Logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Clients
-ec2 = boto3.client('ec2')
-asg = boto3.client('autoscaling')
-eks = boto3.client('eks')
-rds = boto3.client('rds')
-sns = boto3.client('sns')
-cw = boto3.client('cloudwatch')
+# Clients: built on first use and kept warm, so a "start" never pays for the ones only "stop" needs
+CLIENTS = ClientPool()
+# Per-operation latency, retries and throttles for every client, as Embedded Metric Format
+METRICS.configure(sink_from_env('emf'))
+CLIENTS.add_hook(METRICS.instrument_client)
+sns = CLIENTS.lazy('sns')
+lam = CLIENTS.lazy('lambda')
 
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
+WARMUP_REINVOKE = os.environ.get('WARMUP_REINVOKE', 'true') == 'true'
+
+# Shared across phases so per-service throttling backoff carries over within an invocation
+SCANNER = FleetScanner()
+
+# Where node group scalingConfigs are kept between the nightly stop and the morning start
+CAPACITY = CapacitySnapshotStore(backend_from_env(CLIENTS.lazy))
+
+# This account and region; FANOUT_TARGETS (or an event's "targets") adds others, assumed into via STS
+LOCAL = Target(CLIENTS, [CLUSTER_NAME], scanner=SCANNER)
+FANOUT = FanOut(CLIENTS)
+FANOUT_WARMUP_KEY = 'warmup/fanout'
+
+# Scheduled "idle_check" stops only the environments quiet for IDLE_WINDOW_MINUTES
+IDLE = IdleDetector()
+
+COLD_START = ColdStart(CLIENTS)
 
+@COLD_START.track
+@METRICS.track
 def lambda_handler(event, context):
     """
     The Cost Terminator:
     Triggered by EventBridge Rule (e.g., "Nightly Stop" or "Morning Start").
     Event Payload: {"action": "stop"} or {"action": "start"}
+    {"action": "stop", "dry_run": true} changes nothing and reports what the stop would do;
+    REAPER_DRY_RUN=true keeps only the orphaned-resource cleanup to a plan.
+    {"action": "idle_check"} stops only environments whose traffic and average CPU stayed under
+    the idle thresholds for the whole window; with "dry_run" it only reports the verdicts.
+    A "start" that has not finished warming up returns {"status": "in_progress", "checkpoint": {...}}.
+    With FANOUT_TARGETS (or "targets" in the event) every account and region runs in parallel
+    and the report covers all of them.
     """
     action = event.get('action', 'stop')
     logger.info(f"Received action: {action}")
     
     report = []
+    status = "success"
+    targets = targets_for(event)
+    # Every phase of this invocation filters one shared snapshot instead of describing again
+    for target in targets:
+        target.reset_inventory()
 
     if action == 'stop':
-        report.append(scale_down_eks_nodes())
-        report.append(stop_dev_instances())
-        report.append(stop_dev_rds())
-        report.append(cleanup_orphaned_resources())
-        # Phase 8: Right-Sizing Recommendations
-        report.append(analyze_right_sizing())
+        dry_run = event.get('dry_run', False)
+        results = FANOUT.run(lambda target: stop_pipeline(target, dry_run), targets)
+        failed = [r for r in results if r.error]
+        if failed and targets == [LOCAL]:
+            raise failed[0].error
+        if failed:
+            status = "partial"
+        report.extend(merge_reports(results))
+    elif action == 'idle_check':
+        dry_run = event.get('dry_run', False)
+        results = FANOUT.run(lambda target: idle_stop(target, dry_run), targets)
+        if any(r.error for r in results):
+            status = "partial"
+        # Runs every few minutes, so only environments that were stopped (or failed) make the report
+        report.extend(merge_reports([r for r in results if r.error or r.result]))
     elif action == 'start':
-        report.append(restore_eks_nodes())
-        report.append(start_dev_instances())
-        report.append(start_dev_rds())
+        with METRICS.phase('warm_up'):
+            status, state = warm_up(event, context, targets)
+        if status == 'in_progress':
+            return {"status": status, "action": action, "checkpoint": state}
+        report.extend(state['report'])
     
     # Filter empty reports and join
     summary = "\n".join([r for r in report if r])
     if summary:
         publish_alert(f"Cost Terminator Report: {action.upper()}", summary)
     
-    return {"status": "success", "action": action, "report": summary}
+    return {"status": status, "action": action, "report": summary}
+
+def targets_for(event):
+    """Targets from the event's "targets" or FANOUT_TARGETS; just this account and region when neither is set."""
+    specs = parse_targets(event.get('targets'), CLIENTS.session.region_name)
+    return FANOUT.targets(specs) if specs else [LOCAL]
+
+def capacity_for(target):
+    return CAPACITY if target.scope is None else CapacitySnapshotStore(CAPACITY.backend, scope=target.scope)
+
+def stop_pipeline(target, dry_run=False):
+    """The nightly stop for one account and region. Returns its report lines; with dry_run nothing is changed."""
+    report = []
+    with METRICS.phase('scale_down'):
+        report.append(scale_down_eks_nodes(target, dry_run))
+    with METRICS.phase('stop_instances'):
+        report.append(stop_dev_instances(target, dry_run))
+    with METRICS.phase('stop_rds'):
+        report.append(stop_dev_rds(target, dry_run))
+    with METRICS.phase('cleanup'):
+        report.append(cleanup_orphaned_resources(target, dry_run or REAPER_DRY_RUN))
+    # Phase 8: Right-Sizing Recommendations
+    with METRICS.phase('right_sizing'):
+        report.append(analyze_right_sizing(target))
+    return [r for r in report if r]
+
+def idle_stop(target, dry_run=False):
+    """Stops one account and region's dev environment if it has been idle for the whole window. Returns its report lines."""
+    with METRICS.phase('idle_check'):
+        verdict = IDLE.evaluate(target)
+    logger.info(f"{target.label} is {verdict.state}: {'; '.join(verdict.reasons)}")
+    if verdict.state != 'idle':
+        return []
+    if dry_run:
+        return [f"Idle ({'; '.join(verdict.reasons)}), would stop."]
+
+    report = [f"Idle: {'; '.join(verdict.reasons)}."]
+    with METRICS.phase('scale_down'):
+        report.append(scale_down_eks_nodes(target))
+    with METRICS.phase('stop_instances'):
+        report.append(stop_dev_instances(target))
+    with METRICS.phase('stop_rds'):
+        report.append(stop_dev_rds(target))
+    return [r for r in report if r]
+
+def warm_up(event, context, targets=None):
+    """
+    Morning start as a staged warm-up: data tier first, node groups only once RDS and EC2 are healthy.
+    Returns (status, checkpoint). A Step Functions loop passes the checkpoint back in the next event;
+    otherwise the function re-invokes itself and resumes from the persisted checkpoint.
+    """
+    targets = targets or [LOCAL]
+    if targets == [LOCAL]:
+        status, state = warm_up_target(LOCAL, deadline_from(context), event.get('checkpoint'))
+    else:
+        status, state = warm_up_fanout(targets, deadline_from(context), event.get('checkpoint'))
+
+    driven_externally = 'checkpoint' in event
+    if status == 'in_progress' and WARMUP_REINVOKE and not driven_externally and context is not None:
+        payload = {'action': 'start'}
+        if 'targets' in event:
+            payload['targets'] = event['targets']
+        lam.invoke(FunctionName=context.invoked_function_arn, InvocationType='Event',
+                   Payload=json.dumps(payload))
+        logger.info("Re-invoked self to continue warm-up")
+    return status, state
+
+def warmup_key(target):
+    # SSM parameter names only allow a-zA-Z0-9_.-/, so no '+' between cluster names
+    return f"warmup/{target.key('_'.join(target.clusters))}"
+
+def warm_up_target(target, deadline, checkpoint=None):
+    """Runs (or resumes) the staged warm-up of one account and region. Returns (status, state)."""
+    stages = [
+        Stage('start_data_tier', partial(_start_data_tier, target)),
+        Stage('data_tier_ready', partial(_data_tier_ready, target)),
+        Stage('restore_compute', partial(_restore_compute, target)),
+        Stage('compute_ready', partial(_compute_ready, target)),
+    ]
+    scheduler = WarmupScheduler(stages, CAPACITY.backend, warmup_key(target))
+    return scheduler.run(deadline, checkpoint=checkpoint)
+
+def warm_up_fanout(targets, deadline, checkpoint=None):
+    """
+    Warms every target up in parallel. Each target checkpoints its own stages; the fan-out
+    checkpoint only records which targets are still pending, the status of those done and as
+    much of their report as fits one SSM parameter, so a resumed invocation never restarts a
+    target that already finished.
+    """
+    if checkpoint is None:
+        found = CAPACITY.backend.get(FANOUT_WARMUP_KEY)
+        checkpoint = found[0] if found else None
+    if checkpoint and expired(checkpoint):
+        # Targets that never got ready end here; nothing resumes them again
+        logger.error(f"Fan-out warm-up gave up with {len(checkpoint['pending'])} targets still pending")
+        for target in targets:
+            if target.label in checkpoint['pending']:
+                CAPACITY.backend.delete(warmup_key(target))
+        checkpoint['report'].append(f"Warm-up failed: {', '.join(checkpoint['pending'])} still not ready "
+                                    f"after {MAX_WARMUP_SECONDS}s, giving up.")
+        checkpoint['failed'] = True
+        CAPACITY.backend.delete(FANOUT_WARMUP_KEY)
+        return 'failed', checkpoint
+    fanout = checkpoint or {'pending': [t.label for t in targets], 'done': {}, 'report': [], 'dropped': 0,
+                            'failed': False, 'startedAt': time.time()}
+
+    running = [t for t in targets if t.label in fanout['pending']]
+    results = FANOUT.run(lambda target: warm_up_target(target, deadline), running)
+
+    fanout['pending'] = [r.target.label for r in results if not r.error and r.result[0] == 'in_progress']
+    finished = [TargetResult(r.target, None if r.error else r.result[1]['report'], r.error)
+                for r in results if r.target.label not in fanout['pending']]
+    for r in results:
+        if r.target.label not in fanout['pending']:
+            fanout['done'][r.target.label] = 'error' if r.error else r.result[0]
+    if finished:
+        fanout['report'].extend(merge_reports(finished))
+    fanout['failed'] = fanout['failed'] or any(r.error or r.result[0] == 'failed' for r in results)
+
+    if fanout['pending']:
+        # Pending targets and statuses always fit; report lines of finished targets are dropped if they would not
+        CAPACITY.backend.put(FANOUT_WARMUP_KEY, fit_report(fanout))
+        return 'in_progress', fanout
+    CAPACITY.backend.delete(FANOUT_WARMUP_KEY)
+    if fanout['dropped']:
+        fanout['report'].append(f"... {fanout['dropped']} report lines not kept (checkpoint size limit)")
+    fanout['report'].append("Targets: " + ", ".join(f"{label} {status}" for label, status in fanout['done'].items()))
+    return ('failed' if fanout['failed'] else 'success'), fanout
+
+def _start_data_tier(target, state, deadline):
+    note(state, start_dev_rds(target))
+    note(state, start_dev_instances(target))
+    return True
+
+def _data_tier_ready(target, state, deadline):
+    """Waits on RDS availability and EC2 status checks concurrently."""
+    # Anything Dev that is not stopped is either up or on its way; a DB that failed to start stays out
+    db_ids = [db.id for db in target.inventory.databases.select(
+        ('starting', 'available', 'configuring-enhanced-monitoring', 'configuring-log-exports', 'backing-up', 'modifying'), env='Dev')]
+    instance_ids = [i.id for i in target.inventory.instances.select(('pending', 'running'), env='Dev')]
+
+    waits = [
+        lambda chunk=chunk: wait_for(target.rds, 'db_instance_available', deadline, Filters=[{'Name': 'db-instance-id', 'Values': chunk}])
+        for chunk in _chunks(db_ids, 100)
+    ] + [
+        lambda chunk=chunk: wait_for(target.ec2, 'instance_status_ok', deadline, InstanceIds=chunk)
+        for chunk in _chunks(instance_ids, 100)
+    ]
+    logger.info(f"Waiting on {len(db_ids)} RDS and {len(instance_ids)} EC2 instances in {target.label}")
+    return wait_all(waits)
+
+def _restore_compute(target, state, deadline):
+    note(state, restore_eks_nodes(target))
+    state['restoredAt'] = time.time()
+    return True
+
+def _compute_ready(target, state, deadline):
+    """Waits for every node group to be ACTIVE and its ASGs' nodes in service, then reports the resume time."""
+    nodegroups = [ng for cluster_name in target.clusters for ng in target.inventory.nodegroups(cluster_name)]
+    ready = wait_all([
+        lambda ng=ng: wait_for(target.eks, 'nodegroup_active', deadline, clusterName=ng.cluster, nodegroupName=ng.name)
+        for ng in nodegroups
+    ] + [
+        lambda: wait_for_capacity(target.asg, [name for ng in nodegroups for name in ng.asgs], deadline, POLL_DELAY)
+    ])
+    if ready:
+        nodes = time.time() - state.get('restoredAt', state['startedAt'])
+        METRICS.observe('resume_duration', nodes, mode=RESUME_MODE)
+        note(state, f"⏱️ Resume ({RESUME_MODE}): nodes in service {nodes:.0f}s after restore, "
+                    f"{time.time() - state['startedAt']:.0f}s after start.")
+    return ready
 
 def publish_alert(subject, message):
     if SNS_TOPIC_ARN:
         sns.publish(TopicArn=SNS_TOPIC_ARN, Subject=subject, Message=message)
 
-def scale_down_eks_nodes():
-    """Sets EKS Node Group min/desired size to 0."""
-    logger.info("Scaling down EKS Node Groups...")
-    # TODO: Fetch cluster name dynamically or from env
-    cluster_name = os.environ.get('CLUSTER_NAME', 'amazon-cluster')
-    
-    try:
-        nodegroups = eks.list_nodegroups(clusterName=cluster_name)['nodegroups']
+def scale_down_eks_nodes(target=LOCAL, dry_run=False):
+    """Snapshots each EKS Node Group's scalingConfig, then sets min/desired size to 0, for every cluster of the target."""
+    logger.info(f"Scaling down EKS Node Groups in {target.label}..." + (" (dry run)" if dry_run else ""))
+    capacity = capacity_for(target)
+
+    def scale_cluster(cluster_name):
+        nodegroups = target.inventory.nodegroups(cluster_name)
+        if dry_run:
+            return len(nodegroups)
+        raise_first_error(target.scanner.map('eks', lambda ng: snapshot_and_scale_down(target.eks, capacity, cluster_name, ng.name, ng.scaling), nodegroups))
         for ng in nodegroups:
-            # Tag the current size so we can restore it later
-            desc = eks.describe_nodegroup(clusterName=cluster_name, nodegroupName=ng)['nodegroup']
-            current_min = desc['scalingConfig']['minSize']
-            current_desired = desc['scalingConfig']['desiredSize']
-            
-            # Use EC2 Tags on the ASG or Parameter Store to save state (Simplified here)
-            logger.info(f"Saving state for {ng}: min={current_min}, desired={current_desired}")
-            
-            # Scale to 0
-            eks.update_nodegroup_config(
-                clusterName=cluster_name,
-                nodegroupName=ng,
-                scalingConfig={'minSize': 0, 'desiredSize': 0}
-            )
-            logger.info(f"Scaled {ng} to 0")
-        return f"Scaled down EKS Node Groups ({len(nodegroups)} groups) to 0."
+            ng.scaling.update(minSize=0, desiredSize=0)
+        return len(nodegroups)
+
+    try:
+        scaled = sum(for_each_cluster(target, scale_cluster))
+        if dry_run:
+            return f"Would scale down EKS Node Groups ({scaled} groups) to 0."
+        METRICS.processed('scale_down', scaled)
+        return f"Scaled down EKS Node Groups ({scaled} groups) to 0."
     except Exception as e:
         logger.error(f"Failed to scale EKS: {e}")
         return f"Error scaling EKS: {e}"
 
-def restore_eks_nodes():
-    """Restores EKS Node Groups to default size (e.g., 1)."""
-    logger.info("Restoring EKS Node Groups...")
-    cluster_name = os.environ.get('CLUSTER_NAME', 'amazon-cluster')
-    
+def restore_eks_nodes(target=LOCAL):
+    """Restores EKS Node Groups to the scalingConfig captured at scale-down, for every cluster of the target."""
+    logger.info(f"Restoring EKS Node Groups in {target.label}...")
+    capacity = capacity_for(target)
+
+    def restore_cluster(cluster_name):
+        nodegroups = target.inventory.nodegroup_names(cluster_name)
+        results = target.scanner.map('eks', lambda ng: restore_from_snapshot(target.eks, capacity, cluster_name, ng), nodegroups)
+        raise_first_error(results)
+        METRICS.processed('restore_compute', len(results))
+
+        restored = [f"{r.item}={r.result[0]['desiredSize']}" for r in results]
+        defaulted = [r.item for r in results if r.result[1] is None]
+        summary = f"Restored EKS Node Groups in {cluster_name} to snapshot capacity: {', '.join(restored)}."
+        if defaulted:
+            summary += f" No snapshot (defaulted): {', '.join(defaulted)}."
+        return summary
+
     try:
-        nodegroups = eks.list_nodegroups(clusterName=cluster_name)['nodegroups']
-        for ng in nodegroups:
-            # In a real scenario, read from DynamoDB/Tags. Here we default to 1.
-            eks.update_nodegroup_config(
-                clusterName=cluster_name,
-                nodegroupName=ng,
-                scalingConfig={'minSize': 1, 'desiredSize': 1}
-            )
-            logger.info(f"Restored {ng} to size 1")
-        return f"Restored EKS Node Groups in {cluster_name} to size 1."
+        return "\n".join(for_each_cluster(target, restore_cluster))
     except Exception as e:
         logger.error(f"Failed to restore EKS: {e}")
         return f"Error restoring EKS: {e}"
 
-def stop_dev_instances():
+def _chunks(ids, size=1000):
+    """Splits IDs into batches small enough for a single EC2 stop/start request."""
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+def stop_dev_instances(target=LOCAL, dry_run=False):
     """Stops EC2 Intances tagged Environment=Dev"""
-    logger.info("Stopping Dev EC2 Instances...")
+    logger.info(f"Stopping Dev EC2 Instances in {target.label}...")
     # Fix: Exclude Spot Instances (they cannot be stopped, only terminated via ASG/EKS scaling)
-    filters = [
-        {'Name': 'tag:Environment', 'Values': ['Dev']}, 
-        {'Name': 'instance-state-name', 'Values': ['running']},
-        {'Name': 'instance-lifecycle', 'Values': ['on-demand']} # Only stop On-Demand
-    ]
-    instances = ec2.describe_instances(Filters=filters)
-    ids = [i['InstanceId'] for r in instances['Reservations'] for i in r['Instances']]
-    
+    instances = target.inventory.instances
+    running = instances.select('running', env='Dev', lifecycle='on-demand') # Only stop On-Demand
+    ids = [i.id for i in running]
 
+    if ids and dry_run:
+        return f"Would stop EC2 Instances: {', '.join(ids)}"
+    if ids and is_warm():
+        hibernated, stopped = hibernate_or_stop(target.ec2, target.scanner, running)
+        instances.set_state(running, 'stopping')
+        METRICS.processed('stop_instances', len(ids))
+        lines = []
+        if hibernated:
+            lines.append(f"Hibernated EC2 Instances: {', '.join(hibernated)}")
+        if stopped:
+            lines.append(f"Stopped EC2 Instances: {', '.join(stopped)}")
+        return "\n".join(lines)
     if ids:
-        ec2.stop_instances(InstanceIds=ids)
+        raise_first_error(target.scanner.map('ec2', lambda chunk: target.ec2.stop_instances(InstanceIds=chunk), _chunks(ids)))
+        instances.set_state(running, 'stopping')
+        METRICS.processed('stop_instances', len(ids))
         return f"Stopped EC2 Instances: {', '.join(ids)}"
     else:
         logger.info("No running Dev instances found.")
         return "No running Dev EC2 instances found to stop."
 
-def start_dev_instances():
+def start_dev_instances(target=LOCAL):
     """Starts EC2 Intances tagged Environment=Dev"""
-    logger.info("Starting Dev EC2 Instances...")
-    filters = [{'Name': 'tag:Environment', 'Values': ['Dev']}, {'Name': 'instance-state-name', 'Values': ['stopped']}]
-    instances = ec2.describe_instances(Filters=filters)
-    ids = [i['InstanceId'] for r in instances['Reservations'] for i in r['Instances']]
-    
+    logger.info(f"Starting Dev EC2 Instances in {target.label}...")
+    instances = target.inventory.instances
+    stopped = instances.select('stopped', env='Dev')
+    ids = [i.id for i in stopped]
+
     if ids:
-        ec2.start_instances(InstanceIds=ids)
+        raise_first_error(target.scanner.map('ec2', lambda chunk: target.ec2.start_instances(InstanceIds=chunk), _chunks(ids)))
+        instances.set_state(stopped, 'pending')
+        METRICS.processed('start_instances', len(ids))
         return f"Started EC2 Instances: {', '.join(ids)}"
     return "No stopped Dev EC2 instances found to start."
 
-def cleanup_orphaned_resources():
-    """Deletes available volumes and unassociated EIPs."""
-    logger.info("Cleaning up orphaned resources...")
-    
-    # EBS Volumes
-    volumes = ec2.describe_volumes(Filters=[{'Name': 'status', 'Values': ['available']}])
-    for vol in volumes['Volumes']:
-        vid = vol['VolumeId']
-        # Check for protection tag
-        tags = {t['Key']: t['Value'] for t in vol.get('Tags', [])}
-        if tags.get('DoNotDelete') != 'true':
-            # Safety check: Is this a Kubernetes PVC?
-            is_pvc = any(k.startswith('kubernetes.io/created-for/pvc') for k in tags.keys())
-            if is_pvc:
-                logger.info(f"Skipping PVC volume: {vid}")
-                continue
-                
-            ec2.delete_volume(VolumeId=vid)
-            logger.info(f"Deleted orphaned volume: {vid}")
-
-    # Elastic IPs
-    eips = ec2.describe_addresses()
-    for eip in eips['Addresses']:
-        if 'AssociationId' not in eip:
-            alloc_id = eip['AllocationId']
-            ec2.release_address(AllocationId=alloc_id)
-            logger.info(f"Released orphaned EIP: {alloc_id}")
-
-def stop_dev_rds():
+def cleanup_orphaned_resources(target=LOCAL, dry_run=False):
+    """Deletes available volumes, old snapshots, unassociated EIPs and unattached ENIs."""
+    logger.info(f"Cleaning up orphaned resources in {target.label}..." + (" (dry run)" if dry_run else ""))
+    reaper = Reaper(target.ec2, target.scanner, target.inventory)
+    plan = reaper.plan()
+    for item in plan:
+        logger.info(f"Plan: delete {item.kind} {item.resource_id} ({item.detail}), ${item.monthly_savings:.2f}/month")
+
+    if dry_run:
+        return summarize_reaper(plan)
+    results = reaper.execute(plan)
+    METRICS.processed('cleanup', sum(1 for r in results if not r.error))
+    return summarize_reaper(plan, results)
+
+def stop_dev_rds(target=LOCAL, dry_run=False):
     """Stops RDS Instances tagged Environment=Dev"""
-    logger.info("Stopping Dev RDS Instances...")
-    dbs = rds.describe_db_instances()
-    for db in dbs['DBInstances']:
-        db_id = db['DBInstanceIdentifier']
-        status = db['DBInstanceStatus']
-        
-        arn = db['DBInstanceArn']
-        tags = rds.list_tags_for_resource(ResourceName=arn)['TagList']
-        # Robust tag checking: strip whitespace
-        env_tag = next((t['Value'].strip() for t in tags if t['Key'].strip() == 'Environment'), None)
-
-        if env_tag == 'Dev' and status == 'available':
-            rds.stop_db_instance(DBInstanceIdentifier=db_id)
-            logger.info(f"Stopped RDS: {db_id}")
-            return f"Stopped RDS Instance: {db_id}"
+    logger.info(f"Stopping Dev RDS Instances in {target.label}...")
+    databases = target.inventory.databases
+    available = databases.select('available', env='Dev')
+    if available and dry_run:
+        return f"Would stop RDS Instances: {', '.join(db.id for db in available)}"
+    stopped = []
+    for r in target.scanner.map('rds', lambda db: target.rds.stop_db_instance(DBInstanceIdentifier=db.id), available):
+        if r.error:
+            logger.error(f"Failed to stop RDS {r.item.id}: {r.error}")
+        else:
+            logger.info(f"Stopped RDS: {r.item.id}")
+            stopped.append(r.item)
+    databases.set_state(stopped, 'stopping')
+    METRICS.processed('stop_rds', len(stopped))
+
+    if stopped:
+        return f"Stopped RDS Instances: {', '.join(db.id for db in stopped)}"
     return "Checked RDS instances."
 
-def start_dev_rds():
+def start_dev_rds(target=LOCAL):
     """Starts RDS Instances tagged Environment=Dev"""
-    logger.info("Starting Dev RDS Instances...")
-    dbs = rds.describe_db_instances()
-    for db in dbs['DBInstances']:
-        db_id = db['DBInstanceIdentifier']
-        status = db['DBInstanceStatus']
-        
-        arn = db['DBInstanceArn']
-        tags = rds.list_tags_for_resource(ResourceName=arn)['TagList']
-        # Robust tag checking: strip whitespace
-        env_tag = next((t['Value'].strip() for t in tags if t['Key'].strip() == 'Environment'), None)
-
-        if env_tag == 'Dev' and status == 'stopped':
-            rds.start_db_instance(DBInstanceIdentifier=db_id)
-            logger.info(f"Started RDS: {db_id}")
-            return f"Started RDS Instance: {db_id}"
+    logger.info(f"Starting Dev RDS Instances in {target.label}...")
+    databases = target.inventory.databases
+    started = []
+    for r in target.scanner.map('rds', lambda db: target.rds.start_db_instance(DBInstanceIdentifier=db.id), databases.select('stopped', env='Dev')):
+        if r.error:
+            logger.error(f"Failed to start RDS {r.item.id}: {r.error}")
+        else:
+            logger.info(f"Started RDS: {r.item.id}")
+            started.append(r.item)
+    databases.set_state(started, 'starting')
+    METRICS.processed('start_rds', len(started))
+
+    if started:
+        return f"Started RDS Instances: {', '.join(db.id for db in started)}"
     return "Checked RDS instances."
 
-def analyze_right_sizing():
-    """Analyzes CPU Utilization for the past 7 days to recommend right-sizing."""
-    logger.info("Analyzing Right-Sizing opportunities...")
-    
+def analyze_right_sizing(target=LOCAL):
+    """Analyzes CPU, network and EBS usage for the past 7 days to recommend right-sizing."""
+    logger.info(f"Analyzing Right-Sizing opportunities in {target.label}...")
+
+    # Skip if explicitly ignored
+    candidates = [i for i in target.inventory.instances.select('running') if not i.ignore_rightsizing]
+
+    METRICS.processed('right_sizing', len(candidates))
     recommendations = []
-    instances = ec2.describe_instances(Filters=[{'Name': 'instance-state-name', 'Values': ['running']}])
-    
-    for r in instances['Reservations']:
-        for i in r['Instances']:
-            instance_id = i['InstanceId']
-            instance_type = i['InstanceType']
-            
-            # Skip if explicitly ignored
-            tags = {t['Key']: t['Value'] for t in i.get('Tags', [])}
-            if tags.get('IgnoreRightSizing') == 'true':
-                continue
-                
-            # Get Max CPU over last 7 days
-            try:
-                response = cw.get_metric_statistics(
-                    Namespace='AWS/EC2',
-                    MetricName='CPUUtilization',
-                    Dimensions=[{'Name': 'InstanceId', 'Value': instance_id}],
-                    StartTime=datetime.utcnow().replace(day=datetime.utcnow().day - 7),
-                    EndTime=datetime.utcnow(),
-                    Period=86400,
-                    Statistics=['Maximum'],
-                    Unit='Percent'
-                )
-                
-                # If no data points, skip
-                if not response['Datapoints']:
-                    continue
-                    
-                max_cpu = max([dp['Maximum'] for dp in response['Datapoints']])
-                
-                # Logic: If Max CPU < 20% on a "Large" instance, recommend downgrade
-                if max_cpu < 20.0 and 'large' in instance_type:
-                     recommendations.append(f"📉 Recommendation: Downgrade {instance_id} ({instance_type}). Max CPU was only {max_cpu:.1f}%")
-            
-            except Exception as e:
-                logger.error(f"Failed to get metrics for {instance_id}: {e}")
-                
+    for rec in RightSizingEngine(target.cw, target.scanner).recommend(candidates):
+        p50, p95, peak = rec.cpu
+        recommendations.append(
+            f"📉 Recommendation: Downgrade {rec.instance_id} ({rec.current_type} → {rec.target_type}). "
+            f"CPU p50/p95/max {p50:.1f}/{p95:.1f}/{peak:.1f}%, "
+            f"network p95 {rec.net_bps / 1e6:.2f} MB/s, EBS p95 {rec.ebs_bps / 1e6:.2f} MB/s"
+        )
+
     if recommendations:
         return "\n".join(recommendations)
     return None
+
+COLD_START.imported()
@@ -0,0 +1,203 @@
+import logging
+import sys
+import threading
+from collections import defaultdict
+
+from scanner import raise_first_error
+from tag_index import load_tag_index
+
+logger = logging.getLogger()
+
+
+def _tag(resource, key):
+    for t in resource.get('Tags') or resource.get('TagSet') or ():
+        if t['Key'] == key:
+            return t['Value']
+    return None
+
+
+def _has_tag_prefix(resource, prefix):
+    return any(t['Key'].startswith(prefix) for t in resource.get('Tags') or ())
+
+
+def _s(value):
+    # States, types and tag values repeat across thousands of records; share one copy of each
+    return None if value is None else sys.intern(value)
+
+
+class Instance:
+    __slots__ = ('id', 'type', 'state', 'lifecycle', 'env', 'ignore_rightsizing', 'hibernation')
+
+    def __init__(self, raw):
+        self.id = raw['InstanceId']
+        self.type = _s(raw['InstanceType'])
+        self.state = _s(raw['State']['Name'])
+        # describe_instances leaves InstanceLifecycle out for on-demand instances
+        self.lifecycle = _s(raw.get('InstanceLifecycle') or 'on-demand')
+        self.env = _s(_tag(raw, 'Environment'))
+        self.ignore_rightsizing = _tag(raw, 'IgnoreRightSizing') == 'true'
+        self.hibernation = raw.get('HibernationOptions', {}).get('Configured', False)
+
+
+class Database:
+    __slots__ = ('id', 'arn', 'state', 'env')
+
+    def __init__(self, raw, env):
+        self.id = raw['DBInstanceIdentifier']
+        self.arn = raw['DBInstanceArn']
+        self.state = _s(raw['DBInstanceStatus'])
+        self.env = _s(env)
+
+
+class Volume:
+    __slots__ = ('id', 'size', 'type', 'iops', 'throughput', 'protected', 'pvc')
+
+    def __init__(self, raw):
+        self.id = raw['VolumeId']
+        self.size = raw.get('Size', 0)
+        self.type = _s(raw.get('VolumeType', 'gp2'))
+        self.iops = raw.get('Iops')
+        self.throughput = raw.get('Throughput')
+        self.protected = _tag(raw, 'DoNotDelete') == 'true'
+        self.pvc = _has_tag_prefix(raw, 'kubernetes.io/created-for/pvc')
+
+
+class Address:
+    __slots__ = ('id', 'public_ip', 'associated', 'protected')
+
+    def __init__(self, raw):
+        self.id = raw['AllocationId']
+        self.public_ip = raw.get('PublicIp', '')
+        self.associated = 'AssociationId' in raw
+        self.protected = _tag(raw, 'DoNotDelete') == 'true'
+
+
+class NodeGroup:
+    __slots__ = ('cluster', 'name', 'scaling', 'asgs')
+
+    def __init__(self, raw):
+        self.cluster = raw['clusterName']
+        self.name = raw['nodegroupName']
+        self.scaling = dict(raw['scalingConfig'])
+        self.asgs = tuple(a['name'] for a in raw.get('resources', {}).get('autoScalingGroups', []))
+
+
+class Table:
+    """
+    Records of one resource type, indexed by state so the common "Dev and running"
+    lookups touch only the records in that state.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self._by_state = defaultdict(list)
+        for r in records:
+            self._by_state[r.state].append(r)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def select(self, state=None, **fields):
+        """
+        Records matching every given field. `state` (and any field) may be a single value
+        or a tuple of accepted values.
+        """
+        if state is None:
+            candidates = self.records
+        else:
+            states = state if isinstance(state, tuple) else (state,)
+            candidates = [r for s in states for r in self._by_state.get(s, ())]
+        for name, value in fields.items():
+            accepted = value if isinstance(value, tuple) else (value,)
+            candidates = [r for r in candidates if getattr(r, name) in accepted]
+        return candidates
+
+    def set_state(self, records, state):
+        """Records a state change we caused, so later phases see it without describing again."""
+        for r in records:
+            self._by_state[r.state].remove(r)
+            r.state = _s(state)
+            self._by_state[r.state].append(r)
+
+
+class Inventory:
+    """
+    One snapshot of a Target's EC2 instances, RDS instances, available EBS volumes,
+    Elastic IPs and EKS node groups, shared by every phase of an invocation.
+
+    Each resource type is swept once, on first use, with one paginated describe; records
+    keep only the fields the phases read (as __slots__ objects with interned strings),
+    not the raw boto3 responses. Phases record the state changes they make through
+    Table.set_state instead of describing again.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self._tables = {}
+        self._locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def _table(self, kind, load):
+        with self._lock:
+            lock = self._locks[kind]
+        # Phases run concurrently (the reaper's discoveries, fan-out clusters); one sweep each
+        with lock:
+            if kind not in self._tables:
+                self._tables[kind] = load()
+                logger.info(f"Inventory of {self.target.label}: {len(self._tables[kind])} {kind}")
+            return self._tables[kind]
+
+    def _paginate(self, service, client, operation, result_key, **kwargs):
+        return self.target.scanner.paginate(service, client, operation, result_key, **kwargs)
+
+    @property
+    def instances(self):
+        return self._table('instances', lambda: Table([
+            Instance(i)
+            for r in self._paginate('ec2', self.target.ec2, 'describe_instances', 'Reservations')
+            for i in r['Instances']
+        ]))
+
+    @property
+    def databases(self):
+        def load():
+            # One bulk tag lookup instead of a list_tags_for_resource round trip per DB
+            tags = load_tag_index(self.target.tagging, 'rds:db', self.target.scanner, scope=self.target.scope)
+            return Table([
+                Database(db, tags.get(db['DBInstanceArn'], 'Environment'))
+                for db in self._paginate('rds', self.target.rds, 'describe_db_instances', 'DBInstances')
+            ])
+        return self._table('databases', load)
+
+    @property
+    def volumes(self):
+        # Only unattached volumes matter to any phase, so the sweep filters server-side
+        return self._table('volumes', lambda: [
+            Volume(v)
+            for v in self._paginate('ec2', self.target.ec2, 'describe_volumes', 'Volumes',
+                                    Filters=[{'Name': 'status', 'Values': ['available']}])
+        ])
+
+    @property
+    def addresses(self):
+        return self._table('addresses', lambda: [
+            Address(a) for a in self._paginate('ec2', self.target.ec2, 'describe_addresses', 'Addresses')
+        ])
+
+    def nodegroup_names(self, cluster):
+        return self._table(f"nodegroup names in {cluster}", lambda: list(
+            self._paginate('eks', self.target.eks, 'list_nodegroups', 'nodegroups', clusterName=cluster)
+        ))
+
+    def nodegroups(self, cluster):
+        """Described node groups of one cluster; the restore path only needs nodegroup_names()."""
+        def load():
+            results = self.target.scanner.map(
+                'eks', lambda ng: self.target.eks.describe_nodegroup(clusterName=cluster, nodegroupName=ng)['nodegroup'],
+                self.nodegroup_names(cluster))
+            raise_first_error(results)
+            return [NodeGroup(r.result) for r in results]
+        return self._table(f"node groups in {cluster}", load)
@@ -1,36 +1,41 @@
-import boto3
 import json
+import os
+
+from ops_common.clients import ClientPool
+
+from capacity_store import CapacitySnapshotStore, backend_from_env, restore_from_snapshot, snapshot_and_scale_down
+
+# Kept across warm invocations instead of rebuilt on every call
+CLIENTS = ClientPool()
 
 def lambda_handler(event, context):
     action = event.get('action', 'status')
-    eks = boto3.client('eks')
-    cluster_name = 'amazon-cluster'
-    
+    eks = CLIENTS.client('eks')
+    cluster_name = os.environ.get('CLUSTER_NAME', 'amazon-cluster')
+    # Same snapshot store as index.py, so either function can restore what the other scaled down
+    store = CapacitySnapshotStore(backend_from_env(CLIENTS.lazy))
+
     # Get node groups
-    nodegroups = eks.list_nodegroups(clusterName=cluster_name)['nodegroups']
-    
+    nodegroups = [ng for page in eks.get_paginator('list_nodegroups').paginate(clusterName=cluster_name)
+                  for ng in page['nodegroups']]
+
     results = []
-    
+
     for ng in nodegroups:
         if action == 'stop':
-            eks.update_nodegroup_config(
-                clusterName=cluster_name,
-                nodegroupName=ng,
-                scalingConfig={'desiredSize': 0}
-            )
-            results.append(f"Stopped {ng}")
+            version = snapshot_and_scale_down(eks, store, cluster_name, ng)
+            results.append(f"Stopped {ng}" + (f" (snapshot v{version})" if version else ""))
         elif action == 'start':
-            eks.update_nodegroup_config(
-                clusterName=cluster_name,
-                nodegroupName=ng,
-                scalingConfig={'desiredSize': 2}
-            )
-            results.append(f"Started {ng}")
+            scaling, version = restore_from_snapshot(eks, store, cluster_name, ng)
+            source = f"snapshot v{version}" if version else "default"
+            results.append(f"Started {ng} with desiredSize={scaling['desiredSize']} ({source})")
         else:
             desc = eks.describe_nodegroup(clusterName=cluster_name, nodegroupName=ng)
             size = desc['nodegroup']['scalingConfig']['desiredSize']
-            results.append(f"Nodegroup {ng} current size: {size}")
-            
+            snapshot = store.load(cluster_name, ng)
+            saved = f", saved desiredSize: {snapshot[0]['desiredSize']} (v{snapshot[1]})" if snapshot else ""
+            results.append(f"Nodegroup {ng} current size: {size}{saved}")
+
     return {
         'statusCode': 200,
         'body': json.dumps({'message': results})
@@ -0,0 +1,192 @@
+import logging
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger()
+
+REAPER_DRY_RUN = os.environ.get('REAPER_DRY_RUN', 'false') == 'true'
+# Only snapshots carrying this Environment tag are ever deleted; backups and DR copies of
+# everything else in the account are left alone. Empty disables snapshot cleanup.
+SNAPSHOT_ENV = os.environ.get('REAPER_SNAPSHOT_ENV', 'Dev')
+# Snapshots older than this (and not backing an AMI) are deleted
+SNAPSHOT_MAX_AGE_DAYS = int(os.environ.get('REAPER_SNAPSHOT_DAYS', 90))
+
+HOURS_PER_MONTH = 730
+
+# us-east-1 list prices, USD. Close enough elsewhere to rank and total what a run saves.
+EBS_GB_MONTH = {
+    'gp2': 0.10,
+    'gp3': 0.08,
+    'io1': 0.125,
+    'io2': 0.125,
+    'st1': 0.045,
+    'sc1': 0.015,
+    'standard': 0.05,
+}
+EBS_PIOPS_MONTH = 0.065        # io1/io2 provisioned IOPS
+GP3_IOPS_MONTH = 0.005         # gp3 IOPS above the 3,000 baseline
+GP3_THROUGHPUT_MONTH = 0.04    # gp3 MB/s above the 125 MB/s baseline
+SNAPSHOT_GB_MONTH = {'standard': 0.05, 'archive': 0.0125}
+EIP_IDLE_HOUR = 0.005
+
+PlanItem = namedtuple('PlanItem', ['kind', 'resource_id', 'monthly_savings', 'detail'])
+
+KIND_LABELS = OrderedDict([
+    ('volume', 'volumes'),
+    ('snapshot', 'snapshots'),
+    ('eip', 'EIPs'),
+    ('eni', 'ENIs'),
+])
+
+
+def volume_monthly_cost(volume):
+    """volume: an inventory Volume record."""
+    cost = volume.size * EBS_GB_MONTH.get(volume.type, EBS_GB_MONTH['gp2'])
+    if volume.type in ('io1', 'io2'):
+        cost += (volume.iops or 0) * EBS_PIOPS_MONTH
+    elif volume.type == 'gp3':
+        cost += max(0, (volume.iops or 3000) - 3000) * GP3_IOPS_MONTH
+        cost += max(0, (volume.throughput or 125) - 125) * GP3_THROUGHPUT_MONTH
+    return cost
+
+
+def snapshot_monthly_cost(snapshot):
+    """Upper bound: snapshots are incremental, so the volume size overstates what one holds."""
+    return snapshot.get('VolumeSize', 0) * SNAPSHOT_GB_MONTH.get(snapshot.get('StorageTier', 'standard'), 0.05)
+
+
+def _tags(resource):
+    return {t['Key']: t['Value'] for t in resource.get('Tags') or resource.get('TagSet') or []}
+
+
+def _protected(tags):
+    return tags.get('DoNotDelete') == 'true'
+
+
+class Reaper:
+    """
+    Finds orphaned EBS volumes, old snapshots of the dev environment, idle Elastic IPs and unattached ENIs,
+    prices what deleting each one saves per month, and deletes them through the scanner's
+    rate limits. plan() never deletes anything, so it doubles as the dry run.
+    Volumes and Elastic IPs come from the invocation's shared Inventory.
+    """
+
+    def __init__(self, ec2, scanner, inventory, snapshot_max_age_days=SNAPSHOT_MAX_AGE_DAYS,
+                 snapshot_env=SNAPSHOT_ENV, now=None):
+        self.ec2 = ec2
+        self.scanner = scanner
+        self.inventory = inventory
+        self.snapshot_max_age_days = snapshot_max_age_days
+        self.snapshot_env = snapshot_env
+        self.now = now or datetime.now(timezone.utc)
+
+    def _paginate(self, operation, result_key, **kwargs):
+        return self.scanner.paginate('ec2', self.ec2, operation, result_key, **kwargs)
+
+    def orphaned_volumes(self):
+        for vol in self.inventory.volumes:
+            if vol.protected:
+                continue
+            # Safety check: Is this a Kubernetes PVC?
+            if vol.pvc:
+                logger.info(f"Skipping PVC volume: {vol.id}")
+                continue
+            yield PlanItem('volume', vol.id, volume_monthly_cost(vol), f"{vol.size} GiB {vol.type}")
+
+    def old_snapshots(self):
+        if not self.snapshot_env:
+            return
+        cutoff = self.now - timedelta(days=self.snapshot_max_age_days)
+        # AWS refuses to delete a snapshot an AMI is built from, so leave those to AMI cleanup
+        in_use = {
+            mapping['Ebs']['SnapshotId']
+            for image in self._paginate('describe_images', 'Images', Owners=['self'])
+            for mapping in image.get('BlockDeviceMappings', [])
+            if 'SnapshotId' in mapping.get('Ebs', {})
+        }
+        for snap in self._paginate('describe_snapshots', 'Snapshots', OwnerIds=['self'],
+                                   Filters=[{'Name': 'tag:Environment', 'Values': [self.snapshot_env]}]):
+            tags = _tags(snap)
+            if tags.get('Environment') != self.snapshot_env:
+                continue
+            if snap['StartTime'] >= cutoff or snap['SnapshotId'] in in_use or _protected(tags):
+                continue
+            age = (self.now - snap['StartTime']).days
+            yield PlanItem('snapshot', snap['SnapshotId'], snapshot_monthly_cost(snap),
+                           f"{snap.get('VolumeSize', 0)} GiB, {age} days old")
+
+    def idle_eips(self):
+        for eip in self.inventory.addresses:
+            if eip.associated or eip.protected:
+                continue
+            yield PlanItem('eip', eip.id, EIP_IDLE_HOUR * HOURS_PER_MONTH, eip.public_ip)
+
+    def unattached_enis(self):
+        for eni in self._paginate('describe_network_interfaces', 'NetworkInterfaces',
+                                  Filters=[{'Name': 'status', 'Values': ['available']}]):
+            # Interfaces AWS manages itself (load balancers, NAT gateways, endpoints) are never ours to delete
+            if eni.get('RequesterManaged') or eni.get('InterfaceType', 'interface') != 'interface':
+                continue
+            if _protected(_tags(eni)):
+                continue
+            yield PlanItem('eni', eni['NetworkInterfaceId'], 0.0, eni.get('Description', ''))
+
+    def plan(self):
+        """Runs every discovery concurrently and returns the deletion plan, most valuable first."""
+        sources = [self.orphaned_volumes, self.old_snapshots, self.idle_eips, self.unattached_enis]
+        with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+            found = list(pool.map(lambda source: list(source()), sources))
+        items = [item for items in found for item in items]
+        return sorted(items, key=lambda i: (-i.monthly_savings, i.kind, i.resource_id))
+
+    def _delete(self, item):
+        if item.kind == 'volume':
+            return self.ec2.delete_volume(VolumeId=item.resource_id)
+        if item.kind == 'snapshot':
+            return self.ec2.delete_snapshot(SnapshotId=item.resource_id)
+        if item.kind == 'eip':
+            return self.ec2.release_address(AllocationId=item.resource_id)
+        if item.kind == 'eni':
+            return self.ec2.delete_network_interface(NetworkInterfaceId=item.resource_id)
+        raise ValueError(f"Unknown plan item kind: {item.kind}")
+
+    def execute(self, plan):
+        """Deletes every planned resource in parallel. Returns ScanResults in plan order."""
+        results = self.scanner.map('ec2', self._delete, plan)
+        for r in results:
+            if r.error:
+                logger.error(f"Failed to delete {r.item.kind} {r.item.resource_id}: {r.error}")
+            else:
+                logger.info(f"Deleted orphaned {r.item.kind}: {r.item.resource_id}")
+        return results
+
+
+def _totals(items):
+    totals = OrderedDict((kind, [0, 0.0]) for kind in KIND_LABELS)
+    for item in items:
+        totals[item.kind][0] += 1
+        totals[item.kind][1] += item.monthly_savings
+    return ", ".join(f"{n} {KIND_LABELS[kind]} ${cost:,.2f}" for kind, (n, cost) in totals.items() if n)
+
+
+def summarize(plan, results=None, top=5):
+    """One report line for the plan (dry run) or for what was actually deleted."""
+    if not plan:
+        return "🧹 Reaper: no orphaned resources found."
+
+    if results is None:
+        savings = sum(i.monthly_savings for i in plan)
+        biggest = "; ".join(f"{i.resource_id} ({i.detail}) ${i.monthly_savings:,.2f}" for i in plan[:top])
+        return (f"🧹 Reaper plan (dry run): {len(plan)} resources, est. savings ${savings:,.2f}/month "
+                f"({_totals(plan)}). Largest: {biggest}")
+
+    deleted = [r.item for r in results if not r.error]
+    failed = [r.item for r in results if r.error]
+    savings = sum(i.monthly_savings for i in deleted)
+    line = (f"🧹 Reaper: deleted {len(deleted)}/{len(plan)} orphaned resources, est. savings "
+            f"${savings:,.2f}/month ({_totals(deleted) or 'nothing deleted'}).")
+    if failed:
+        line += f" Failed: {', '.join(i.resource_id for i in failed[:10])}" + (" …" if len(failed) > 10 else "")
+    return line
@@ -0,0 +1,76 @@
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from scanner import is_throttle, raise_first_error
+
+logger = logging.getLogger()
+
+# cold: stop instances and scale node groups to zero
+# warm: hibernate the instances configured for it, so they resume with memory and disks intact.
+# EKS managed node groups do not support ASG warm pools (a warm instance would run the node
+# bootstrap), so node groups scale to zero through EKS in both modes.
+RESUME_MODE = os.environ.get('RESUME_MODE', 'cold')
+
+
+def is_warm(mode=None):
+    return (mode or RESUME_MODE) == 'warm'
+
+
+def _chunks(ids, size=1000):
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+def hibernate_or_stop(ec2, scanner, instances):
+    """
+    Hibernates the instances configured for it and stops the rest. A batch EC2 refuses to
+    hibernate (e.g. launched too recently for hibernation to be ready) is stopped instead.
+    Returns (hibernated ids, stopped ids).
+    """
+    capable = [i.id for i in instances if i.hibernation]
+    plain = [i.id for i in instances if not i.hibernation]
+
+    def hibernate(chunk):
+        try:
+            ec2.stop_instances(InstanceIds=chunk, Hibernate=True)
+            return True
+        except ClientError as e:
+            if is_throttle(e):
+                raise
+            logger.warning(f"Hibernate refused for {len(chunk)} instances ({e.response['Error']['Code']}), stopping instead")
+            ec2.stop_instances(InstanceIds=chunk)
+            return False
+
+    results = scanner.map('ec2', hibernate, _chunks(capable))
+    raise_first_error(results)
+    raise_first_error(scanner.map('ec2', lambda chunk: ec2.stop_instances(InstanceIds=chunk), _chunks(plain)))
+
+    hibernated, stopped = [], list(plain)
+    for r in results:
+        (hibernated if r.result else stopped).extend(r.item)
+    return hibernated, stopped
+
+
+def wait_for_capacity(asg_client, names, deadline, delay):
+    """
+    Polls until every ASG has as many InService instances as it wants, or `deadline` passes.
+    Node groups report ACTIVE long before their nodes are up, so this is what resume time is
+    measured against. Returns True once all are in service.
+    """
+    pending = list(names)
+    while pending:
+        groups = []
+        for i in range(0, len(pending), 50):
+            groups.extend(asg_client.describe_auto_scaling_groups(AutoScalingGroupNames=pending[i:i + 50])['AutoScalingGroups'])
+        pending = [
+            g['AutoScalingGroupName'] for g in groups
+            if sum(1 for inst in g.get('Instances', []) if inst['LifecycleState'] == 'InService') < g['DesiredCapacity']
+        ]
+        if not pending:
+            return True
+        if time.time() + delay > deadline:
+            return False
+        time.sleep(delay)
+    return True
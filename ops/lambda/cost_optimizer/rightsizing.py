@@ -0,0 +1,224 @@
+import logging
+import math
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger()
+
+LOOKBACK_DAYS = int(os.environ.get('RIGHTSIZING_LOOKBACK_DAYS', 7))
+PERIOD = int(os.environ.get('RIGHTSIZING_PERIOD', 3600))
+# Headroom the recommended size must keep: projected p95 / max CPU after the downsize
+CPU_TARGET_P95 = float(os.environ.get('RIGHTSIZING_CPU_TARGET_P95', 40.0))
+CPU_TARGET_MAX = float(os.environ.get('RIGHTSIZING_CPU_TARGET_MAX', 80.0))
+# Share of the smaller size's baseline network / EBS bandwidth the p95 throughput may use
+IO_TARGET = float(os.environ.get('RIGHTSIZING_IO_TARGET', 60.0))
+
+# Hard API limit: MetricDataQueries per get_metric_data request
+MAX_QUERIES = 500
+
+# (label, metric name, statistic). Byte counters are summed per period and reported as bytes/s.
+METRICS = [
+    ('cpu', 'CPUUtilization', 'Maximum'),
+    ('net_in', 'NetworkIn', 'Sum'),
+    ('net_out', 'NetworkOut', 'Sum'),
+    ('ebs_read', 'EBSReadBytes', 'Sum'),
+    ('ebs_write', 'EBSWriteBytes', 'Sum'),
+]
+METRIC_INDEX = {label: j for j, (label, _, _) in enumerate(METRICS)}
+PERCENTILES = [50, 95]
+
+# AWS size normalization factors, used as relative capacity between sizes of one family
+SIZE_FACTORS = {
+    'nano': 0.25, 'micro': 0.5, 'small': 1, 'medium': 2, 'large': 4, 'xlarge': 8,
+    '2xlarge': 16, '3xlarge': 24, '4xlarge': 32, '6xlarge': 48, '8xlarge': 64, '9xlarge': 72,
+    '10xlarge': 80, '12xlarge': 96, '16xlarge': 128, '18xlarge': 144, '24xlarge': 192,
+    '32xlarge': 256, '48xlarge': 384,
+}
+
+# Baseline (sustained, not burst) bandwidth per size in Gbit/s, approximated across current
+# generation families; a downsize that needs burst credits to keep up is no downsize.
+# Network limits apply per direction, EBS limits to reads and writes together.
+NETWORK_BASELINE_GBPS = {
+    'nano': 0.032, 'micro': 0.064, 'small': 0.128, 'medium': 0.256, 'large': 0.5, 'xlarge': 1.0,
+    '2xlarge': 2.0, '3xlarge': 3.0, '4xlarge': 4.5, '6xlarge': 7.5, '8xlarge': 10, '9xlarge': 10,
+    '10xlarge': 10, '12xlarge': 12, '16xlarge': 20, '18xlarge': 25, '24xlarge': 25,
+    '32xlarge': 50, '48xlarge': 50,
+}
+EBS_BASELINE_GBPS = {
+    'nano': 0.043, 'micro': 0.087, 'small': 0.174, 'medium': 0.347, 'large': 0.65, 'xlarge': 1.15,
+    '2xlarge': 2.3, '3xlarge': 3.5, '4xlarge': 4.75, '6xlarge': 6.0, '8xlarge': 6.8, '9xlarge': 9.5,
+    '10xlarge': 9.5, '12xlarge': 9.5, '16xlarge': 13.6, '18xlarge': 19, '24xlarge': 19,
+    '32xlarge': 19, '48xlarge': 19,
+}
+
+BURSTABLE_LADDER = ['nano', 'micro', 'small', 'medium', 'large', 'xlarge', '2xlarge']
+GRAVITON_LADDER = ['medium', 'large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge', '16xlarge']
+DEFAULT_LADDER = ['large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge', '16xlarge', '24xlarge']
+
+# Sizes actually offered per family; anything not listed falls back to DEFAULT_LADDER
+FAMILY_LADDERS = {
+    't2': BURSTABLE_LADDER, 't3': BURSTABLE_LADDER, 't3a': BURSTABLE_LADDER, 't4g': BURSTABLE_LADDER,
+    'm6g': GRAVITON_LADDER, 'm7g': GRAVITON_LADDER, 'c6g': GRAVITON_LADDER, 'c7g': GRAVITON_LADDER,
+    'r6g': GRAVITON_LADDER, 'r7g': GRAVITON_LADDER,
+    'm5': ['large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge', '16xlarge', '24xlarge'],
+    'c5': ['large', 'xlarge', '2xlarge', '4xlarge', '9xlarge', '12xlarge', '18xlarge', '24xlarge'],
+    'r5': ['large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge', '16xlarge', '24xlarge'],
+}
+
+UsageStats = namedtuple('UsageStats', ['instance_ids', 'p50', 'p95', 'max', 'samples'])
+Recommendation = namedtuple('Recommendation', ['instance_id', 'current_type', 'target_type', 'cpu', 'net_bps', 'ebs_bps'])
+
+
+def _batches(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def percentile(ordered, q):
+    """q-th percentile of an ascending list, interpolated linearly like numpy's default."""
+    rank = (len(ordered) - 1) * q / 100.0
+    low = int(math.floor(rank))
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _fits_bandwidth(size, net_bps, ebs_bps, io_target):
+    """True if p95 network (busier direction) and EBS throughput, in bytes/s, fit the size's baseline."""
+    limit = io_target / 100.0 * 1e9 / 8
+    return net_bps <= NETWORK_BASELINE_GBPS[size] * limit and ebs_bps <= EBS_BASELINE_GBPS[size] * limit
+
+
+def target_size(instance_type, cpu_p95, cpu_max, net_bps=0.0, ebs_bps=0.0,
+                target_p95=CPU_TARGET_P95, target_max=CPU_TARGET_MAX, io_target=IO_TARGET):
+    """
+    Walks the family's size ladder down from the current size and returns the smallest
+    instance type whose projected CPU still fits the headroom targets and whose baseline
+    network and EBS bandwidth still carry the p95 throughput (or the current type).
+    """
+    family, _, size = instance_type.partition('.')
+    ladder = FAMILY_LADDERS.get(family, DEFAULT_LADDER)
+    if size not in ladder or size not in SIZE_FACTORS:
+        return instance_type
+
+    current = SIZE_FACTORS[size]
+    best = size
+    for candidate in reversed(ladder[:ladder.index(size)]):
+        scale = current / SIZE_FACTORS[candidate]
+        if cpu_p95 * scale > target_p95 or cpu_max * scale > target_max:
+            break
+        if not _fits_bandwidth(candidate, net_bps, ebs_bps, io_target):
+            break
+        best = candidate
+    return f"{family}.{best}"
+
+
+class RightSizingEngine:
+    """
+    Fetches CPU, network and EBS metrics for the whole fleet with batched GetMetricData
+    requests and reduces every series to p50/p95/max as its batch arrives, so memory
+    stays at one batch of datapoints however large the fleet is. CPU picks the size;
+    network and EBS throughput keep it from dropping below what the instance moves.
+    """
+
+    def __init__(self, cw, scanner, lookback_days=LOOKBACK_DAYS, period=PERIOD):
+        self.cw = cw
+        self.scanner = scanner
+        self.lookback = timedelta(days=lookback_days)
+        self.period = period
+
+    def _window(self):
+        end = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        return end - self.lookback, end
+
+    def _queries(self, instance_ids, offset):
+        queries = []
+        for i, instance_id in enumerate(instance_ids, start=offset):
+            for j, (_, metric, stat) in enumerate(METRICS):
+                queries.append({
+                    'Id': f"m{i}_{j}",
+                    'MetricStat': {
+                        'Metric': {
+                            'Namespace': 'AWS/EC2',
+                            'MetricName': metric,
+                            'Dimensions': [{'Name': 'InstanceId', 'Value': instance_id}],
+                        },
+                        'Period': self.period,
+                        'Stat': stat,
+                    },
+                    'ReturnData': True,
+                })
+        return queries
+
+    def _fetch_batch(self, batch, start, end):
+        """{(instance, metric): {period bin: value}} of one batch, series merged across pages."""
+        offset, instance_ids = batch
+        series = {}
+        start_ts, bins = start.timestamp(), int((end - start).total_seconds() // self.period)
+        # Plain paginator here: the scanner already holds this call's CloudWatch slot
+        pages = self.cw.get_paginator('get_metric_data').paginate(
+            MetricDataQueries=self._queries(instance_ids, offset),
+            StartTime=start,
+            EndTime=end,
+            ScanBy='TimestampAscending',
+        )
+        for page in pages:
+            for r in page['MetricDataResults']:
+                if not r['Values']:
+                    continue
+                i, j = (int(x) for x in r['Id'][1:].split('_'))
+                points = series.setdefault((i, j), {})
+                for t, value in zip(r['Timestamps'], r['Values']):
+                    b = int((t.timestamp() - start_ts) // self.period)
+                    if 0 <= b < bins:
+                        points[b] = value
+        return series
+
+    def fetch(self, instance_ids):
+        """Returns UsageStats of per-instance lists indexed by METRICS; None where no data was reported."""
+        start, end = self._window()
+        n, m = len(instance_ids), len(METRICS)
+        p50 = [[None] * m for _ in range(n)]
+        p95 = [[None] * m for _ in range(n)]
+        peak = [[None] * m for _ in range(n)]
+        samples = [[0] * m for _ in range(n)]
+
+        per_request = MAX_QUERIES // m
+        batches = [(k * per_request, ids) for k, ids in enumerate(_batches(instance_ids, per_request))]
+        logger.info(f"Fetching {n * m} metric series in {len(batches)} GetMetricData batches")
+
+        for batch, series, error in self.scanner.map('cloudwatch', lambda b: self._fetch_batch(b, start, end), batches):
+            if error:
+                logger.error(f"Failed to get metrics for {len(batch[1])} instances: {error}")
+                continue
+            for (i, j), points in series.items():
+                # Byte counters were summed per period; normalize to bytes/s
+                scale = self.period if METRICS[j][2] == 'Sum' else 1
+                ordered = sorted(v / scale for v in points.values())
+                p50[i][j], p95[i][j] = (percentile(ordered, q) for q in PERCENTILES)
+                peak[i][j] = ordered[-1]
+                samples[i][j] = len(ordered)
+        return UsageStats(list(instance_ids), p50, p95, peak, samples)
+
+    def recommend(self, instances):
+        """instances: inventory Instance records. Returns a list of Recommendations."""
+        if not instances:
+            return []
+        stats = self.fetch([i.id for i in instances])
+        cpu = METRIC_INDEX['cpu']
+
+        def p95s(k, *labels):
+            return [stats.p95[k][METRIC_INDEX[label]] or 0.0 for label in labels]
+
+        recommendations = []
+        for k, i in enumerate(instances):
+            if not stats.samples[k][cpu]:
+                continue
+            cpu_stats = (stats.p50[k][cpu], stats.p95[k][cpu], stats.max[k][cpu])
+            # Network bandwidth is per direction; EBS bandwidth is shared by reads and writes
+            net_bps = max(p95s(k, 'net_in', 'net_out'))
+            ebs_bps = sum(p95s(k, 'ebs_read', 'ebs_write'))
+            target = target_size(i.type, cpu_stats[1], cpu_stats[2], net_bps, ebs_bps)
+            if target == i.type:
+                continue
+            recommendations.append(Recommendation(i.id, i.type, target, cpu_stats, net_bps, ebs_bps))
+        return recommendations
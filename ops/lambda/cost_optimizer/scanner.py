@@ -0,0 +1,175 @@
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import botocore.session
+from botocore.exceptions import ClientError
+
+from ops_common.metrics import THROTTLE_CODES
+
+logger = logging.getLogger()
+
+# Per-service ceilings on in-flight calls. EKS and ASG control planes throttle much earlier than EC2.
+DEFAULT_LIMITS = {
+    'ec2': 10,
+    'rds': 8,
+    'eks': 4,
+    'autoscaling': 4,
+    'cloudwatch': 4,
+}
+
+MAX_WORKERS = int(os.environ.get('SCANNER_MAX_WORKERS', 16))
+
+ScanResult = namedtuple('ScanResult', ['item', 'result', 'error'])
+
+
+_PAGINATOR_MODELS = {}
+_PAGINATOR_LOCK = threading.Lock()
+
+
+def _page_tokens(client, operation):
+    """Returns (input_token, output_token) for a paginated operation, or None if it has a single page."""
+    if not client.can_paginate(operation):
+        return None
+    service = client.meta.service_model.service_name
+    with _PAGINATOR_LOCK:
+        if service not in _PAGINATOR_MODELS:
+            _PAGINATOR_MODELS[service] = botocore.session.get_session().get_paginator_model(service)
+    config = _PAGINATOR_MODELS[service].get_paginator(client.meta.method_to_api_mapping[operation])
+    if not isinstance(config['input_token'], str):
+        return None
+    return config['input_token'], config['output_token']
+
+
+def is_throttle(error):
+    """True if a ClientError is AWS asking us to back off."""
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLE_CODES
+
+
+def _retried(response):
+    """True if a boto3 response needed retries, i.e. the service pushed back before it succeeded."""
+    return isinstance(response, dict) and (response.get('ResponseMetadata') or {}).get('RetryAttempts', 0) > 0
+
+
+def raise_first_error(results):
+    """Re-raises the first failure of a map() so callers keep their all-or-nothing error reports."""
+    for r in results:
+        if r.error is not None:
+            raise r.error
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency gate for a single AWS service.
+    Halves the number of in-flight calls on every throttle and adds one back after
+    a full window of successes (AIMD), never exceeding the configured ceiling.
+    """
+
+    def __init__(self, limit):
+        self.max_limit = max(1, limit)
+        self.limit = self.max_limit
+        self.active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class FleetScanner:
+    """
+    Shared scanning engine for the Cost Terminator.
+    Runs per-resource API calls through a bounded thread pool with a per-service
+    AdaptiveLimiter. Retries and their backoff are botocore's (the ClientPool's standard
+    mode); the limiter only decides how many calls each service gets at once.
+    """
+
+    def __init__(self, limits=None, max_workers=MAX_WORKERS):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.max_workers = max(1, max_workers)
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def _limiter(self, service):
+        with self._lock:
+            if service not in self._limiters:
+                limit = min(self.limits.get(service, self.max_workers), self.max_workers)
+                self._limiters[service] = AdaptiveLimiter(limit)
+            return self._limiters[service]
+
+    def call(self, service, fn, *args, **kwargs):
+        """
+        Runs fn once under the service's limiter. A call that ended throttled, or only
+        succeeded after botocore retried it, halves the service's concurrency.
+        """
+        limiter = self._limiter(service)
+        limiter.acquire()
+        backed_off = False
+        try:
+            result = fn(*args, **kwargs)
+            backed_off = _retried(result)
+            return result
+        except ClientError as e:
+            backed_off = is_throttle(e)
+            if backed_off:
+                logger.warning(f"Throttled by {service} after botocore's retries: {e}")
+            raise
+        finally:
+            limiter.release(backed_off)
+
+    def paginate(self, service, client, operation, result_key, **kwargs):
+        """
+        Yields every entry of result_key across all pages of a describe/list call.
+        Each page is its own call(), so a throttle fails or retries that page rather than the whole sweep.
+        """
+        method = getattr(client, operation)
+        tokens = _page_tokens(client, operation)
+        if tokens is None:
+            yield from self.call(service, method, **kwargs).get(result_key, [])
+            return
+
+        input_token, output_token = tokens
+        kwargs = dict(kwargs)
+        while True:
+            page = self.call(service, method, **kwargs)
+            yield from page.get(result_key, [])
+            token = page.get(output_token)
+            if not token:
+                return
+            kwargs[input_token] = token
+
+    def map(self, service, fn, items):
+        """
+        Applies fn to every item concurrently and returns ScanResults in input order.
+        fn must not call back into the scanner for the same service.
+        """
+        items = list(items)
+        if not items:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as pool:
+            futures = [pool.submit(self.call, service, fn, item) for item in items]
+
+        results = []
+        for item, future in zip(items, futures):
+            error = future.exception()
+            results.append(ScanResult(item, None if error else future.result(), error))
+        return results
@@ -0,0 +1,89 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger()
+
+TAG_CACHE_TTL = int(os.environ.get('TAG_CACHE_TTL', 300))
+
+# get_resources returns at most 100 resources per page
+PAGE_SIZE = 100
+
+# Module-level so the index survives warm Lambda invocations
+_CACHE = {}
+_LOCK = threading.Lock()
+
+
+class TagIndex:
+    """
+    ARN -> tags lookup for one resource type, built from bulk Resource Groups Tagging API pages.
+    Keys and values are whitespace-stripped, matching how the sweeps have always compared tags.
+    """
+
+    def __init__(self, tags_by_arn, loaded_at=None):
+        self._tags = tags_by_arn
+        self.loaded_at = loaded_at if loaded_at is not None else time.time()
+
+    def __len__(self):
+        return len(self._tags)
+
+    def __contains__(self, arn):
+        return arn in self._tags
+
+    def tags(self, arn):
+        """All tags for an ARN; resources with no tags at all are absent from the API and return {}."""
+        return self._tags.get(arn, {})
+
+    def get(self, arn, key, default=None):
+        return self._tags.get(arn, {}).get(key, default)
+
+    def matching(self, key, value):
+        """ARNs whose tag `key` equals `value`."""
+        return [arn for arn, tags in self._tags.items() if tags.get(key) == value]
+
+    def age(self):
+        return time.time() - self.loaded_at
+
+
+def _normalize(tag_list):
+    return {t['Key'].strip(): t['Value'].strip() for t in tag_list}
+
+
+def load_tag_index(tagging, resource_type, scanner, tag_filters=None, ttl=TAG_CACHE_TTL, refresh=False, scope=None):
+    """
+    Returns a TagIndex for every resource of `resource_type` (e.g. 'rds:db') in the client's region,
+    served from the in-memory cache while it is younger than `ttl` seconds.
+    tag_filters is passed straight to get_resources, e.g. [{'Key': 'Environment', 'Values': ['Dev']}].
+    scope tells apart clients for the same region in different accounts.
+    """
+    filters_key = tuple((f['Key'], tuple(f.get('Values', []))) for f in tag_filters or [])
+    cache_key = (scope, tagging.meta.region_name, resource_type, filters_key)
+
+    with _LOCK:
+        cached = _CACHE.get(cache_key)
+        if cached and not refresh and cached.age() < ttl:
+            logger.info(f"Tag index hit for {resource_type} ({len(cached)} resources, {cached.age():.0f}s old)")
+            return cached
+
+    kwargs = {'ResourceTypeFilters': [resource_type], 'ResourcesPerPage': PAGE_SIZE}
+    if tag_filters:
+        kwargs['TagFilters'] = tag_filters
+
+    tags_by_arn = {
+        r['ResourceARN']: _normalize(r.get('Tags', []))
+        for r in scanner.paginate('tagging', tagging, 'get_resources', 'ResourceTagMappingList', **kwargs)
+    }
+    index = TagIndex(tags_by_arn)
+    logger.info(f"Loaded tag index for {resource_type}: {len(index)} resources")
+
+    with _LOCK:
+        _CACHE[cache_key] = index
+    return index
+
+
+def invalidate(resource_type=None):
+    """Drops cached indexes, e.g. after tagging resources within the same invocation."""
+    with _LOCK:
+        for key in [k for k in _CACHE if resource_type in (None, k[2])]:
+            del _CACHE[key]
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import WaiterError
+
+from ops_common.metrics import METRICS
+
+logger = logging.getLogger()
+
+# Seconds of Lambda time kept back for writing the checkpoint and publishing the report
+SAFETY_MARGIN = int(os.environ.get('WARMUP_SAFETY_MARGIN', 30))
+# Budget per invocation when there is no Lambda context (local runs, Step Functions activities)
+DEFAULT_BUDGET = int(os.environ.get('WARMUP_BUDGET', 240))
+# A warm-up still unfinished after this long fails instead of being resumed again
+MAX_WARMUP_SECONDS = int(os.environ.get('WARMUP_MAX_SECONDS', 3600))
+POLL_DELAY = int(os.environ.get('WARMUP_POLL_DELAY', 15))
+# Standard-tier SSM parameters hold at most 4 KB; leave room for the key and encoding
+CHECKPOINT_LIMIT = 3900
+
+# run(state, deadline) -> True once the stage is complete, False if it ran out of time
+Stage = namedtuple('Stage', ['name', 'run'])
+
+
+def deadline_from(context, budget=DEFAULT_BUDGET):
+    """Wall-clock time by which this invocation must checkpoint and return."""
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        return time.time() + context.get_remaining_time_in_millis() / 1000.0 - SAFETY_MARGIN
+    return time.time() + budget
+
+
+def wait_for(client, waiter_name, deadline, delay=POLL_DELAY, **kwargs):
+    """
+    Runs a boto3 waiter for at most the time left before `deadline`.
+    Returns True when the resource is ready, False when time ran out; real failures raise.
+    """
+    attempts = max(1, int((deadline - time.time()) // delay))
+    try:
+        client.get_waiter(waiter_name).wait(WaiterConfig={'Delay': delay, 'MaxAttempts': attempts}, **kwargs)
+        return True
+    except WaiterError as e:
+        if e.kwargs.get('reason') == 'Max attempts exceeded':
+            return False
+        raise
+
+
+def wait_all(waits):
+    """Runs zero-argument wait callables concurrently; True only if every one of them is ready."""
+    if not waits:
+        return True
+    with ThreadPoolExecutor(max_workers=len(waits)) as pool:
+        return all(list(pool.map(lambda w: w(), waits)))
+
+
+def note(state, text, limit=400):
+    """Adds a report line to the checkpoint, truncated so it stays within a 4 KB SSM parameter."""
+    if text:
+        state['report'].append(text if len(text) <= limit else f"{text[:limit]}… (truncated)")
+
+
+def fit_report(doc, limit=CHECKPOINT_LIMIT):
+    """Drops the newest report lines until the JSON checkpoint fits `limit`, counting them in doc['dropped']."""
+    while doc['report'] and len(json.dumps(doc, sort_keys=True)) > limit:
+        doc['report'].pop()
+        doc['dropped'] = doc.get('dropped', 0) + 1
+    return doc
+
+
+def new_state():
+    return {'stage': 0, 'startedAt': time.time(), 'timings': {}, 'report': [], 'invocations': 0}
+
+
+def expired(state):
+    return time.time() - state['startedAt'] > MAX_WARMUP_SECONDS
+
+
+class WarmupScheduler:
+    """
+    Runs dependency-ordered stages, checkpointing progress between Lambda invocations.
+
+    The checkpoint is persisted through a capacity_store backend (so plain repeated
+    invocations resume) and also returned to the caller (so a Step Functions loop can
+    pass it back in the next event).
+    """
+
+    def __init__(self, stages, backend, key):
+        self.stages = stages
+        self.backend = backend
+        self.key = key
+
+    def load(self, checkpoint=None):
+        """Picks the checkpoint to resume from: explicit event payload first, then the backend."""
+        state = checkpoint
+        if state is None:
+            found = self.backend.get(self.key)
+            state = found[0] if found else None
+        return state or new_state()
+
+    def give_up(self, state):
+        """Ends a warm-up that has run past MAX_WARMUP_SECONDS, so nothing resumes it again."""
+        stage = self.stages[min(state['stage'], len(self.stages) - 1)].name
+        logger.error(f"Warm-up gave up at {stage} after {time.time() - state['startedAt']:.0f}s")
+        note(state, f"Warm-up failed: still at {stage} after {MAX_WARMUP_SECONDS}s, giving up.")
+        self.backend.delete(self.key)
+        return 'failed', state
+
+    def run(self, deadline, checkpoint=None):
+        """Advances as many stages as fit before `deadline`. Returns (status, state)."""
+        state = self.load(checkpoint)
+        state['invocations'] += 1
+
+        while state['stage'] < len(self.stages):
+            if expired(state):
+                return self.give_up(state)
+            stage = self.stages[state['stage']]
+            logger.info(f"Warm-up stage {state['stage'] + 1}/{len(self.stages)}: {stage.name}")
+            started = time.time()
+            try:
+                done = stage.run(state, deadline)
+            except Exception as e:
+                logger.error(f"Warm-up stage {stage.name} failed: {e}")
+                note(state, f"Warm-up stage {stage.name} failed: {e}")
+                self.backend.delete(self.key)
+                return 'failed', state
+            finally:
+                elapsed = time.time() - started
+                state['timings'][stage.name] = state['timings'].get(stage.name, 0.0) + elapsed
+                METRICS.observe('ops_phase_duration', elapsed, phase=f"warmup_{stage.name}")
+
+            if not done:
+                if expired(state):
+                    return self.give_up(state)
+                self.backend.put(self.key, state)
+                logger.info(f"Checkpointed warm-up at {stage.name} after {time.time() - state['startedAt']:.0f}s")
+                return 'in_progress', state
+            state['stage'] += 1
+
+        self.backend.delete(self.key)
+        state['report'].append(self.summary(state))
+        return 'success', state
+
+    def summary(self, state):
+        """Per-stage timings in stage order (the checkpoint round trip does not keep dict order)."""
+        total = time.time() - state['startedAt']
+        stages = ", ".join(f"{s.name} {state['timings'].get(s.name, 0.0):.0f}s" for s in self.stages)
+        return f"Warm-up ready in {total:.0f}s over {state['invocations']} invocation(s) ({stages})."
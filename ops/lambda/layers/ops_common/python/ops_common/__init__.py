@@ -0,0 +1,4 @@
+"""
+Shared code for the ops Lambdas, shipped as the `ops_common` Lambda layer
+(ops/terraform/aws/lambda.tf). Lambda puts the layer's python/ directory on sys.path.
+"""
@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger()
+
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 50))
+# 'standard' rather than 'adaptive': FleetScanner already paces throttled services itself
+RETRY_MODE = os.environ.get('AWS_CLIENT_RETRY_MODE', 'standard')
+MAX_ATTEMPTS = int(os.environ.get('AWS_CLIENT_MAX_ATTEMPTS', 5))
+CONNECT_TIMEOUT = int(os.environ.get('AWS_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = int(os.environ.get('AWS_READ_TIMEOUT', 60))
+
+DEFAULT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    retries={'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS},
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+    tcp_keepalive=True,
+)
+
+
+class ClientPool:
+    """
+    boto3 clients created on first use from one shared session and kept for the life of
+    the container, so warm invocations reuse their connection pools.
+
+    Records how long each client took to build and how long its first API call took
+    (endpoint resolution plus TLS handshake), for cold-start reporting.
+    """
+
+    def __init__(self, session=None, region_name=None, config=DEFAULT_CONFIG):
+        self._session = session
+        self.region_name = region_name
+        self.config = config
+        self.hooks = []
+        self.init_ms = {}
+        self.first_call_ms = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = boto3.session.Session()
+        return self._session
+
+    def client(self, service):
+        """The shared client for `service`, built on first use."""
+        client = self._clients.get(service)
+        if client is not None:
+            return client
+        # boto3 sessions are not thread-safe while creating clients
+        with self._lock:
+            client = self._clients.get(service)
+            if client is None:
+                started = time.perf_counter()
+                client = self.session.client(service, region_name=self.region_name, config=self.config)
+                self.init_ms[service] = (time.perf_counter() - started) * 1000
+                self._time_first_call(service, client)
+                for hook in self.hooks:
+                    hook(service, client)
+                self._clients[service] = client
+                logger.debug(f"Created {service} client in {self.init_ms[service]:.0f}ms")
+        return client
+
+    def lazy(self, service):
+        """A stand-in usable wherever a client is expected; the real client is built on first attribute access."""
+        return LazyClient(self, service)
+
+    def add_hook(self, hook):
+        """hook(service, client) runs for every client created from now on and for those that already exist."""
+        with self._lock:
+            self.hooks.append(hook)
+            existing = list(self._clients.items())
+        for service, client in existing:
+            hook(service, client)
+
+    def created(self):
+        return sorted(self._clients)
+
+    def _time_first_call(self, service, client):
+        def before(context, **kwargs):
+            if service not in self.first_call_ms:
+                context['ops_common_started'] = time.perf_counter()
+
+        def after(context, **kwargs):
+            started = context.get('ops_common_started')
+            if started is not None and service not in self.first_call_ms:
+                self.first_call_ms[service] = (time.perf_counter() - started) * 1000
+
+        client.meta.events.register('before-call', before)
+        client.meta.events.register('after-call', after)
+
+
+class LazyClient:
+    """Proxy for a ClientPool client; `ec2 = CLIENTS.lazy('ec2')` costs nothing until ec2 is used."""
+
+    __slots__ = ('_pool', '_service')
+
+    def __init__(self, pool, service):
+        self._pool = pool
+        self._service = service
+
+    def __getattr__(self, name):
+        return getattr(self._pool.client(self._service), name)
+
+    def __repr__(self):
+        state = 'created' if self._service in self._pool.created() else 'not created'
+        return f"<LazyClient {self._service} ({state})>"
+
+
+def unwrap(client):
+    """The real boto3 client behind a LazyClient (building it if needed)."""
+    if isinstance(client, LazyClient):
+        return client._pool.client(client._service)
+    return client
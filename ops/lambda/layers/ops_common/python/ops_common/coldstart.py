@@ -0,0 +1,56 @@
+import functools
+import logging
+import os
+import time
+
+from ops_common import emf
+
+logger = logging.getLogger()
+
+# Importing this module is the first thing a handler does, so this approximates the start of init
+_LOADED_AT = time.perf_counter()
+
+
+class ColdStart:
+    """
+    Measures a Lambda's init phase: how long the handler module took to import, then, after
+    the first invocation, how long each client took to create and to make its first call.
+    Reported once per container as CloudWatch Embedded Metric Format.
+    """
+
+    def __init__(self, pool, function_name=None):
+        self.pool = pool
+        self.function_name = function_name or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+        self.import_ms = None
+        self.cold = True
+
+    def imported(self):
+        """Call at the end of the handler module's top level."""
+        self.import_ms = (time.perf_counter() - _LOADED_AT) * 1000
+
+    def report(self):
+        function = {'FunctionName': self.function_name}
+        emf.emit({'InitImportDuration': self.import_ms or 0.0}, function,
+                 {'clients': self.pool.created()})
+        for service in self.pool.created():
+            metrics = {'ClientInitDuration': self.pool.init_ms.get(service, 0.0)}
+            if service in self.pool.first_call_ms:
+                metrics['ClientFirstCallDuration'] = self.pool.first_call_ms[service]
+            emf.emit(metrics, dict(function, Service=service))
+        logger.info(f"Cold start: import {self.import_ms or 0.0:.0f}ms, clients "
+                    + ", ".join(f"{s} {self.pool.init_ms[s]:.0f}ms" for s in self.pool.created()))
+
+    def track(self, handler):
+        """Decorator: reports the cold start once, after the container's first invocation."""
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            try:
+                return handler(event, context)
+            finally:
+                if self.cold:
+                    self.cold = False
+                    try:
+                        self.report()
+                    except Exception as e:
+                        logger.warning(f"Cold start report failed: {e}")
+        return wrapper
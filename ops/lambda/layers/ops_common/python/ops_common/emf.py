@@ -0,0 +1,33 @@
+import json
+import os
+import time
+
+# CloudWatch namespace for everything the ops automation publishes
+NAMESPACE = os.environ.get('OPS_METRICS_NAMESPACE', 'OpsAutomation')
+
+
+def emit(metrics, dimensions=None, properties=None, unit='Milliseconds', namespace=NAMESPACE, units=None):
+    """
+    Writes one CloudWatch Embedded Metric Format document to stdout. Lambda ships stdout to
+    CloudWatch Logs, which extracts the metrics without any PutMetricData calls.
+    Plain print, not logging: the Lambda log formatter's prefix would break the JSON.
+
+    A metric value may be a list of up to 100 values; `units` overrides `unit` per metric.
+    """
+    units = units or {}
+    dimensions = dict(dimensions or {})
+    doc = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [sorted(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': units.get(name, unit)} for name in metrics],
+            }],
+        },
+    }
+    doc.update(properties or {})
+    doc.update(dimensions)
+    doc.update(metrics)
+    print(json.dumps(doc, default=str), flush=True)
+    return doc
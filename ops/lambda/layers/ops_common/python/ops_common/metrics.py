@@ -0,0 +1,222 @@
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from ops_common import emf
+
+logger = logging.getLogger()
+
+# emf (Lambda), prometheus (long-running exporter) or none (scripts, benchmarks)
+METRICS_SINK = os.environ.get('OPS_METRICS_SINK')
+
+# Error codes AWS uses to signal "slow down" across EC2, RDS, EKS, ASG and CloudWatch
+THROTTLE_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'SlowDown',
+    'PriorRequestNotComplete',
+}
+
+# Seconds; AWS control-plane calls sit between tens of milliseconds and a few seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# EMF accepts at most 100 values per metric in one document
+EMF_MAX_VALUES = 100
+
+
+def _camel(name):
+    return ''.join(part.capitalize() for part in name.split('_'))
+
+
+class NullSink:
+    def count(self, name, value, labels):
+        pass
+
+    def observe(self, name, seconds, labels):
+        pass
+
+    def flush(self):
+        pass
+
+
+class EmfSink:
+    """
+    Aggregates an invocation's metrics in memory and writes them on flush() as CloudWatch
+    Embedded Metric Format: one document per label set, counters summed, timings as value arrays
+    (so CloudWatch can still compute percentiles).
+    """
+
+    def __init__(self, function_name=None):
+        self.function_name = function_name or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._timings = defaultdict(list)
+
+    def count(self, name, value, labels):
+        with self._lock:
+            self._counters[(tuple(sorted(labels.items())), name)] += value
+
+    def observe(self, name, seconds, labels):
+        with self._lock:
+            self._timings[(tuple(sorted(labels.items())), name)].append(round(seconds * 1000, 3))
+
+    def flush(self):
+        with self._lock:
+            counters, self._counters = self._counters, defaultdict(float)
+            timings, self._timings = self._timings, defaultdict(list)
+
+        docs = defaultdict(lambda: ({}, {}))
+        for (labels, name), value in counters.items():
+            values, units = docs[labels]
+            values[_camel(name)] = value
+            units[_camel(name)] = 'Count'
+        overflow = []
+        for (labels, name), values_ms in timings.items():
+            values, units = docs[labels]
+            values[_camel(name)] = values_ms[:EMF_MAX_VALUES]
+            units[_camel(name)] = 'Milliseconds'
+            for i in range(EMF_MAX_VALUES, len(values_ms), EMF_MAX_VALUES):
+                overflow.append((labels, _camel(name), values_ms[i:i + EMF_MAX_VALUES]))
+
+        for labels, (values, units) in docs.items():
+            emf.emit(values, dict(labels, FunctionName=self.function_name), units=units)
+        for labels, name, chunk in overflow:
+            emf.emit({name: chunk}, dict(labels, FunctionName=self.function_name))
+
+
+class PrometheusSink:
+    """
+    Exposes the same metrics through prometheus_client's default registry, for processes
+    that already run start_http_server. Counters become <name>_total, timings <name>_seconds histograms.
+    """
+
+    def __init__(self, registry=None):
+        import prometheus_client
+        self._prometheus = prometheus_client
+        self._registry = registry or prometheus_client.REGISTRY
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _metric(self, kind, name, labels):
+        key = (kind, name)
+        with self._lock:
+            if key not in self._metrics:
+                if kind == 'counter':
+                    metric = self._prometheus.Counter(name, name.replace('_', ' '), sorted(labels),
+                                                      registry=self._registry)
+                else:
+                    metric = self._prometheus.Histogram(f"{name}_seconds", name.replace('_', ' '), sorted(labels),
+                                                        buckets=LATENCY_BUCKETS, registry=self._registry)
+                self._metrics[key] = metric
+            metric = self._metrics[key]
+        return metric.labels(**labels) if labels else metric
+
+    def count(self, name, value, labels):
+        self._metric('counter', name, labels).inc(value)
+
+    def observe(self, name, seconds, labels):
+        self._metric('histogram', name, labels).observe(seconds)
+
+    def flush(self):
+        pass
+
+
+def sink_from_env(default='none'):
+    kind = METRICS_SINK or default
+    if kind == 'emf':
+        return EmfSink()
+    if kind == 'prometheus':
+        return PrometheusSink()
+    if kind == 'none':
+        return NullSink()
+    raise ValueError(f"Unknown OPS_METRICS_SINK: {kind}")
+
+
+class Metrics:
+    """
+    The one instrumentation surface for the ops automation: AWS call latency, retries and
+    throttles per operation, phase durations and resources processed. Where the numbers
+    go (EMF in Lambda, Prometheus in the exporter) is decided by configure().
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink or NullSink()
+
+    def configure(self, sink):
+        self.sink = sink
+        return self
+
+    def count(self, name, value=1, **labels):
+        self.sink.count(name, value, labels)
+
+    def observe(self, name, seconds, **labels):
+        self.sink.observe(name, seconds, labels)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times a block as ops_phase_duration{phase=name}."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('ops_phase_duration', time.perf_counter() - started, phase=name)
+
+    def processed(self, phase, count):
+        if count:
+            self.count('ops_resources_processed', count, phase=phase)
+
+    def instrument_client(self, service, client):
+        """
+        botocore hooks recording every API call: latency (including botocore's own retries),
+        retry attempts and throttled outcomes. Usable as a ClientPool hook.
+        """
+        def before(context, **kwargs):
+            context['ops_metrics_started'] = time.perf_counter()
+
+        def after(http_response, parsed, model, context, **kwargs):
+            started = context.get('ops_metrics_started')
+            if started is None:
+                return
+            code = (parsed.get('Error') or {}).get('Code')
+            outcome = 'throttled' if code in THROTTLE_CODES else ('error' if code else 'success')
+            labels = {'service': service, 'operation': model.name}
+            self.observe('aws_api_call_duration', time.perf_counter() - started, **labels)
+            self.count('aws_api_calls', 1, outcome=outcome, **labels)
+            retries = (parsed.get('ResponseMetadata') or {}).get('RetryAttempts') or 0
+            if retries:
+                self.count('aws_api_retries', retries, **labels)
+            if outcome == 'throttled':
+                self.count('aws_api_throttles', 1, **labels)
+
+        client.meta.events.register('before-call', before)
+        client.meta.events.register('after-call', after)
+
+    def flush(self):
+        try:
+            self.sink.flush()
+        except Exception as e:
+            logger.warning(f"Metrics flush failed: {e}")
+
+    def track(self, handler):
+        """Decorator: flushes the invocation's metrics when the handler returns or raises."""
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            try:
+                return handler(event, context)
+            finally:
+                self.flush()
+        return wrapper
+
+
+# Process-wide instance; library modules record into it, entry points configure where it goes
+METRICS = Metrics()
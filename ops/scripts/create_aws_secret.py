@@ -1,33 +1,21 @@
-import boto3
-import json
-import base64
-import subprocess
-import os
+import sys
 
+from secret_sync import PAIRS, SecretSync
+
+# Kubernetes is the source of truth here: copy db-secrets (and any other configured pairs)
+# into Secrets Manager, writing a new secret version only when a key actually changed.
+# Use secret_sync.py directly for two-way sync or --watch.
 try:
-    existing_secret = subprocess.check_output(
-        ["kubectl", "get", "secret", "db-secrets", "-n", "devsecops", "-o", "jsonpath={.data}"],
-        stderr=subprocess.DEVNULL
-    ).decode().strip()
-    data = json.loads(existing_secret)
+    plans = SecretSync(PAIRS).sync(direction='k8s-to-sm')
 except Exception as e:
-    print("Failed to get existing secret from k8s:", e)
-    exit(1)
-
-secret_payload = {}
-for k, v in data.items():
-    secret_payload[k] = base64.b64decode(v).decode('utf-8')
+    print("Failed to sync secrets from k8s:", e)
+    sys.exit(1)
 
-sm = boto3.client('secretsmanager', region_name='us-east-1')
-try:
-    sm.create_secret(
-        Name='devsecops/amazon-app/db-secrets',
-        SecretString=json.dumps(secret_payload)
-    )
-    print("✅ Secret devsecops/amazon-app/db-secrets created in AWS Secrets Manager")
-except sm.exceptions.ResourceExistsException:
-    sm.update_secret(
-        SecretId='devsecops/amazon-app/db-secrets',
-        SecretString=json.dumps(secret_payload)
-    )
-    print("✅ Secret devsecops/amazon-app/db-secrets updated in AWS Secrets Manager")
+for plan in plans:
+    if 'k8s' in plan.missing:
+        print(f"❌ Secret {plan.pair.name} not found in namespace {plan.pair.namespace}")
+        sys.exit(1)
+    if plan.to_sm:
+        print(f"✅ Secret {plan.pair.secret_id} updated in AWS Secrets Manager")
+    else:
+        print(f"✅ Secret {plan.pair.secret_id} already matches, no new version written")
@@ -0,0 +1,205 @@
+import base64
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+REGION = os.getenv("AWS_REGION", "us-east-1")
+DB_INSTANCE_ID = os.getenv("DB_INSTANCE_ID", "amazon-db")
+REDIS_GROUP_ID = os.getenv("REDIS_GROUP_ID", "amazon-redis-rep-group")
+MQ_BROKER_NAME = os.getenv("MQ_BROKER_NAME", "amazon-mq")
+APP_SECRET_ID = os.getenv("APP_SECRET_ID", "devsecops/amazon-app/db-secrets")
+K8S_SECRET = os.getenv("K8S_SECRET", "db-secrets")
+K8S_NAMESPACE = os.getenv("K8S_NAMESPACE", "devsecops")
+
+# Successful lookups are reused for this long, so a re-run only repeats the ones that failed
+CACHE_PATH = os.getenv("DISCOVERY_CACHE", os.path.expanduser("~/.cache/amazon-discovery-cache.json"))
+CACHE_TTL = int(os.getenv("DISCOVERY_TTL", 600))
+# Lookups that are always re-read: both are quick, and a copy from before an apply would be diffed
+# against (or fall back to) stale secret values
+UNCACHED = {'app_secret', 'k8s_secret'}
+
+
+class DiscoveryCache:
+    """
+    Short-lived JSON cache of lookup results. It holds passwords and decides which endpoints
+    end up in the app's secrets, so it lives in a per-user directory, is written owner-only
+    without following symlinks, and is only read back if this user owns it and nobody else
+    can write it. Entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entries = self._load() if path else {}
+
+    def _load(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY | os.O_NOFOLLOW)
+        except OSError:
+            return {}
+        with os.fdopen(fd) as f:
+            st = os.fstat(f.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & 0o022:
+                print(f"  ⚠️  Ignoring discovery cache {self.path}: not owned by this user or writable by others")
+                return {}
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+
+    def get(self, name):
+        entry = self.entries.get(name)
+        if entry and time.time() - entry['at'] < self.ttl:
+            return entry['value']
+        return None
+
+    def put(self, name, value):
+        self.entries[name] = {'value': value, 'at': time.time()}
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', mode=0o700, exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+        except OSError as e:
+            print(f"  ⚠️  Not caching discovery results in {self.path}: {e}")
+            return
+        with os.fdopen(fd, 'w') as f:
+            # O_CREAT's mode only applies to new files
+            os.fchmod(f.fileno(), 0o600)
+            json.dump(self.entries, f)
+
+
+class Discovery:
+    """
+    Resolves the infrastructure the app's secrets point at (RDS, ElastiCache, Amazon MQ,
+    Secrets Manager and the current Kubernetes secret) concurrently.
+
+    Each lookup runs on its own thread; a lookup that needs another one's result
+    (the RDS password needs the RDS secret ARN) waits on it through need().
+    """
+
+    def __init__(self, region=REGION, cache=None, session=None):
+        self.region = region
+        self.cache = cache if cache is not None else DiscoveryCache()
+        # Written by older versions; never read back, so do not keep them on disk either
+        for name in UNCACHED:
+            self.cache.entries.pop(name, None)
+        self.session = session or boto3.session.Session(region_name=region)
+        self.lookups = {
+            'rds': self.lookup_rds,
+            'rds_password': self.lookup_rds_password,
+            'redis': self.lookup_redis,
+            'mq': self.lookup_mq,
+            'app_secret': self.lookup_app_secret,
+            'k8s_secret': self.lookup_k8s_secret,
+        }
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._submitting = threading.Lock()
+        self._futures = {}
+
+    def client(self, service):
+        # boto3 sessions are not thread-safe while creating clients
+        with self._lock:
+            if service not in self._clients:
+                self._clients[service] = self.session.client(service)
+            return self._clients[service]
+
+    def need(self, name):
+        """Result of another lookup, waiting for it if it is still running."""
+        # Held while resolve() submits, so every lookup of this run has a future by now
+        with self._submitting:
+            future = self._futures.get(name)
+        if future is not None:
+            return future.result()
+        cached = None if name in UNCACHED else self.cache.get(name)
+        return cached if cached is not None else self.lookups[name]()
+
+    def lookup_rds(self):
+        db = self.client('rds').describe_db_instances(DBInstanceIdentifier=DB_INSTANCE_ID)['DBInstances'][0]
+        return {'endpoint': db['Endpoint']['Address'], 'secret_arn': db['MasterUserSecret']['SecretArn']}
+
+    def lookup_rds_password(self):
+        secret = self.client('secretsmanager').get_secret_value(SecretId=self.need('rds')['secret_arn'])
+        return json.loads(secret['SecretString'])['password']
+
+    def lookup_redis(self):
+        group = self.client('elasticache').describe_replication_groups(ReplicationGroupId=REDIS_GROUP_ID)['ReplicationGroups'][0]
+        return group['NodeGroups'][0]['PrimaryEndpoint']['Address']
+
+    def lookup_mq(self):
+        mq = self.client('mq')
+        broker = next((b for page in mq.get_paginator('list_brokers').paginate()
+                       for b in page['BrokerSummaries'] if b['BrokerName'] == MQ_BROKER_NAME), None)
+        if not broker:
+            raise LookupError(f"MQ Broker {MQ_BROKER_NAME} not found")
+        endpoint_url = mq.describe_broker(BrokerId=broker['BrokerId'])['BrokerInstances'][0]['Endpoints'][0]
+        # remove amqps:// and the port
+        return endpoint_url.replace('amqps://', '').replace(':5671', '')
+
+    def lookup_app_secret(self):
+        """The app's copy of the secret in Secrets Manager (see create_aws_secret.py); {} if there is none."""
+        sm = self.client('secretsmanager')
+        try:
+            return json.loads(sm.get_secret_value(SecretId=APP_SECRET_ID)['SecretString'])
+        except sm.exceptions.ResourceNotFoundException:
+            return {}
+
+    def lookup_k8s_secret(self):
+        """Every key of the existing Kubernetes secret, decoded, from a single kubectl call; {} if it does not exist."""
+        proc = subprocess.run(
+            ["kubectl", "get", "secret", K8S_SECRET, "-n", K8S_NAMESPACE, "-o", "jsonpath={.data}"],
+            capture_output=True
+        )
+        if proc.returncode != 0:
+            # A missing secret is an answer; an unreachable cluster is a failure worth retrying
+            if b'NotFound' in proc.stderr:
+                return {}
+            raise RuntimeError(proc.stderr.decode().strip() or f"kubectl exited with {proc.returncode}")
+        out = proc.stdout.decode().strip()
+        return {k: base64.b64decode(v).decode() for k, v in json.loads(out or '{}').items()}
+
+    def _run(self, name):
+        started = time.time()
+        value = self.lookups[name]()
+        print(f"  ✅ {name} ({time.time() - started:.1f}s)")
+        return value
+
+    def resolve(self, names=None, refresh=False):
+        """
+        Runs the given lookups (all by default) concurrently. Returns (found, failed):
+        values by lookup name, and the exception of every lookup that failed.
+        """
+        names = list(names or self.lookups)
+        found, failed = {}, {}
+        pending = []
+        for name in names:
+            cached = None if refresh or name in UNCACHED else self.cache.get(name)
+            if cached is not None:
+                found[name] = cached
+                print(f"  ♻️  {name} (cached)")
+            else:
+                pending.append(name)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                with self._submitting:
+                    self._futures = {name: pool.submit(self._run, name) for name in pending}
+            for name, future in self._futures.items():
+                error = future.exception()
+                if error is None:
+                    found[name] = future.result()
+                    if name not in UNCACHED:
+                        self.cache.put(name, found[name])
+                else:
+                    failed[name] = error
+                    print(f"  ❌ {name}: {error}")
+            self.cache.save()
+        return found, failed
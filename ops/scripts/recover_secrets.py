@@ -1,87 +1,28 @@
-import boto3
-import json
+import base64
+import os
 import subprocess
+import sys
 import time
-import base64
 
-def get_rds_info():
-    print("🔍 Fetching RDS Info...")
-    rds = boto3.client('rds', region_name='us-east-1')
-    try:
-        response = rds.describe_db_instances(DBInstanceIdentifier='amazon-db')
-        endpoint = response['DBInstances'][0]['Endpoint']['Address']
-        
-        # Get Secret ARN
-        secret_arn = response['DBInstances'][0]['MasterUserSecret']['SecretArn']
-        
-        # Get Password
-        sm = boto3.client('secretsmanager', region_name='us-east-1')
-        secret_val = sm.get_secret_value(SecretId=secret_arn)
-        password = json.loads(secret_val['SecretString'])['password']
-        
-        return endpoint, password
-    except Exception as e:
-        print(f"❌ Failed to get RDS info: {e}")
-        return None, None
+from discovery import Discovery
+from secret_sync import diff
 
-def get_redis_endpoint():
-    print("🔍 Fetching Redis Info...")
-    ec = boto3.client('elasticache', region_name='us-east-1')
-    try:
-        # Correct ID found via CLI
-        response = ec.describe_replication_groups(ReplicationGroupId='amazon-redis-rep-group')
-        endpoint = response['ReplicationGroups'][0]['NodeGroups'][0]['PrimaryEndpoint']['Address']
-        return endpoint
-    except Exception as e:
-        print(f"❌ Failed to get Redis info: {e}")
-        return None
-
-def get_mq_info():
-    print("🔍 Fetching MQ Info...")
-    mq = boto3.client('mq', region_name='us-east-1')
-    try:
-        # List brokers to find ID
-        response = mq.list_brokers()
-        broker = next((b for b in response['BrokerSummaries'] if b['BrokerName'] == 'amazon-mq'), None)
-        if not broker:
-            print("❌ MQ Broker not found")
-            return None, None, None
-            
-        broker_id = broker['BrokerId']
-        
-        # Get Endpoint (AMQPS)
-        b_desc = mq.describe_broker(BrokerId=broker_id)
-        # AMQPS port 5671 found in endpoints usually [0] ssl://...
-        endpoint_url = b_desc['BrokerInstances'][0]['Endpoints'][0] 
-        # remove wss:// or ssl:// and port
-        host = endpoint_url.replace('amqps://', '').replace(':5671', '')
-        
-        # Reset Password since we lost it
-        # Try to fetch existing password from K8s secret first
-        import subprocess
-        try:
-            existing_secret = subprocess.check_output(
-                ["kubectl", "get", "secret", "db-secrets", "-n", "devsecops", "-o", "jsonpath={.data.rabbitmq_password}"],
-                stderr=subprocess.DEVNULL
-            ).decode().strip()
-            if existing_secret:
-                new_password = base64.b64decode(existing_secret).decode()
-                print("✅ Using existing MQ password from Kubernetes.")
-            else:
-                new_password = os.getenv("MQ_PASSWORD", "REPLACE_WITH_REAL_PASSWORD")
-        except:
-            new_password = os.getenv("MQ_PASSWORD", "REPLACE_WITH_REAL_PASSWORD")
-            print(f"⚠️  Using MQ Password from environment or placeholder.")
-        
-        return host, 'admin', new_password
-    except Exception as e:
-        print(f"❌ Failed to get MQ info: {e}")
-        return None, None, None
+def mq_password(existing, app_secret):
+    """
+    Amazon MQ never returns the broker password, so reuse the one the cluster already has,
+    then the Secrets Manager copy, then MQ_PASSWORD.
+    """
+    for source, value in (("Kubernetes", existing.get('rabbitmq_password')),
+                          ("Secrets Manager", app_secret.get('rabbitmq_password'))):
+        if value:
+            print(f"✅ Using existing MQ password from {source}.")
+            return value
+    print(f"⚠️  Using MQ Password from environment or placeholder.")
+    return os.getenv("MQ_PASSWORD", "REPLACE_WITH_REAL_PASSWORD")
 
 def generate_yaml(rds_ep, rds_pw, redis_ep, mq_host, mq_user, mq_pw):
     print("📝 Generating db-secrets.yaml...")
-    import os
-    
+
     # Base64 encode values
     def b64(s):
         return base64.b64encode(s.encode()).decode()
@@ -89,6 +30,7 @@ def generate_yaml(rds_ep, rds_pw, redis_ep, mq_host, mq_user, mq_pw):
     # Connection Strings
     db_url = f"jdbc:mysql://{rds_ep}/amazon_db?useSSL=false&allowPublicKeyRetrieval=true&createDatabaseIfNotExist=true"
     redis_host = redis_ep
+    jwt_secret = os.getenv("JWT_SECRET", "mySuperSecretkeyForJwtTestingPurposesOnly1234567890")
     
     yaml_content = f"""apiVersion: v1
 kind: Secret
@@ -115,22 +57,43 @@ data:
   rabbitmq_password: {b64(mq_pw)}
 
   # JWT
-  jwt_secret: {b64(os.getenv("JWT_SECRET", "mySuperSecretkeyForJwtTestingPurposesOnly1234567890"))}
+  jwt_secret: {b64(jwt_secret)}
 """
     
     with open('ops/k8s/db-secrets.yaml', 'w') as f:
         f.write(yaml_content)
     print("✅ ops/k8s/db-secrets.yaml created.")
+    return {
+        'db_url': db_url, 'db_username': 'admin', 'db_password': rds_pw,
+        'redis_host': redis_host,
+        'rabbitmq_host': mq_host, 'rabbitmq_username': mq_user, 'rabbitmq_password': mq_pw,
+        'jwt_secret': jwt_secret,
+    }
 
 if __name__ == '__main__':
-    rds_ep, rds_pw = get_rds_info()
-    redis_ep = get_redis_endpoint()
-    mq_host, mq_user, mq_pw = get_mq_info()
-    
-    if rds_ep and redis_ep and mq_host:
-        generate_yaml(rds_ep, rds_pw, redis_ep, mq_host, mq_user, mq_pw)
-        print("🚀 Applying to K8s...")
-        subprocess.run(["kubectl", "apply", "-f", "ops/k8s/db-secrets.yaml"], check=True)
-        print("✅ Applied!")
+    # --refresh ignores lookups cached by an earlier (partially failed) run
+    started = time.time()
+    print("🔍 Discovering RDS, Redis, MQ and existing secrets...")
+    found, failed = Discovery().resolve(refresh='--refresh' in sys.argv)
+
+    # The existing secrets only supply fallbacks, so recovery goes ahead without them
+    existing = found.get('k8s_secret', {})
+    app_secret = found.get('app_secret', {})
+    required = [name for name in ('rds', 'rds_password', 'redis', 'mq') if name in failed]
+
+    if not required:
+        print(f"⏱️  Discovery finished in {time.time() - started:.1f}s")
+        data = generate_yaml(found['rds']['endpoint'], found['rds_password'], found['redis'],
+                             found['mq'], 'admin', mq_password(existing, app_secret))
+        # Re-applying identical data would still bump the secret and restart the pods that mount it
+        added, removed, changed = diff(existing, data)
+        if not (added or removed or changed):
+            print("✅ db-secrets already up to date, nothing to apply.")
+        else:
+            print(f"🚀 Applying to K8s ({', '.join(added + removed + changed) or 'new secret'})...")
+            subprocess.run(["kubectl", "apply", "-f", "ops/k8s/db-secrets.yaml"], check=True)
+            print("✅ Applied!")
     else:
-        print("❌ Could not gather all secrets.")
+        print(f"❌ Could not gather all secrets ({', '.join(required)} failed). "
+              f"Re-run to retry only those; the rest are cached for a few minutes.")
+        sys.exit(1)
@@ -0,0 +1,392 @@
+"""
+Keeps Kubernetes secrets and their AWS Secrets Manager copies in sync, writing only
+the keys that actually changed.
+
+    python ops/scripts/secret_sync.py                       # sync every pair once, both ways
+    python ops/scripts/secret_sync.py --direction k8s-to-sm --dry-run
+    python ops/scripts/secret_sync.py --watch               # react to changes until interrupted
+
+Pairs come from SECRET_SYNC_PAIRS (JSON list of {"name", "namespace", "secret_id"}),
+defaulting to db-secrets <-> devsecops/amazon-app/db-secrets.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import queue
+import secrets
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+import boto3
+
+REGION = os.getenv("AWS_REGION", "us-east-1")
+DEFAULT_PAIRS = [{"name": "db-secrets", "namespace": "devsecops", "secret_id": "devsecops/amazon-app/db-secrets"}]
+PAIRS = json.loads(os.getenv("SECRET_SYNC_PAIRS", "") or "null") or DEFAULT_PAIRS
+# HMAC digests of the keys (never values) as of the last sync, to tell which side changed a key
+STATE_PATH = os.getenv("SECRET_SYNC_STATE", os.path.expanduser("~/.cache/amazon-secret-sync.json"))
+# With --watch and no SECRET_SYNC_QUEUE_URL, how often Secrets Manager metadata is checked
+WATCH_INTERVAL = int(os.getenv("SECRET_SYNC_INTERVAL", 60))
+# SQS queue fed by an EventBridge rule on Secrets Manager CloudTrail events
+QUEUE_URL = os.getenv("SECRET_SYNC_QUEUE_URL")
+# Changes arriving this close together are synced once
+DEBOUNCE = float(os.getenv("SECRET_SYNC_DEBOUNCE", 2))
+
+SecretPair = namedtuple('SecretPair', ['name', 'namespace', 'secret_id'])
+# Keys to write to each side (None values delete the key) and the sides that did not exist
+Plan = namedtuple('Plan', ['pair', 'to_k8s', 'to_sm', 'conflicts', 'hashes', 'missing'])
+
+
+def digest(value, key=None):
+    """
+    SHA-256 of a value; an HMAC under `key` for digests that are written down, since a
+    plain hash of a low-entropy value (a username, a default password) gives it away.
+    """
+    if key is None:
+        return hashlib.sha256(value.encode()).hexdigest()
+    return hmac.new(key, value.encode(), hashlib.sha256).hexdigest()
+
+
+def hashes(data, key=None):
+    return {k: digest(v, key) for k, v in data.items()}
+
+
+def diff(old, new):
+    """Per-key content diff of two {key: value} dicts: (added, removed, changed) key lists."""
+    old_h, new_h = hashes(old), hashes(new)
+    added = sorted(new_h.keys() - old_h.keys())
+    removed = sorted(old_h.keys() - new_h.keys())
+    changed = sorted(k for k in old_h.keys() & new_h.keys() if old_h[k] != new_h[k])
+    return added, removed, changed
+
+
+def requested_as(secret_id, value):
+    """
+    True if a BatchGetSecretValue result answers `secret_id`, which may be the secret's name,
+    its ARN, or its partial ARN (the ARN without Secrets Manager's "-XXXXXX" suffix).
+    """
+    arn = value['ARN']
+    return secret_id in (value['Name'], arn) or (arn[-7] == '-' and arn[:-7] == secret_id)
+
+
+def plan_pair(pair, k8s, sm, base, direction='both', prefer='k8s', key=None):
+    """
+    Three-way merge of one pair. `k8s` / `sm` are the current {key: value} on each side
+    (None when that side does not exist yet), `base` the key digests from the last sync,
+    made with the HMAC `key`.
+    A key changed on one side only flows to the other; changed on both it follows `prefer`
+    and is reported as a conflict. A side that does not exist is recreated from the other
+    (a rebuilt cluster must not wipe Secrets Manager), unless `direction` says otherwise.
+    """
+    if k8s is None or sm is None:
+        to_k8s = dict(sm) if k8s is None and sm and direction != 'k8s-to-sm' else {}
+        to_sm = dict(k8s) if sm is None and k8s and direction != 'sm-to-k8s' else {}
+        missing = [side for side, data in (('k8s', k8s), ('sm', sm)) if data is None]
+        return Plan(pair, to_k8s, to_sm, [], hashes(k8s or sm or {}, key), missing)
+
+    k8s_h = hashes(k8s, key)
+    sm_h = hashes(sm, key)
+    to_k8s, to_sm, conflicts = {}, {}, []
+    merged = {}
+
+    for key in sorted(k8s_h.keys() | sm_h.keys() | base.keys()):
+        k, s, b = k8s_h.get(key), sm_h.get(key), base.get(key)
+        if k == s:
+            winner = 'same'
+        elif direction == 'k8s-to-sm':
+            winner = 'k8s'
+        elif direction == 'sm-to-k8s':
+            winner = 'sm'
+        elif s == b:
+            winner = 'k8s'
+        elif k == b:
+            winner = 'sm'
+        else:
+            winner = prefer
+            conflicts.append(key)
+
+        if winner == 'same':
+            merged[key] = k
+        elif winner == 'k8s':
+            to_sm[key] = None if k is None else k8s[key]
+            merged[key] = k
+        else:
+            to_k8s[key] = None if s is None else sm[key]
+            merged[key] = s
+    return Plan(pair, to_k8s, to_sm, conflicts, {k: h for k, h in merged.items() if h is not None}, [])
+
+
+class SecretSync:
+    """Fetches both sides of every pair in bulk, plans per-key changes and writes only those."""
+
+    def __init__(self, pairs, sm=None, state_path=STATE_PATH, dry_run=False):
+        self.pairs = [SecretPair(**p) if isinstance(p, dict) else p for p in pairs]
+        self.sm = sm or boto3.client('secretsmanager', region_name=REGION)
+        self.state_path = state_path
+        self.dry_run = dry_run
+        self.state = self._load_state()
+        self.key = bytes.fromhex(self.state['key'])
+
+    def _read_state(self):
+        if not self.state_path:
+            return {}
+        try:
+            fd = os.open(self.state_path, os.O_RDONLY | os.O_NOFOLLOW)
+        except OSError:
+            return {}
+        with os.fdopen(fd) as f:
+            st = os.fstat(f.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & 0o022:
+                print(f"⚠️  Ignoring sync state {self.state_path}: not owned by this user or writable by others")
+                return {}
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+
+    def _load_state(self):
+        """
+        {"key": HMAC key (hex), "pairs": {"namespace/name": {key: digest}}}. A state file without
+        a key holds plain hashes from an older version; it is dropped and rewritten.
+        """
+        state = self._read_state()
+        if not state.get('key'):
+            state = {'key': secrets.token_hex(32), 'pairs': {}}
+        return state
+
+    def _save_state(self):
+        if self.dry_run or not self.state_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or '.', mode=0o700, exist_ok=True)
+            fd = os.open(self.state_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+        except OSError as e:
+            print(f"⚠️  Not saving sync state to {self.state_path}: {e}")
+            return
+        with os.fdopen(fd, 'w') as f:
+            # O_CREAT's mode only applies to new files
+            os.fchmod(f.fileno(), 0o600)
+            json.dump(self.state, f, indent=2, sort_keys=True)
+
+    # --- Kubernetes side ---
+
+    def fetch_k8s(self, pairs):
+        """{(namespace, name): {key: value} or None}, with one kubectl call per namespace."""
+        found = {}
+        for namespace in sorted({p.namespace for p in pairs}):
+            out = subprocess.check_output(["kubectl", "get", "secrets", "-n", namespace, "-o", "json"])
+            items = {i['metadata']['name']: i for i in json.loads(out)['items']}
+            for p in pairs:
+                if p.namespace == namespace:
+                    item = items.get(p.name)
+                    found[(namespace, p.name)] = None if item is None else {
+                        k: base64.b64decode(v).decode() for k, v in (item.get('data') or {}).items()
+                    }
+        return found
+
+    def write_k8s(self, pair, changes, exists):
+        """Patches only the changed keys (null removes a key), or creates the secret."""
+        data = {k: None if v is None else base64.b64encode(v.encode()).decode() for k, v in changes.items()}
+        # Values go through stdin in both cases: command lines are readable by every user via ps and /proc
+        if exists:
+            subprocess.run(["kubectl", "patch", "secret", pair.name, "-n", pair.namespace, "--type", "merge",
+                            "--patch-file", "/dev/stdin"], input=json.dumps({"data": data}).encode(),
+                           check=True, stdout=subprocess.DEVNULL)
+        else:
+            manifest = {"apiVersion": "v1", "kind": "Secret", "type": "Opaque",
+                        "metadata": {"name": pair.name, "namespace": pair.namespace},
+                        "data": {k: v for k, v in data.items() if v is not None}}
+            subprocess.run(["kubectl", "create", "-f", "-"], input=json.dumps(manifest).encode(),
+                           check=True, stdout=subprocess.DEVNULL)
+
+    # --- Secrets Manager side ---
+
+    def fetch_sm(self, pairs):
+        """
+        {secret_id: {key: value} or None}, 20 secrets per BatchGetSecretValue call. Results
+        carry the secret's Name and ARN, so they are matched back to however it was requested.
+        """
+        ids = sorted({p.secret_id for p in pairs})
+        found = {secret_id: None for secret_id in ids}
+        for i in range(0, len(ids), 20):
+            requested = ids[i:i + 20]
+            kwargs = {'SecretIdList': requested}
+            while True:
+                response = self.sm.batch_get_secret_value(**kwargs)
+                for value in response['SecretValues']:
+                    for secret_id in requested:
+                        if requested_as(secret_id, value):
+                            found[secret_id] = json.loads(value['SecretString'])
+                for error in response.get('Errors', []):
+                    if error['ErrorCode'] != 'ResourceNotFoundException':
+                        raise RuntimeError(f"{error['SecretId']}: {error['ErrorCode']} {error.get('Message', '')}")
+                if not response.get('NextToken'):
+                    break
+                kwargs['NextToken'] = response['NextToken']
+        return found
+
+    def write_sm(self, pair, current, changes):
+        """One new secret version carrying every change, or the secret's creation."""
+        merged = dict(current or {})
+        for k, v in changes.items():
+            if v is None:
+                merged.pop(k, None)
+            else:
+                merged[k] = v
+        if current is None:
+            if pair.secret_id.startswith('arn:'):
+                raise RuntimeError(f"{pair.secret_id} does not exist; a secret can only be created by name")
+            self.sm.create_secret(Name=pair.secret_id, SecretString=json.dumps(merged))
+        else:
+            self.sm.put_secret_value(SecretId=pair.secret_id, SecretString=json.dumps(merged))
+
+    # --- Sync ---
+
+    def sync(self, pairs=None, direction='both', prefer='k8s'):
+        """Syncs the given pairs (all by default). Returns the Plans."""
+        pairs = pairs or self.pairs
+        k8s_side = self.fetch_k8s(pairs)
+        sm_side = self.fetch_sm(pairs)
+
+        plans = []
+        for pair in pairs:
+            k8s = k8s_side[(pair.namespace, pair.name)]
+            sm = sm_side[pair.secret_id]
+            base = self.state['pairs'].get(f"{pair.namespace}/{pair.name}", {})
+            plan = plan_pair(pair, k8s, sm, base, direction, prefer, self.key)
+            plans.append(plan)
+            self._report(plan)
+
+            if self.dry_run:
+                continue
+            if plan.to_sm:
+                self.write_sm(pair, sm, plan.to_sm)
+            if plan.to_k8s:
+                self.write_k8s(pair, plan.to_k8s, k8s is not None)
+            self.state['pairs'][f"{pair.namespace}/{pair.name}"] = plan.hashes
+        self._save_state()
+        return plans
+
+    def _report(self, plan):
+        label = f"{plan.pair.namespace}/{plan.pair.name} <-> {plan.pair.secret_id}"
+        if plan.missing and not plan.to_k8s and not plan.to_sm:
+            print(f"⚠️  {label}: missing in {' and '.join(plan.missing)}, nothing to copy")
+            return
+        if not plan.to_k8s and not plan.to_sm:
+            print(f"✅ {label}: in sync")
+            return
+        prefix = "📝 (dry run) " if self.dry_run else "🔄 "
+        if plan.to_sm:
+            print(f"{prefix}{label}: Secrets Manager <- {', '.join(sorted(plan.to_sm))}")
+        if plan.to_k8s:
+            print(f"{prefix}{label}: Kubernetes <- {', '.join(sorted(plan.to_k8s))}")
+        if plan.conflicts:
+            print(f"⚠️  {label}: changed on both sides: {', '.join(plan.conflicts)}")
+
+    # --- Watch ---
+
+    def _watch_k8s(self, events):
+        """Streams Kubernetes secret changes from a kubectl watch per namespace."""
+        def stream(namespace):
+            names = {p.name for p in self.pairs if p.namespace == namespace}
+            proc = subprocess.Popen(["kubectl", "get", "secrets", "-n", namespace, "--watch-only",
+                                     "--output-watch-events", "-o", "json"], stdout=subprocess.PIPE)
+            decoder, buffer = json.JSONDecoder(), ''
+            for line in iter(proc.stdout.readline, b''):
+                buffer += line.decode()
+                try:
+                    event, end = decoder.raw_decode(buffer.lstrip())
+                except ValueError:
+                    continue
+                buffer = buffer.lstrip()[end:]
+                name = event['object']['metadata']['name']
+                if name in names:
+                    events.put(('k8s', namespace, name))
+            events.put(('exit', namespace, None))
+
+        for namespace in sorted({p.namespace for p in self.pairs}):
+            threading.Thread(target=stream, args=(namespace,), daemon=True).start()
+
+    def _watch_sm(self, events):
+        """
+        Secrets Manager changes: EventBridge events from an SQS queue when one is configured,
+        otherwise a cheap DescribeSecret check of LastChangedDate (no secret values are read).
+        """
+        ids = {p.secret_id for p in self.pairs}
+
+        def from_queue():
+            sqs = boto3.client('sqs', region_name=REGION)
+            while True:
+                messages = sqs.receive_message(QueueUrl=QUEUE_URL, WaitTimeSeconds=20,
+                                               MaxNumberOfMessages=10).get('Messages', [])
+                for message in messages:
+                    detail = json.loads(message['Body']).get('detail', {})
+                    secret = (detail.get('requestParameters') or {}).get('secretId', '')
+                    for secret_id in ids:
+                        if secret == secret_id or secret.split(':secret:')[-1].startswith(secret_id):
+                            events.put(('sm', secret_id, None))
+                    sqs.delete_message(QueueUrl=QUEUE_URL, ReceiptHandle=message['ReceiptHandle'])
+
+        def from_metadata():
+            seen = {}
+            while True:
+                for secret_id in ids:
+                    try:
+                        changed = self.sm.describe_secret(SecretId=secret_id).get('LastChangedDate')
+                    except self.sm.exceptions.ResourceNotFoundException:
+                        changed = None
+                    if secret_id in seen and seen[secret_id] != changed:
+                        events.put(('sm', secret_id, None))
+                    seen[secret_id] = changed
+                time.sleep(WATCH_INTERVAL)
+
+        threading.Thread(target=from_queue if QUEUE_URL else from_metadata, daemon=True).start()
+
+    def watch(self, direction='both', prefer='k8s'):
+        """Syncs once, then re-syncs just the affected pairs whenever either side changes."""
+        self.sync(direction=direction, prefer=prefer)
+        events = queue.Queue()
+        self._watch_k8s(events)
+        self._watch_sm(events)
+        print("👀 Watching for secret changes (Ctrl-C to stop)...")
+
+        while True:
+            batch = [events.get()]
+            # Our own writes and bursts of edits arrive as several events; sync once for all of them
+            deadline = time.time() + DEBOUNCE
+            while time.time() < deadline:
+                try:
+                    batch.append(events.get(timeout=max(0.0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            if any(kind == 'exit' for kind, _, _ in batch):
+                raise RuntimeError("kubectl watch ended")
+            touched = [p for p in self.pairs if any(
+                (kind == 'k8s' and (a, b) == (p.namespace, p.name)) or (kind == 'sm' and a == p.secret_id)
+                for kind, a, b in batch)]
+            if touched:
+                self.sync(touched, direction, prefer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--direction', choices=['both', 'k8s-to-sm', 'sm-to-k8s'], default='both')
+    parser.add_argument('--prefer', choices=['k8s', 'sm'], default='k8s',
+                        help='side that wins a key changed on both sides (or when there is no sync history)')
+    parser.add_argument('--dry-run', action='store_true', help='print what would change without writing')
+    parser.add_argument('--watch', action='store_true', help='keep running and sync on every change')
+    args = parser.parse_args()
+
+    engine = SecretSync(PAIRS, dry_run=args.dry_run)
+    if args.watch:
+        engine.watch(args.direction, args.prefer)
+    else:
+        engine.sync(direction=args.direction, prefer=args.prefer)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,37 @@ variable "lambda_role_name" {
   default = "cost_optimizer_role"
 }
 
+# Extra accounts/regions for the Cost Terminator; empty runs it in this account and region only
+variable "cost_terminator_targets" {
+  type = list(object({
+    account  = optional(string)
+    role_arn = optional(string)
+    regions  = list(string)
+    clusters = optional(list(string))
+  }))
+  default = []
+}
+
+# Role the Cost Terminator assumes in target accounts listed without a role_arn
+variable "fanout_role_name" {
+  default = "cost-terminator"
+}
+
+# How long a dev environment must stay quiet before the idle check stops it
+variable "idle_window_minutes" {
+  default = 120
+}
+
+# cold: stop and scale to zero; warm: also hibernate instances configured for it (node groups scale to zero either way)
+variable "resume_mode" {
+  default = "cold"
+}
+
+# Seconds the Auto-Healer's queue collects alarms before one invocation coalesces them into fleet-wide SSM commands
+variable "auto_healer_batching_window" {
+  default = 30
+}
+
 resource "aws_iam_role" "lambda_exec" {
   name = var.lambda_role_name
 
@@ -29,19 +60,30 @@ resource "aws_iam_policy" "lambda_policy" {
           "ec2:DescribeInstances",
           "ec2:StopInstances",
           "ec2:StartInstances",
+          "ec2:DescribeInstanceStatus",
           "ec2:DescribeVolumes",
           "ec2:DeleteVolume",
+          "ec2:DescribeSnapshots",
+          "ec2:DeleteSnapshot",
+          "ec2:DescribeImages",
+          "ec2:DescribeNetworkInterfaces",
+          "ec2:DeleteNetworkInterface",
           "ec2:DescribeAddresses",
           "ec2:ReleaseAddress",
           "ec2:RevokeSecurityGroupIngress",
+          "ec2:DescribeSecurityGroupRules",
           "rds:DescribeDBInstances",
           "rds:ListTagsForResource",
           "rds:StopDBInstance",
           "rds:StartDBInstance",
+          "tag:GetResources",
           "eks:ListNodegroups",
           "eks:DescribeNodegroup",
           "eks:UpdateNodegroupConfig",
+          "autoscaling:DescribeAutoScalingGroups",
           "ssm:SendCommand",
+          "ssm:ListCommandInvocations",
+          "cloudwatch:GetMetricData",
           "logs:CreateLogGroup",
           "logs:CreateLogStream",
           "logs:PutLogEvents",
@@ -49,6 +91,50 @@ resource "aws_iam_policy" "lambda_policy" {
         ]
         Effect   = "Allow"
         Resource = "*"
+      },
+      {
+        # Node group capacity snapshots written at scale-down and read back at restore
+        Action = [
+          "ssm:GetParameter",
+          "ssm:PutParameter",
+          "ssm:DeleteParameter"
+        ]
+        Effect   = "Allow"
+        Resource = "arn:aws:ssm:*:${data.aws_caller_identity.current.account_id}:parameter/cost-terminator/*"
+      },
+      {
+        # Auto-Healer cooldowns, rate-limit buckets and alert digest
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:PutItem"
+        ]
+        Effect   = "Allow"
+        Resource = aws_dynamodb_table.auto_healer_state.arn
+      },
+      {
+        # Auto-Healer alarm batches
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ]
+        Effect   = "Allow"
+        Resource = aws_sqs_queue.auto_healer_alarms.arn
+      },
+      {
+        # Morning warm-up re-invokes itself to resume from its checkpoint
+        Action   = ["lambda:InvokeFunction"]
+        Effect   = "Allow"
+        Resource = "arn:aws:lambda:${var.region}:${data.aws_caller_identity.current.account_id}:function:cost_terminator"
+      },
+      {
+        # Fan-out into the other dev accounts; each needs fanout_role_name (or its role_arn) trusting lambda_exec
+        Action   = ["sts:AssumeRole"]
+        Effect   = "Allow"
+        Resource = distinct(concat(
+          ["arn:aws:iam::*:role/${var.fanout_role_name}"],
+          [for t in var.cost_terminator_targets : t.role_arn if t.role_arn != null]
+        ))
       }
     ]
   })
@@ -64,6 +150,20 @@ resource "aws_sns_topic" "alerts" {
   name = "auto-healer-alerts"
 }
 
+# Shared code for both Lambdas (lazy boto3 client pool, cold-start metrics)
+resource "archive_file" "ops_common_zip" {
+  type        = "zip"
+  source_dir  = "${path.module}/../../lambda/layers/ops_common"
+  output_path = "${path.module}/ops_common_layer.zip"
+}
+
+resource "aws_lambda_layer_version" "ops_common" {
+  layer_name          = "ops_common"
+  filename            = archive_file.ops_common_zip.output_path
+  source_code_hash    = archive_file.ops_common_zip.output_base64sha256
+  compatible_runtimes = ["python3.9"]
+}
+
 # 1. Cost Terminator Lambda
 resource "archive_file" "cost_optimizer_zip" {
   type        = "zip"
@@ -79,10 +179,17 @@ resource "aws_lambda_function" "cost_optimizer" {
   source_code_hash = archive_file.cost_optimizer_zip.output_base64sha256
   runtime         = "python3.9"
   timeout         = 300
+  layers          = [aws_lambda_layer_version.ops_common.arn]
   
   environment {
     variables = {
-      SNS_TOPIC_ARN = aws_sns_topic.alerts.arn
+      SNS_TOPIC_ARN       = aws_sns_topic.alerts.arn
+      CAPACITY_STORE      = "ssm"
+      CLUSTER_NAME        = var.cluster_name
+      FANOUT_TARGETS      = jsonencode(var.cost_terminator_targets)
+      FANOUT_ROLE_NAME    = var.fanout_role_name
+      IDLE_WINDOW_MINUTES = var.idle_window_minutes
+      RESUME_MODE         = var.resume_mode
     }
   }
 }
@@ -109,7 +216,47 @@ resource "aws_lambda_permission" "allow_eventbridge" {
   source_arn    = aws_cloudwatch_event_rule.nightly_stop.arn
 }
 
+# Stops dev environments as soon as they have been idle for idle_window_minutes;
+# the nightly stop stays as the backstop
+resource "aws_cloudwatch_event_rule" "idle_check" {
+  name                = "idle-check"
+  description         = "Cost Terminator idle detection"
+  schedule_expression = "rate(15 minutes)"
+}
+
+resource "aws_cloudwatch_event_target" "trigger_idle_check" {
+  rule      = aws_cloudwatch_event_rule.idle_check.name
+  target_id = "cost_terminator_idle_check"
+  arn       = aws_lambda_function.cost_optimizer.arn
+  input     = jsonencode({"action": "idle_check"})
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_idle_check" {
+  statement_id  = "AllowExecutionFromEventBridgeIdleCheck"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.cost_optimizer.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.idle_check.arn
+}
+
 # 3. Auto-Healer Lambda
+resource "aws_dynamodb_table" "auto_healer_state" {
+  name         = "auto-healer-state"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "key"
+
+  attribute {
+    name = "key"
+    type = "S"
+  }
+
+  # Hosts that stop alarming age out once their cooldown and escalation window have passed
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
 resource "archive_file" "auto_healer_zip" {
   type        = "zip"
   source_dir  = "${path.module}/../../lambda/auto_healer"
@@ -124,14 +271,76 @@ resource "aws_lambda_function" "auto_healer" {
   source_code_hash = archive_file.auto_healer_zip.output_base64sha256
   runtime         = "python3.9"
   timeout         = 60
+  layers          = [aws_lambda_layer_version.ops_common.arn]
   
   environment {
     variables = {
-      SNS_TOPIC_ARN = aws_sns_topic.alerts.arn
+      SNS_TOPIC_ARN      = aws_sns_topic.alerts.arn
+      HEALER_STATE       = "dynamodb"
+      HEALER_STATE_TABLE = aws_dynamodb_table.auto_healer_state.name
     }
   }
 }
 
+# CloudWatch alarms the Auto-Healer remediates (DiskSpace-* and the like) publish here. The topic
+# feeds a queue rather than the Lambda, so a storm of alarms arrives as one batch per window.
+resource "aws_sns_topic" "auto_healer_alarms" {
+  name = "auto-healer-alarms"
+}
+
+resource "aws_sqs_queue" "auto_healer_alarms_dlq" {
+  name                      = "auto-healer-alarms-dlq"
+  message_retention_seconds = 1209600
+}
+
+resource "aws_sqs_queue" "auto_healer_alarms" {
+  name = "auto-healer-alarms"
+  # Six times the function timeout, so a batch still being remediated is not redelivered
+  visibility_timeout_seconds = 360
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.auto_healer_alarms_dlq.arn
+    maxReceiveCount     = 5
+  })
+}
+
+resource "aws_sqs_queue_policy" "auto_healer_alarms" {
+  queue_url = aws_sqs_queue.auto_healer_alarms.id
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect    = "Allow"
+        Principal = { Service = "sns.amazonaws.com" }
+        Action    = "sqs:SendMessage"
+        Resource  = aws_sqs_queue.auto_healer_alarms.arn
+        Condition = {
+          ArnEquals = { "aws:SourceArn" = aws_sns_topic.auto_healer_alarms.arn }
+        }
+      }
+    ]
+  })
+}
+
+resource "aws_sns_topic_subscription" "auto_healer_alarms" {
+  topic_arn = aws_sns_topic.auto_healer_alarms.arn
+  protocol  = "sqs"
+  endpoint  = aws_sqs_queue.auto_healer_alarms.arn
+}
+
+# Failed records come back through ReportBatchItemFailures, so only they are retried
+resource "aws_lambda_event_source_mapping" "auto_healer_alarms" {
+  event_source_arn                   = aws_sqs_queue.auto_healer_alarms.arn
+  function_name                      = aws_lambda_function.auto_healer.arn
+  batch_size                         = 500
+  maximum_batching_window_in_seconds = var.auto_healer_batching_window
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  # Few concurrent pollers keep a storm in few, large batches
+  scaling_config {
+    maximum_concurrency = 2
+  }
+}
+
 resource "aws_cloudwatch_event_rule" "morning_start" {
   name                = "morning-start"
   description         = "Trigger Cost Terminator at 9 AM CST"
@@ -152,3 +361,46 @@ resource "aws_lambda_permission" "allow_eventbridge_start" {
   principal     = "events.amazonaws.com"
   source_arn    = aws_cloudwatch_event_rule.morning_start.arn
 }
+
+resource "aws_cloudwatch_event_rule" "security_group_audit" {
+  name                = "security-group-audit"
+  description         = "Full security group audit by the Auto-Healer, daily at 6 AM CST"
+  schedule_expression = "cron(0 12 * * ? *)"
+}
+
+resource "aws_cloudwatch_event_target" "trigger_security_group_audit" {
+  rule      = aws_cloudwatch_event_rule.security_group_audit.name
+  target_id = "auto_healer_security_group_audit"
+  arn       = aws_lambda_function.auto_healer.arn
+  input     = jsonencode({"action": "audit_security_groups"})
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_security_group_audit" {
+  statement_id  = "AllowExecutionFromEventBridgeSecurityGroupAudit"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.auto_healer.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.security_group_audit.arn
+}
+
+# Sends the alerts the Auto-Healer held back during a storm, even if no further alarm arrives
+resource "aws_cloudwatch_event_rule" "auto_healer_digest" {
+  name                = "auto-healer-digest"
+  description         = "Flush the Auto-Healer alert digest"
+  schedule_expression = "rate(15 minutes)"
+}
+
+resource "aws_cloudwatch_event_target" "trigger_auto_healer_digest" {
+  rule      = aws_cloudwatch_event_rule.auto_healer_digest.name
+  target_id = "auto_healer_digest"
+  arn       = aws_lambda_function.auto_healer.arn
+  input     = jsonencode({"action": "flush_digest"})
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_auto_healer_digest" {
+  statement_id  = "AllowExecutionFromEventBridgeAutoHealerDigest"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.auto_healer.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.auto_healer_digest.arn
+}
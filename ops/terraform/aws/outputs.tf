@@ -87,3 +87,8 @@ output "cognito_domain" {
   description = "The Hosted UI Domain prefix"
   value       = "${aws_cognito_user_pool_domain.main.domain}.auth.${var.region}.amazoncognito.com"
 }
+
+output "auto_healer_alarm_topic_arn" {
+  description = "SNS topic CloudWatch alarms publish to for Auto-Healer remediation"
+  value       = aws_sns_topic.auto_healer_alarms.arn
+}